@@ -15,22 +15,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 __author__ = "Tobias Kraft"
-__version__ = "1.85"
+__version__ = "2.10"
 
-import requests
 import time
-from requests.auth import HTTPBasicAuth
-from requests.auth import HTTPDigestAuth
+START_TIME = time.perf_counter()
 import os
 import logging
 from logging.handlers import TimedRotatingFileHandler
 from configparser import ConfigParser
 from pathlib import Path
 import sys
-from packaging import version
 import argparse 
 import json
-import subprocess
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+# requests, packaging, subprocess, websocket-client and paho-mqtt are imported where a backend needs them
+IMPORT_TIME = time.perf_counter() - START_TIME
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
@@ -38,367 +40,562 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger()
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-c', '--config', help='Override configuration file path')
-args = parser.parse_args()
-
-ENABLE_LOG_TO_FILE = False
-LOG_BACKUP_COUNT = 30
-
-try:
-    config = ConfigParser()
-
-    baseconfig = str(Path.joinpath(Path(__file__).parent.resolve(), "HoymilesZeroExport_Config.ini"))
-    if args.config:
-        config.read([baseconfig, args.config])
-    else:
-        config.read(baseconfig)
-
-    ENABLE_LOG_TO_FILE = config.getboolean('COMMON', 'ENABLE_LOG_TO_FILE', fallback = ENABLE_LOG_TO_FILE)
-    LOG_BACKUP_COUNT = config.getint('COMMON', 'LOG_BACKUP_COUNT', fallback = LOG_BACKUP_COUNT)
-except Exception as e:
-    logger.info('Error on reading ENABLE_LOG_TO_FILE, set it to DISABLED')
-    ENABLE_LOG_TO_FILE = False
-    if hasattr(e, 'message'):
-        logger.error(e.message)
-    else:
-        logger.error(e)
-
-if ENABLE_LOG_TO_FILE:
-    if not os.path.exists(Path.joinpath(Path(__file__).parent.resolve(), 'log')):
-        os.makedirs(Path.joinpath(Path(__file__).parent.resolve(), 'log'))
-
-    rotating_file_handler = TimedRotatingFileHandler(
-        filename=Path.joinpath(Path.joinpath(Path(__file__).parent.resolve(), 'log'),'log'),
-        when='midnight',
-        interval=2,
-        backupCount=LOG_BACKUP_COUNT)
-
-    formatter = logging.Formatter(
-        '%(asctime)s %(levelname)-8s %(message)s')
-    rotating_file_handler.setFormatter(formatter)
-    logger.addHandler(rotating_file_handler)
-
-logger.info('Log write to file: %s', ENABLE_LOG_TO_FILE)
-logger.info('Python Version: ' + sys.version)
-try:
-    assert sys.version_info >= (3,6)
-except:
-    logger.info('Error: your Python version is too old, this script requires version 3.6 or newer. Please update your Python.')
-    sys.exit()
-
-def CastToInt(pValueToCast):
-    try:
-        result = int(pValueToCast)
-        return result
-    except:
-        result = 0
-    try:
-        result = int(float(pValueToCast))
-        return result
-    except:
-        logger.error("Exception at CastToInt")
-        raise
-
-def SetLimitWithPriority(pLimit):
-    try:
-        if not hasattr(SetLimitWithPriority, "LastLimit"):
-            SetLimitWithPriority.LastLimit = CastToInt(0)
-        if not hasattr(SetLimitWithPriority, "LastLimitAck"):
-            SetLimitWithPriority.LastLimitAck = bool(False)
-
-        if (SetLimitWithPriority.LastLimit == CastToInt(pLimit)) and SetLimitWithPriority.LastLimitAck:
-            logger.info("Inverterlimit was already accepted at %s Watt",CastToInt(pLimit))
+BASE_CONFIG = str(Path.joinpath(Path(__file__).parent.resolve(), "HoymilesZeroExport_Config.ini"))
+
+# one HTTP transport (with its connection pool) shared by all controllers of this process, created on start (HTTP_TRANSPORT in [COMMON])
+HTTP_POOL_SIZE = 20
+HTTP_TRANSPORT = None
+# record or replay of all device responses (--record / --replay), None if not used
+CASSETTE = None
+
+# worker pool shared by all controllers of this process, created on start when the number of controllers is known
+WORKER_POOL = None
+# log the duration of the startup phases (--startup-profile)
+STARTUP_PROFILE = False
+
+# request priorities for the rate limiter of a device
+PRIORITY_CONTROL = 0
+PRIORITY_STATUS = 1
+PRIORITY_INFO = 2
+
+class RateLimiter:
+    # token bucket for one device host, shared by all controllers using this host.
+    # control requests (limits, acks) may use every token and are served first, status requests leave a quarter of the burst to control requests,
+    # informational requests half of it and are dropped instead of waiting longer than 2 seconds
+    RESERVE = [0, 0.25, 0.5]
+    MAX_WAIT = [None, None, 2]
+
+    def __init__(self, host: str, rate: float, burst: int):
+        self.host = host
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        self.waiting = [0, 0, 0]
+        self.granted = [0, 0, 0]
+        self.deferred = [0, 0, 0]
+        self.dropped = [0, 0, 0]
+
+    def GetRequiredTokens(self, pPriority: int):
+        return 1 + min(self.burst - 1, self.burst * self.RESERVE[pPriority])
+
+    def Acquire(self, pPriority: int):
+        with self.condition:
+            Start = time.monotonic()
+            Deferred = False
+            self.waiting[pPriority] += 1
+            try:
+                while True:
+                    Now = time.monotonic()
+                    self.tokens = min(self.burst, self.tokens + (Now - self.updated) * self.rate)
+                    self.updated = Now
+                    RequiredTokens = self.GetRequiredTokens(pPriority)
+                    if self.tokens >= RequiredTokens and not any(self.waiting[:pPriority]):
+                        self.tokens -= 1
+                        self.granted[pPriority] += 1
+                        if Deferred:
+                            self.deferred[pPriority] += 1
+                        return
+                    Deferred = True
+                    WaitTime = max(0.01, (RequiredTokens - self.tokens) / self.rate)
+                    if self.MAX_WAIT[pPriority] is not None and Now - Start + WaitTime > self.MAX_WAIT[pPriority]:
+                        self.dropped[pPriority] += 1
+                        logger.info('%s: request dropped, too many requests (%s)', self.host, self.GetStatistics())
+                        raise Exception(f"Error: request to {self.host} dropped by rate limiter")
+                    self.condition.wait(WaitTime)
+            finally:
+                self.waiting[pPriority] -= 1
+                self.condition.notify_all()
+
+    def GetStatistics(self):
+        return {name: {'granted': self.granted[i], 'deferred': self.deferred[i], 'dropped': self.dropped[i]} for i, name in enumerate(['control', 'status', 'info'])}
+
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+
+def GetRateLimiter(pHost: str, pRate: float, pBurst: int):
+    with RATE_LIMITERS_LOCK:
+        if pHost not in RATE_LIMITERS:
+            RATE_LIMITERS[pHost] = RateLimiter(pHost, pRate, pBurst)
+        return RATE_LIMITERS[pHost]
+
+class WatchdogPhase:
+    # a section of device I/O with a time budget, entered with "with WATCHDOG.Phase(...)"
+    def __init__(self, watchdog, name: str, budget: float):
+        self.watchdog = watchdog
+        self.name = name
+        self.budget = budget
+
+    def __enter__(self):
+        if self.watchdog.phase_budget > 0:
+            with self.watchdog.lock:
+                self.watchdog.phases.setdefault(threading.get_ident(), []).append([self.name, time.monotonic(), self.budget, False])
+        return self
+
+    def __exit__(self, *args):
+        if self.watchdog.phase_budget > 0:
+            with self.watchdog.lock:
+                Phases = self.watchdog.phases.get(threading.get_ident())
+                if Phases:
+                    Phases.pop()
+
+class Watchdog:
+    # supervises the device I/O of all threads: a phase over its budget gets its current call aborted (connection dropped,
+    # script killed) while the process and its warm state stay alive. systemd gets watchdog pings (sd_notify) only while
+    # every controller makes loop progress, so systemd restarts the service only if aborting did not help
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phase_budget = 0
+        # per thread: the stack of phases [name, start, budget, aborted] and the callback aborting the current call
+        self.phases = {}
+        self.aborts = {}
+        # per controller: the latest time of its next loop progress
+        self.progress = {}
+        self.stalled = set()
+        self.notify_socket = os.environ.get('NOTIFY_SOCKET')
+        self.ping_interval = int(os.environ.get('WATCHDOG_USEC', 0)) / 2000000
+        self.thread = None
+
+    def Phase(self, pName: str, pExtraBudget: float = 0):
+        return WatchdogPhase(self, pName, self.phase_budget + pExtraBudget)
+
+    def SetAbort(self, pCallback):
+        # called by the transports and the script powermeter around every call: pCallback aborts it from another thread
+        if self.phase_budget <= 0:
             return
-        if (SetLimitWithPriority.LastLimit == CastToInt(pLimit)) and not SetLimitWithPriority.LastLimitAck:
-            logger.info("Inverterlimit %s Watt was previously not accepted by at least one inverter, trying again...",CastToInt(pLimit))
-
-        logger.info("setting new limit to %s Watt",CastToInt(pLimit))
-        SetLimitWithPriority.LastLimit = CastToInt(pLimit)
-        SetLimitWithPriority.LastLimitAck = True
-        if (CastToInt(pLimit) <= GetMinWattFromAllInverters()):
-            pLimit = 0 # set only minWatt for every inv.
-        RemainingLimit = CastToInt(pLimit)
-        for j in range (1,6):
-            if GetMaxWattFromAllInvertersSamePrio(j) <= 0:
-                continue
-            if RemainingLimit >= GetMaxWattFromAllInvertersSamePrio(j):
-                LimitPrio = GetMaxWattFromAllInvertersSamePrio(j)
+        with self.lock:
+            if pCallback is None:
+                self.aborts.pop(threading.get_ident(), None)
             else:
-                LimitPrio = RemainingLimit
-            RemainingLimit = RemainingLimit - LimitPrio
-
-            for i in range(INVERTER_COUNT):
-                if (not AVAILABLE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]):
-                    continue
-                if HOY_BATTERY_PRIORITY[i] != j:
-                    continue
-                Factor = HOY_MAX_WATT[i] / GetMaxWattFromAllInvertersSamePrio(j)
-                NewLimit = CastToInt(LimitPrio*Factor)
-                NewLimit = ApplyLimitsToSetpointInverter(i, NewLimit)
-                if HOY_COMPENSATE_WATT_FACTOR[i] != 1:
-                    logger.info('Ahoy: Inverter "%s": compensate Limit from %s Watt to %s Watt', NAME[i], CastToInt(NewLimit), CastToInt(NewLimit*HOY_COMPENSATE_WATT_FACTOR[i]))
-                    NewLimit = CastToInt(NewLimit * HOY_COMPENSATE_WATT_FACTOR[i])
-                    NewLimit = ApplyLimitsToMaxInverterLimits(i, NewLimit)
-
-                if (NewLimit == CastToInt(CURRENT_LIMIT[i])) and LASTLIMITACKNOWLEDGED[i]:
-                    continue
-
-                LASTLIMITACKNOWLEDGED[i] = True
+                self.aborts[threading.get_ident()] = pCallback
 
-                DTU.SetLimit(i, NewLimit)
-                if not DTU.WaitForAck(i, SET_LIMIT_TIMEOUT_SECONDS):
-                    SetLimitWithPriority.LastLimitAck = False
-                    LASTLIMITACKNOWLEDGED[i] = False
-    except:
-        logger.error("Exception at SetLimitWithPriority")
-        SetLimitWithPriority.LastLimitAck = False
-        raise
-
-def SetLimitMixedModeWithPriority(pLimit):
-    try:
-        if not hasattr(SetLimitMixedModeWithPriority, "LastLimit"):
-            SetLimitMixedModeWithPriority.LastLimit = CastToInt(0)
-        if not hasattr(SetLimitMixedModeWithPriority, "LastLimitAck"):
-            SetLimitMixedModeWithPriority.LastLimitAck = bool(False)
+    def SetProgress(self, pName: str, pTimeout: float):
+        with self.lock:
+            self.progress[pName] = time.monotonic() + pTimeout
 
-        if (SetLimitMixedModeWithPriority.LastLimit == CastToInt(pLimit)) and SetLimitMixedModeWithPriority.LastLimitAck:
-            logger.info("Inverterlimit was already accepted at %s Watt",CastToInt(pLimit))
+    def Notify(self, pMessage: str):
+        if not self.notify_socket:
             return
-        if (SetLimitMixedModeWithPriority.LastLimit == CastToInt(pLimit)) and not SetLimitMixedModeWithPriority.LastLimitAck:
-            logger.info("Inverterlimit %s Watt was previously not accepted by at least one inverter, trying again...",CastToInt(pLimit))
-
-        logger.info("setting new limit to %s Watt",CastToInt(pLimit))
-        SetLimitMixedModeWithPriority.LastLimit = CastToInt(pLimit)
-        SetLimitMixedModeWithPriority.LastLimitAck = True
-        if (CastToInt(pLimit) <= GetMinWattFromAllInverters()):
-            pLimit = 0 # set only minWatt for every inv.
-        RemainingLimit = CastToInt(pLimit)
-
-        # Handle non-battery inverters first
-        if RemainingLimit >= GetMaxInverterWattFromAllNonBatteryInverters():
-            nonBatteryInvertersLimit = GetMaxInverterWattFromAllNonBatteryInverters()
-        else:
-            nonBatteryInvertersLimit = RemainingLimit
-
-        for i in range(INVERTER_COUNT):
-            if not AVAILABLE[i] or HOY_BATTERY_MODE[i]:
-                continue
+        import socket
+        try:
+            Address = self.notify_socket
+            if Address.startswith('@'):
+                Address = '\0' + Address[1:]
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as Socket:
+                Socket.connect(Address)
+                Socket.sendall(pMessage.encode('utf-8'))
+        except Exception as e:
+            logger.error('Watchdog: sd_notify failed: %s', e)
+
+    def Start(self, pPhaseBudget: int):
+        self.phase_budget = pPhaseBudget
+        self.Notify('READY=1')
+        if (self.phase_budget > 0) or (self.ping_interval > 0):
+            self.thread = threading.Thread(target=self.Supervise, name='watchdog', daemon=True)
+            self.thread.start()
+
+    def Supervise(self):
+        LastPing = 0
+        while True:
+            time.sleep(1)
+            Now = time.monotonic()
+            Aborts = []
+            with self.lock:
+                for ident, Phases in self.phases.items():
+                    for Phase in Phases:
+                        if (not Phase[3]) and (Now - Phase[1] > Phase[2]):
+                            Phase[3] = True
+                            Aborts.append((Phase[0], Now - Phase[1], self.aborts.get(ident)))
+                Stalled = {name for name, deadline in self.progress.items() if Now > deadline}
+            for Name, Duration, Abort in Aborts:
+                if Abort is None:
+                    logger.error('Watchdog: phase "%s" exceeded its budget (%s s), nothing to abort', Name, CastToInt(Duration))
+                    continue
+                logger.error('Watchdog: phase "%s" exceeded its budget (%s s), aborting its current call', Name, CastToInt(Duration))
+                try:
+                    Abort()
+                except Exception as e:
+                    logger.error('Watchdog: abort of phase "%s" failed: %s', Name, e)
+            if Stalled != self.stalled:
+                if Stalled:
+                    logger.error('Watchdog: no loop progress of %s, stopping the systemd watchdog pings', ', '.join(sorted(Stalled)))
+                    self.Notify('STATUS=no loop progress of ' + ', '.join(sorted(Stalled)))
+                else:
+                    self.Notify('STATUS=running')
+                self.stalled = Stalled
+            if (self.ping_interval > 0) and (not Stalled) and (Now - LastPing >= self.ping_interval):
+                self.Notify('WATCHDOG=1')
+                LastPing = Now
+
+WATCHDOG = Watchdog()
+
+def GetWatchedPoolClass(pPoolClass):
+    # urllib3 pool whose connections register with the watchdog while sending a request, so a stalled one can be dropped
+    class WatchedConnection(pPoolClass.ConnectionCls):
+        def request(self, *args, **kwargs):
+            WATCHDOG.SetAbort(self.Abort)
+            return super().request(*args, **kwargs)
+
+        def Abort(self):
+            import socket
+            if self.sock is not None:
+                self.sock.shutdown(socket.SHUT_RDWR)
+
+    class WatchedPool(pPoolClass):
+        ConnectionCls = WatchedConnection
+    return WatchedPool
+
+class RequestsTransport:
+    # HTTP calls of all devices with requests: the response has json(), content, status_code, raise_for_status() and raw (stream)
+    def __init__(self, pool_size: int):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+        self.session = requests.Session()
+        for scheme in ['http://', 'https://']:
+            Adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            Adapter.poolmanager.pool_classes_by_scheme = {'http': GetWatchedPoolClass(HTTPConnectionPool), 'https': GetWatchedPoolClass(HTTPSConnectionPool)}
+            self.session.mount(scheme, Adapter)
+
+    def Get(self, url: str, headers: dict = None, auth = None, timeout = 10, stream: bool = False):
+        try:
+            return self.session.get(url, headers=headers, auth=auth, timeout=timeout, stream=stream)
+        finally:
+            WATCHDOG.SetAbort(None)
 
-            # Calculate proportional limit for non-battery inverters
-            nonBatteryMaxWatt = sum(HOY_MAX_WATT[i] for i in range(INVERTER_COUNT) if not HOY_BATTERY_MODE[i] and AVAILABLE[i])
-            Factor = HOY_MAX_WATT[i] / nonBatteryMaxWatt
-            NewLimit = CastToInt(nonBatteryInvertersLimit * Factor)
+    def Post(self, url: str, json_data: dict = None, data: str = None, headers: dict = None, auth = None, timeout = 10):
+        try:
+            return self.session.post(url, json=json_data, data=data, headers=headers, auth=auth, timeout=timeout)
+        finally:
+            WATCHDOG.SetAbort(None)
 
-            # Apply the calculated limit to the inverter
-            NewLimit = ApplyLimitsToSetpointInverter(i, NewLimit)
-            if HOY_COMPENSATE_WATT_FACTOR[i] != 1:
-                logger.info('Ahoy: Inverter "%s": compensate Limit from %s Watt to %s Watt', NAME[i], CastToInt(NewLimit), CastToInt(NewLimit*HOY_COMPENSATE_WATT_FACTOR[i]))
-                NewLimit = CastToInt(NewLimit * HOY_COMPENSATE_WATT_FACTOR[i])
-                NewLimit = ApplyLimitsToMaxInverterLimits(i, NewLimit)
+    def GetDigestAuth(self, user: str, password: str):
+        from requests.auth import HTTPDigestAuth
+        return HTTPDigestAuth(user, password)
 
-            if (NewLimit == CastToInt(CURRENT_LIMIT[i])) and LASTLIMITACKNOWLEDGED[i]:
-                continue
+class StdlibResponse:
+    def __init__(self, status_code: int, content: bytes, raw = None):
+        self.status_code = status_code
+        self.content = content
+        self.raw = raw
 
-            LASTLIMITACKNOWLEDGED[i] = True
+    def json(self):
+        return json.loads(self.content)
 
-            DTU.SetLimit(i, NewLimit)
-            if not DTU.WaitForAck(i, SET_LIMIT_TIMEOUT_SECONDS):
-                SetLimitMixedModeWithPriority.LastLimitAck = False
-                LASTLIMITACKNOWLEDGED[i] = False
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f'HTTP error {self.status_code}')
 
-        # Adjust RemainingLimit based on what was assigned to non-battery inverters
-        RemainingLimit -= nonBatteryInvertersLimit
+    def __enter__(self):
+        return self
 
-        # Then handle battery inverters based on priority
-        for j in range(1, 6):
-            batteryMaxWattSamePrio = GetMaxWattFromAllBatteryInvertersSamePrio(j)
-            if batteryMaxWattSamePrio <= 0:
-                continue
+    def __exit__(self, *args):
+        if self.raw is not None:
+            self.raw.close()
 
-            if RemainingLimit >= batteryMaxWattSamePrio:
-                LimitPrio = batteryMaxWattSamePrio
-            else:
-                LimitPrio = RemainingLimit
-            RemainingLimit = RemainingLimit - LimitPrio
-
-            for i in range(INVERTER_COUNT):
-                if (not HOY_BATTERY_MODE[i]):
-                    continue
-                if (not AVAILABLE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]):
-                    continue
-                if HOY_BATTERY_PRIORITY[i] != j:
-                    continue
-                Factor = HOY_MAX_WATT[i] / batteryMaxWattSamePrio
-                NewLimit = CastToInt(LimitPrio*Factor)
-                NewLimit = ApplyLimitsToSetpointInverter(i, NewLimit)
-                if HOY_COMPENSATE_WATT_FACTOR[i] != 1:
-                    logger.info('Ahoy: Inverter "%s": compensate Limit from %s Watt to %s Watt', NAME[i], CastToInt(NewLimit), CastToInt(NewLimit*HOY_COMPENSATE_WATT_FACTOR[i]))
-                    NewLimit = CastToInt(NewLimit * HOY_COMPENSATE_WATT_FACTOR[i])
-                    NewLimit = ApplyLimitsToMaxInverterLimits(i, NewLimit)
-
-                if (NewLimit == CastToInt(CURRENT_LIMIT[i])) and LASTLIMITACKNOWLEDGED[i]:
+class StdlibDigestAuth:
+    # keeps the last challenge: only the first request (and requests after the nonce expired) is challenged
+    def __init__(self, user: str, password: str):
+        self.user = user
+        self.password = password
+        self.challenge = None
+        self.nonce_count = 0
+        self.lock = threading.Lock()
+
+    def SetChallenge(self, pHeader: str):
+        import re
+        with self.lock:
+            self.challenge = {key.lower(): value1 or value2 for key, value1, value2 in re.findall(r'(\w+)=(?:"([^"]*)"|([^\s,]*))', pHeader)}
+            self.nonce_count = 0
+
+    def GetHeader(self, pMethod: str, pPath: str):
+        import hashlib
+        with self.lock:
+            if self.challenge is None:
+                return None
+            self.nonce_count = self.nonce_count + 1
+            Challenge = self.challenge
+            NonceCount = f'{self.nonce_count:08x}'
+        Algorithm = Challenge.get('algorithm', 'MD5')
+        HashName = {'MD5': 'md5', 'SHA': 'sha1', 'SHA-256': 'sha256', 'SHA-512': 'sha512'}[Algorithm.upper().replace('-SESS', '')]
+        def Hash(pText):
+            return hashlib.new(HashName, pText.encode('utf-8')).hexdigest()
+        ClientNonce = os.urandom(8).hex()
+        HA1 = Hash(f'{self.user}:{Challenge["realm"]}:{self.password}')
+        if Algorithm.upper().endswith('-SESS'):
+            HA1 = Hash(f'{HA1}:{Challenge["nonce"]}:{ClientNonce}')
+        HA2 = Hash(f'{pMethod}:{pPath}')
+        Header = f'Digest username="{self.user}", realm="{Challenge["realm"]}", nonce="{Challenge["nonce"]}", uri="{pPath}", algorithm={Algorithm}'
+        if 'auth' in Challenge.get('qop', '').split(','):
+            Response = Hash(f'{HA1}:{Challenge["nonce"]}:{NonceCount}:{ClientNonce}:auth:{HA2}')
+            Header = Header + f', qop=auth, nc={NonceCount}, cnonce="{ClientNonce}"'
+        else:
+            Response = Hash(f'{HA1}:{Challenge["nonce"]}:{HA2}')
+        Header = Header + f', response="{Response}"'
+        if 'opaque' in Challenge:
+            Header = Header + f', opaque="{Challenge["opaque"]}"'
+        return Header
+
+class StdlibTransport:
+    # HTTP calls of all devices with http.client only: one persistent connection per host and thread, basic and digest auth.
+    # same interface as RequestsTransport
+    def __init__(self):
+        import http.client
+        from urllib.parse import urlsplit
+        self.client = http.client
+        self.urlsplit = urlsplit
+        self.local = threading.local()
+
+    def GetConnection(self, pScheme: str, pHost: str, pTimeout: float, pPersistent: bool):
+        Connections = self.local.__dict__.setdefault('connections', {})
+        Connection = Connections.get((pScheme, pHost)) if pPersistent else None
+        if Connection is None:
+            Connection = (self.client.HTTPSConnection if pScheme == 'https' else self.client.HTTPConnection)(pHost, timeout=pTimeout)
+            if pPersistent:
+                Connections[(pScheme, pHost)] = Connection
+        Connection.timeout = pTimeout
+        if Connection.sock is not None:
+            Connection.sock.settimeout(pTimeout)
+        return Connection
+
+    def Request(self, pMethod: str, pUrl: str, pBody: bytes, pHeaders: dict, pAuth, pTimeout, pStream: bool = False):
+        Url = self.urlsplit(pUrl)
+        Path = (Url.path or '/') + (f'?{Url.query}' if Url.query else '')
+        Timeout = pTimeout[-1] if isinstance(pTimeout, tuple) else pTimeout
+        for Attempt in range(3):
+            Headers = dict(pHeaders or {})
+            if isinstance(pAuth, tuple):
+                Headers['Authorization'] = 'Basic ' + base64.b64encode(f'{pAuth[0]}:{pAuth[1]}'.encode('utf-8')).decode('ascii')
+            elif pAuth is not None:
+                Authorization = pAuth.GetHeader(pMethod, Path)
+                if Authorization is not None:
+                    Headers['Authorization'] = Authorization
+            Connection = self.GetConnection(Url.scheme, Url.netloc, Timeout, not pStream)
+            Reused = Connection.sock is not None
+            Connection.aborted = False
+            WATCHDOG.SetAbort(lambda: self.Abort(Connection))
+            try:
+                Connection.request(pMethod, Path, body=pBody, headers=Headers)
+                Response = Connection.getresponse()
+            except (self.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the device closed the kept alive connection: send again on a new connection
+                Connection.close()
+                if Reused and (Attempt == 0) and not Connection.aborted:
                     continue
-
-                LASTLIMITACKNOWLEDGED[i] = True
-
-                DTU.SetLimit(i, NewLimit)
-                if not DTU.WaitForAck(i, SET_LIMIT_TIMEOUT_SECONDS):
-                    SetLimitMixedModeWithPriority.LastLimitAck = False
-                    LASTLIMITACKNOWLEDGED[i] = False
-    except:
-        logger.error("Exception at SetLimitMixedModeWithPriority")
-        SetLimitMixedModeWithPriority.LastLimitAck = False
-        raise
-
-def SetLimit(pLimit):
-    try:
-        if GetMixedMode():
-            SetLimitMixedModeWithPriority(CastToInt(pLimit))
-            return
-        if GetBatteryMode() and GetPriorityMode():
-            SetLimitWithPriority(CastToInt(pLimit))
-            return
-
-        if not hasattr(SetLimit, "LastLimit"):
-            SetLimit.LastLimit = CastToInt(0)
-        if not hasattr(SetLimit, "LastLimitAck"):
-            SetLimit.LastLimitAck = bool(False)
-
-        if (SetLimit.LastLimit == CastToInt(pLimit)) and SetLimit.LastLimitAck:
-            logger.info("Inverterlimit was already accepted at %s Watt",CastToInt(pLimit))
-            return
-        if (SetLimit.LastLimit == CastToInt(pLimit)) and not SetLimit.LastLimitAck:
-            logger.info("Inverterlimit %s Watt was previously not accepted by at least one inverter, trying again...",CastToInt(pLimit))
-
-        logger.info("setting new limit to %s Watt",CastToInt(pLimit))
-        SetLimit.LastLimit = CastToInt(pLimit)
-        SetLimit.LastLimitAck = True
-        if (CastToInt(pLimit) <= GetMinWattFromAllInverters()):
-            pLimit = 0 # set only minWatt for every inv.
-        for i in range(INVERTER_COUNT):
-            if (not AVAILABLE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]):
+                raise
+            except Exception:
+                Connection.close()
+                raise
+            finally:
+                WATCHDOG.SetAbort(None)
+            if (Response.status == 401) and isinstance(pAuth, StdlibDigestAuth) and (Attempt < 2) and Response.getheader('WWW-Authenticate', '').lower().startswith('digest'):
+                Response.read()
+                pAuth.SetChallenge(Response.getheader('WWW-Authenticate'))
+                if pStream:
+                    Connection.close()
                 continue
-            Factor = HOY_MAX_WATT[i] / GetMaxWattFromAllInverters()
-            NewLimit = CastToInt(pLimit*Factor)
-            NewLimit = ApplyLimitsToSetpointInverter(i, NewLimit)
-            if HOY_COMPENSATE_WATT_FACTOR[i] != 1:
-                logger.info('Ahoy: Inverter "%s": compensate Limit from %s Watt to %s Watt', NAME[i], CastToInt(NewLimit), CastToInt(NewLimit*HOY_COMPENSATE_WATT_FACTOR[i]))
-                NewLimit = CastToInt(NewLimit * HOY_COMPENSATE_WATT_FACTOR[i])
-                NewLimit = ApplyLimitsToMaxInverterLimits(i, NewLimit)
-
-            if (NewLimit == CastToInt(CURRENT_LIMIT[i])) and LASTLIMITACKNOWLEDGED[i]:
-                continue
-
-            LASTLIMITACKNOWLEDGED[i] = True
+            if pStream:
+                return StdlibResponse(Response.status, None, Response)
+            WATCHDOG.SetAbort(lambda: self.Abort(Connection))
+            try:
+                Content = Response.read()
+            except Exception:
+                Connection.close()
+                raise
+            finally:
+                WATCHDOG.SetAbort(None)
+            if Response.will_close:
+                Connection.close()
+            return StdlibResponse(Response.status, Content)
+        raise Exception('HTTP error: authentication failed')
+
+    def Abort(self, pConnection):
+        import socket
+        pConnection.aborted = True
+        if pConnection.sock is not None:
+            pConnection.sock.shutdown(socket.SHUT_RDWR)
+
+    def Get(self, url: str, headers: dict = None, auth = None, timeout = 10, stream: bool = False):
+        return self.Request('GET', url, None, headers, auth, timeout, stream)
+
+    def Post(self, url: str, json_data: dict = None, data: str = None, headers: dict = None, auth = None, timeout = 10):
+        Headers = dict(headers or {})
+        Body = data
+        if json_data is not None:
+            Body = json.dumps(json_data)
+            Headers['Content-Type'] = 'application/json'
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        return self.Request('POST', url, Body, Headers, auth, timeout)
+
+    def GetDigestAuth(self, user: str, password: str):
+        return StdlibDigestAuth(user, password)
+
+def CreateHttpTransport(pName: str):
+    if pName == 'stdlib':
+        return StdlibTransport()
+    if pName == 'requests':
+        return RequestsTransport(HTTP_POOL_SIZE)
+    raise ValueError(f'unknown HTTP_TRANSPORT "{pName}", use requests or stdlib')
+
+class Cassette:
+    # compressed append-only recording of device responses: one gzip member per run with one JSON line per request
+    # {"t": time, "d": duration, "k": request, "s": status, "c": content} (or "e": error). the replay serves the responses of every request
+    # in the recorded order with their recorded duration (or at once), a request body that was not recorded gets the last response of the URL.
+    # the replay ends when the most frequent request (usually the powermeter) has no response left, the controllers stop then.
+    # a fast replay also skips the regulation delays (Sleep): its clock (Monotonic) advances by them instead
+    def __init__(self, file: str, replay: bool, fast: bool = False):
+        import gzip
+        import zlib
+        from collections import defaultdict
+        self.lock = threading.Lock()
+        self.replay = replay
+        self.fast = fast
+        self.count = 0
+        self.ended = False
+        self.offset = 0.0
+        self.file = None
+        if not replay:
+            self.file = gzip.open(file, 'at', encoding='utf-8')
+            self.flushed = time.monotonic()
+            return
+        self.responses = defaultdict(deque)
+        self.last = {}
+        try:
+            with gzip.open(file, 'rt', encoding='utf-8') as CassetteFile:
+                for Line in CassetteFile:
+                    Entry = json.loads(Line)
+                    self.responses[Entry['k']].append(Entry)
+                    self.last[self.GetUrlKey(Entry['k'])] = Entry
+        except (EOFError, OSError, zlib.error) as e:
+            # recording not closed (e.g. killed): everything up to the last flush is used, a later run appended behind it is lost
+            logger.error('Replay: cassette %s is damaged after %s responses, the rest is not replayed: %s', file, sum(len(entries) for entries in self.responses.values()), e)
+        self.recorded = {key: len(entries) for key, entries in self.responses.items()}
+        self.end_count = max(self.recorded.values(), default=0)
+        logger.info('Replay: %s responses of %s requests from %s', sum(len(entries) for entries in self.responses.values()), len(self.responses), file)
+
+    def Close(self):
+        if self.file is not None:
+            with self.lock:
+                self.file.close()
+
+    def Sleep(self, pSeconds: float):
+        if self.replay and self.fast:
+            with self.lock:
+                self.offset += max(0, pSeconds)
+        else:
+            time.sleep(pSeconds)
 
-            DTU.SetLimit(i, NewLimit)
-            if not DTU.WaitForAck(i, SET_LIMIT_TIMEOUT_SECONDS):
-                SetLimit.LastLimitAck = False
-                LASTLIMITACKNOWLEDGED[i] = False
+    def Monotonic(self):
+        return time.monotonic() + self.offset
 
-    except:
-        logger.error("Exception at SetLimit")
-        SetLimit.LastLimitAck = False
-        raise
+    def GetUrlKey(self, pKey: str):
+        return ' '.join(pKey.split(' ')[:2])
 
-def GetHoymilesAvailable():
-    try:
-        GetHoymilesAvailable = False
-        for i in range(INVERTER_COUNT):
+    def Call(self, pKey: str, pFunction):
+        # pFunction sends the request and returns (status, content)
+        if self.replay:
+            return self.Replay(pKey)
+        Start = time.monotonic()
+        Entry = {'t': round(time.time(), 3), 'k': pKey}
+        try:
+            Status, Content = pFunction()
+            Entry['s'] = Status
             try:
-                WasAvail = AVAILABLE[i]
-                AVAILABLE[i] = DTU.GetAvailable(i)
-                if AVAILABLE[i]:
-                    GetHoymilesAvailable = True
-                    if not WasAvail:
-                        if hasattr(SetLimit, "LastLimit"):
-                            SetLimit.LastLimit = CastToInt(0)
-                        if hasattr(SetLimit, "LastLimitAck"):
-                            SetLimit.LastLimitAck = bool(False)
-                        if hasattr(SetLimitWithPriority, "LastLimit"):
-                            SetLimitWithPriority.LastLimit = CastToInt(0)
-                        if hasattr(SetLimitWithPriority, "LastLimitAck"):
-                            SetLimitWithPriority.LastLimitAck = bool(False)
-                        LASTLIMITACKNOWLEDGED[i] = False
-                        GetHoymilesInfo()
-            except Exception as e:
-                AVAILABLE[i] = False
-                logger.error("Exception at GetHoymilesAvailable, Inverter %s (%s) not reachable", i, NAME[i])
-                if hasattr(e, 'message'):
-                    logger.error(e.message)
-                else:
-                    logger.error(e)
-        return GetHoymilesAvailable
-    except:
-        logger.error('Exception at GetHoymilesAvailable')
-        raise
+                Entry['c'] = Content.decode('utf-8')
+            except UnicodeDecodeError:
+                Entry['b'] = base64.b64encode(Content).decode('ascii')
+            return StdlibResponse(Status, Content)
+        except Exception as e:
+            Entry['e'] = str(e)
+            raise
+        finally:
+            Entry['d'] = round(time.monotonic() - Start, 3)
+            self.Write(Entry)
+
+    def Write(self, pEntry: dict):
+        with self.lock:
+            self.file.write(json.dumps(pEntry, separators=(',', ':')) + '\n')
+            self.count += 1
+            # flush at most every 5 seconds: a crash loses at most these, the compression stays efficient
+            if time.monotonic() - self.flushed >= 5:
+                self.file.flush()
+                self.flushed = time.monotonic()
+
+    def Replay(self, pKey: str):
+        with self.lock:
+            Entries = self.responses.get(pKey)
+            if Entries:
+                Entry = Entries.popleft()
+                self.count += 1
+                if (not Entries) and (self.recorded[pKey] == self.end_count) and not self.ended:
+                    logger.info('Replay: end of the cassette after %s responses', self.count)
+                    self.ended = True
+                if not Entries:
+                    # the last response is served again if the current code sends this request more often
+                    Entries.append(Entry)
+            else:
+                Entry = self.last.get(self.GetUrlKey(pKey))
+        if Entry is None:
+            raise Exception(f'Error: no recorded response for {pKey}')
+        if not self.fast:
+            time.sleep(Entry['d'])
+        if 'e' in Entry:
+            raise Exception(Entry['e'])
+        Content = base64.b64decode(Entry['b']) if 'b' in Entry else Entry['c'].encode('utf-8')
+        return StdlibResponse(Entry['s'], Content)
+
+class CassetteTransport:
+    # HTTP transport recording the responses of another transport into a cassette, or replaying them without any device.
+    # streams (ESPHome SSE) are not recorded, the powermeter falls back to polling on replay
+    def __init__(self, transport, cassette: Cassette):
+        self.transport = transport
+        self.cassette = cassette
+
+    def Get(self, url: str, headers: dict = None, auth = None, timeout = 10, stream: bool = False):
+        if stream:
+            if self.cassette.replay:
+                raise Exception('Error: streams are not replayed')
+            return self.transport.Get(url, headers=headers, auth=auth, timeout=timeout, stream=True)
+        return self.cassette.Call(f'GET {url}', lambda: self.GetResult(self.transport.Get(url, headers=headers, auth=auth, timeout=timeout)))
+
+    def Post(self, url: str, json_data: dict = None, data: str = None, headers: dict = None, auth = None, timeout = 10):
+        Body = json.dumps(json_data, separators=(',', ':')) if json_data is not None else data
+        return self.cassette.Call(f'POST {url} {Body}', lambda: self.GetResult(self.transport.Post(url, json_data=json_data, data=data, headers=headers, auth=auth, timeout=timeout)))
+
+    def GetResult(self, pResponse):
+        return pResponse.status_code, pResponse.content
+
+    def GetDigestAuth(self, user: str, password: str):
+        return self.transport.GetDigestAuth(user, password)
+
+def Sleep(pSeconds: float):
+    # regulation delays, skipped by a fast replay
+    if CASSETTE is not None:
+        CASSETTE.Sleep(pSeconds)
+    else:
+        time.sleep(pSeconds)
 
-def GetHoymilesInfo():
-    try:
-        for i in range(INVERTER_COUNT):
-            try:
-                if not AVAILABLE[i]:
-                    continue
-                DTU.GetInfo(i)
-            except Exception as e:
-                logger.error('Exception at GetHoymilesInfo, Inverter "%s" not reachable', NAME[i])
-                if hasattr(e, 'message'):
-                    logger.error(e.message)
-                else:
-                    logger.error(e)
-    except:
-        logger.error("Exception at GetHoymilesInfo")
-        raise
+def Monotonic():
+    # clock of the regulation, advanced by the skipped delays of a fast replay
+    if CASSETTE is not None:
+        return CASSETTE.Monotonic()
+    return time.monotonic()
 
-def GetHoymilesPanelMinVoltage(pInverterId):
-    if not hasattr(GetHoymilesPanelMinVoltage, "HoymilesPanelMinVoltageArray"):
-        GetHoymilesPanelMinVoltage.HoymilesPanelMinVoltageArray = [] 
+def CastToInt(pValueToCast):
     try:
-        if not AVAILABLE[pInverterId]:
-            return 0
-        
-        HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId].append(DTU.GetPanelMinVoltage(pInverterId))
-        
-        # calculate mean over last x values
-        if len(HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId]) > 5:
-            HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId].pop(0)
-        from statistics import mean
-        
-        logger.info('Average min-panel voltage, inverter "%s": %s Volt',NAME[pInverterId], mean(HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId]))
-        return mean(HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId])
+        result = int(pValueToCast)
+        return result
     except:
-        logger.error("Exception at GetHoymilesPanelMinVoltage, Inverter %s not reachable", pInverterId)
-        raise
-
-def SetHoymilesPowerStatus(pInverterId, pActive):
+        result = 0
     try:
-        if not AVAILABLE[pInverterId]:
-            return
-        if SET_POWERSTATUS_CNT > 0:
-            if not hasattr(SetHoymilesPowerStatus, "LastPowerStatus"):
-                SetHoymilesPowerStatus.LastPowerStatus = []
-                SetHoymilesPowerStatus.LastPowerStatus = [False for i in range(INVERTER_COUNT)]
-            if not hasattr(SetHoymilesPowerStatus, "SamePowerStatusCnt"):
-                SetHoymilesPowerStatus.SamePowerStatusCnt = []
-                SetHoymilesPowerStatus.SamePowerStatusCnt = [0 for i in range(INVERTER_COUNT)]
-            if SetHoymilesPowerStatus.LastPowerStatus[pInverterId] == pActive:
-                SetHoymilesPowerStatus.SamePowerStatusCnt[pInverterId] = SetHoymilesPowerStatus.SamePowerStatusCnt[pInverterId] + 1
-            else:
-                SetHoymilesPowerStatus.LastPowerStatus[pInverterId] = pActive
-                SetHoymilesPowerStatus.SamePowerStatusCnt[pInverterId] = 0
-            if SetHoymilesPowerStatus.SamePowerStatusCnt[pInverterId] > SET_POWERSTATUS_CNT:
-                if pActive:
-                    logger.info("Retry Counter exceeded: Inverter PowerStatus already ON")
-                else:
-                    logger.info("Retry Counter exceeded: Inverter PowerStatus already OFF")
-                return
-        DTU.SetPowerStatus(pInverterId, pActive)
-        time.sleep(SET_POWER_STATUS_DELAY_IN_SECONDS)
+        result = int(float(pValueToCast))
+        return result
     except:
-        logger.error("Exception at SetHoymilesPowerStatus")
+        logger.error("Exception at CastToInt")
         raise
-    
+
 def GetNumberArray(pExcludedPanels):
     lclExcludedPanelsList = pExcludedPanels.split(',')
     result = []
@@ -409,192 +606,14 @@ def GetNumberArray(pExcludedPanels):
         result.append(number)
     return result
 
-def GetCheckBattery():
-    try:
-        result = False
-        for i in range(INVERTER_COUNT):
-            try:
-                if not AVAILABLE[i]:
-                    continue
-                if not HOY_BATTERY_MODE[i]:
-                    result = True
-                    continue
-                minVoltage = GetHoymilesPanelMinVoltage(i)
-
-                if minVoltage <= HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V[i]:
-                    SetHoymilesPowerStatus(i, False)
-                    HOY_BATTERY_GOOD_VOLTAGE[i] = False
-                    HOY_MAX_WATT[i] = HOY_BATTERY_REDUCE_WATT[i]
-
-                elif minVoltage <= HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V[i]:
-                    if HOY_MAX_WATT[i] != HOY_BATTERY_REDUCE_WATT[i]:
-                        HOY_MAX_WATT[i] = HOY_BATTERY_REDUCE_WATT[i]
-                        SetLimit.LastLimit = -1
-
-                elif minVoltage >= HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V[i]:
-                    SetHoymilesPowerStatus(i, True)
-                    if not HOY_BATTERY_GOOD_VOLTAGE[i]:
-                        DTU.SetLimit(i, HOY_MIN_WATT[i])
-                        DTU.WaitForAck(i, SET_LIMIT_TIMEOUT_SECONDS)
-                        SetLimit.LastLimit = -1
-                    HOY_BATTERY_GOOD_VOLTAGE[i] = True
-                    HOY_MAX_WATT[i] = HOY_BATTERY_NORMAL_WATT[i]
-
-                elif minVoltage >= HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V[i]:
-                    if HOY_MAX_WATT[i] != HOY_BATTERY_NORMAL_WATT[i]:
-                        HOY_MAX_WATT[i] = HOY_BATTERY_NORMAL_WATT[i]
-                        SetLimit.LastLimit = -1
-
-                if HOY_BATTERY_GOOD_VOLTAGE[i]:
-                    result = True
-            except:
-                logger.error("Exception at CheckBattery, Inverter %s not reachable", i)
-        return result
-    except:
-        logger.error("Exception at CheckBattery")
-        raise
-
-def GetHoymilesTemperature():
-    try:
-        for i in range(INVERTER_COUNT):
-            try:
-                DTU.GetTemperature(i)
-            except:
-                logger.error("Exception at GetHoymilesTemperature, Inverter %s not reachable", i)
-    except:
-        logger.error("Exception at GetHoymilesTemperature")
-        raise
-
-def GetHoymilesActualPower():
-    try:
-        try:
-            Watts = abs(INTERMEDIATE_POWERMETER.GetPowermeterWatts())
-            logger.info(f"intermediate meter {INTERMEDIATE_POWERMETER.__class__.__name__}: {Watts} Watt")
-            return Watts
-        except Exception as e:
-            logger.error("Exception at GetHoymilesActualPower")
-            if hasattr(e, 'message'):
-                logger.error(e.message)
-            else:
-                logger.error(e)
-            logger.error("try reading actual power from DTU:")
-            Watts = DTU.GetPowermeterWatts()
-            logger.info(f"intermediate meter {DTU.__class__.__name__}: {Watts} Watt")
-    except:
-        logger.error("Exception at GetHoymilesActualPower")
-        if SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR:
-            SetLimit(0)
-        raise
-
-def GetPowermeterWatts():
-    try:
-        Watts = POWERMETER.GetPowermeterWatts()
-        logger.info(f"powermeter {POWERMETER.__class__.__name__}: {Watts} Watt")
-        return Watts
-    except:
-        logger.error("Exception at GetPowermeterWatts")
-        if SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR:
-            SetLimit(0)        
-        raise
-
-def CutLimitToProduction(pSetpoint):
-    if pSetpoint != GetMaxWattFromAllInverters():
-        ActualPower = GetHoymilesActualPower()
-        # prevent the setpoint from running away...
-        if pSetpoint > ActualPower + (GetMaxWattFromAllInverters() * MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER / 100):
-            pSetpoint = CastToInt(ActualPower + (GetMaxWattFromAllInverters() * MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER / 100))
-            logger.info('Cut limit to %s Watt, limit was higher than %s percent of live-production', CastToInt(pSetpoint), MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER)
-    return CastToInt(pSetpoint)
-
-def ApplyLimitsToSetpoint(pSetpoint):
-    if pSetpoint > GetMaxWattFromAllInverters():
-        pSetpoint = GetMaxWattFromAllInverters()
-    if pSetpoint < GetMinWattFromAllInverters():
-        pSetpoint = GetMinWattFromAllInverters()
-    return pSetpoint
-
-def ApplyLimitsToSetpointInverter(pInverter, pSetpoint):
-    if pSetpoint > HOY_MAX_WATT[pInverter]:
-        pSetpoint = HOY_MAX_WATT[pInverter]
-    if pSetpoint < HOY_MIN_WATT[pInverter]:
-        pSetpoint = HOY_MIN_WATT[pInverter]
-    return pSetpoint
-
-def ApplyLimitsToMaxInverterLimits(pInverter, pSetpoint):
-    if pSetpoint > HOY_INVERTER_WATT[pInverter]:
-        pSetpoint = HOY_INVERTER_WATT[pInverter]
-    if pSetpoint < HOY_MIN_WATT[pInverter]:
-        pSetpoint = HOY_MIN_WATT[pInverter]
-    return pSetpoint
-
-# Max possible Watts, can be reduced on battery mode
-def GetMaxWattFromAllInverters():
-    maxWatt = 0
-    for i in range(INVERTER_COUNT):
-        if (not AVAILABLE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]):
-            continue
-        maxWatt = maxWatt + HOY_MAX_WATT[i]
-    return maxWatt
-
-# Max possible Watts, can be reduced on battery mode
-def GetMaxWattFromAllInvertersSamePrio(pPriority):
-    maxWatt = 0
-    for i in range(INVERTER_COUNT):
-        if (not AVAILABLE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]):
-            continue
-        if HOY_BATTERY_PRIORITY[i] == pPriority:
-            maxWatt = maxWatt + HOY_MAX_WATT[i]
-    return maxWatt
-
-def GetMaxWattFromAllBatteryInvertersSamePrio(pPriority):
-    return sum(
-        HOY_MAX_WATT[i] for i in range(INVERTER_COUNT)
-        if AVAILABLE[i] and HOY_BATTERY_GOOD_VOLTAGE[i] and HOY_BATTERY_MODE[i] and HOY_BATTERY_PRIORITY[i] == pPriority
-    )
-
-# Max possible Watts (physically) - Inverter Specification!
-def GetMaxInverterWattFromAllInverters():
-    maxWatt = 0
-    for i in range(INVERTER_COUNT):
-        if (not AVAILABLE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]):
-            continue
-        maxWatt = maxWatt + HOY_INVERTER_WATT[i]
-    return maxWatt
-
-def GetMaxInverterWattFromAllNonBatteryInverters():
-    return sum(
-        HOY_INVERTER_WATT[i] for i in range(INVERTER_COUNT)
-        if AVAILABLE[i] and not HOY_BATTERY_MODE[i] and HOY_BATTERY_GOOD_VOLTAGE[i]
-    )
-
-def GetMinWattFromAllInverters():
-    minWatt = 0
-    for i in range(INVERTER_COUNT):
-        if (not AVAILABLE[i]) or (not HOY_BATTERY_GOOD_VOLTAGE[i]):
-            continue
-        minWatt = minWatt + HOY_MIN_WATT[i]
-    return minWatt
-
-def GetMixedMode():
-    #if battery mode and custom priority use SetLimitWithPriority
-    for i in range(INVERTER_COUNT):
-        for j in range(INVERTER_COUNT):
-            if (HOY_BATTERY_MODE[i] != HOY_BATTERY_MODE[j]):
-                return True
-    return False
-
-def GetBatteryMode():
-    for i in range(INVERTER_COUNT):
-        if HOY_BATTERY_MODE[i]:
-            return True
-    return False
-
-def GetPriorityMode():
-    for i in range(INVERTER_COUNT):
-        for j in range(INVERTER_COUNT):
-            if HOY_BATTERY_PRIORITY[i] != HOY_BATTERY_PRIORITY[j]:
-                return True
-    return False
+def WriteFileAtomic(pFile: Path, pText: str):
+    # write to a temporary file and rename it: a crash never leaves a half written file
+    TempFile = pFile.with_suffix('.tmp')
+    with open(TempFile, 'w') as f:
+        f.write(pText)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(TempFile, pFile)
 
 class Powermeter:
     def GetPowermeterWatts(self) -> int:
@@ -612,7 +631,7 @@ class Tasmota(Powermeter):
 
     def GetJson(self, path):
         url = f'http://{self.ip}{path}'
-        return requests.get(url, timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, timeout=10).json()
 
     def GetPowermeterWatts(self):
         ParsedData = self.GetJson('/cm?cmnd=status%2010')
@@ -624,70 +643,278 @@ class Tasmota(Powermeter):
             return CastToInt(input - ouput)
 
 class Shelly(Powermeter):
+    # polls of the full status and of the chosen endpoint after probing: the saved milliseconds are the difference of their medians
+    TIMING_COUNT = 5
+
     def __init__(self, ip: str, user: str, password: str):
         self.ip = ip
         self.user = user
         self.password = password
+        # one digest auth object per device: it keeps the last nonce, so only the first RPC call is challenged
+        self.rpc_auth = HTTP_TRANSPORT.GetDigestAuth(self.user, self.password)
+        self.generation = None
+        self.endpoint = None
 
-    def GetJson(self, path):
+    def GetResponse(self, path):
         url = f'http://{self.ip}{path}'
         headers = {"content-type": "application/json"}
-        return requests.get(url, headers=headers, auth=(self.user, self.password), timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, headers=headers, auth=(self.user, self.password), timeout=10)
 
-    def GetRpcJson(self, path):
+    def GetRpcResponse(self, path):
         url = f'http://{self.ip}/rpc{path}'
         headers = {"content-type": "application/json"}
-        return requests.get(url, headers=headers, auth=HTTPDigestAuth(self.user, self.password), timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, headers=headers, auth=self.rpc_auth, timeout=10)
 
-    def GetPowermeterWatts(self) -> int:
+    def GetJson(self, path):
+        return self.GetResponse(path).json()
+
+    def GetRpcJson(self, path):
+        return self.GetRpcResponse(path).json()
+
+    def GetEndpointData(self, pEndpoint):
+        rpc, paths, parse = pEndpoint
+        Bytes = 0
+        Start = time.perf_counter()
+        ParsedData = []
+        for path in paths:
+            response = self.GetRpcResponse(path) if rpc else self.GetResponse(path)
+            Bytes = Bytes + len(response.content)
+            ParsedData.append(response.json())
+        return ParsedData, Bytes, (time.perf_counter() - Start) * 1000
+
+    def GetEndpoints(self, pStatus):
+        # list of (rpc, paths, parse) candidates for self.generation, the first one reads the full status document
         raise NotImplementedError()
 
-class Shelly1PM(Shelly):
-    def GetPowermeterWatts(self):
-        return CastToInt(self.GetJson('/status')['meters'][0]['power'])
+    def Probe(self):
+        try:
+            ParsedData = HTTP_TRANSPORT.Get(f'http://{self.ip}/shelly', timeout=10).json()
+            self.generation = CastToInt(ParsedData.get('gen', 1))
+            if self.generation >= 2 and not ParsedData.get('auth_en', True):
+                self.rpc_auth = None
+        except Exception as e:
+            logger.error('Shelly: probing generation failed, assuming generation 1: %s', e)
+            self.generation = 1
+        if self.generation >= 2:
+            FullEndpoint = (True, ['/Shelly.GetStatus'], None)
+        else:
+            FullEndpoint = (False, ['/status'], None)
+        Status, FullBytes = self.GetEndpointData(FullEndpoint)[:2]
+        Endpoints = self.GetEndpoints(Status[0])
+        self.endpoint = Endpoints[0]
+        Bytes = FullBytes
+        for Endpoint in Endpoints[1:]:
+            try:
+                ParsedData, EndpointBytes = self.GetEndpointData(Endpoint)[:2]
+                Endpoint[2](ParsedData)
+            except Exception as e:
+                logger.info('Shelly: endpoint %s not supported: %s', Endpoint[1], e)
+                continue
+            # fewer requests first (every request costs a round trip on the ESP and several requests read the phases at different times),
+            # then the payload size: the duration of a single request is too noisy to choose the endpoint for the whole run
+            if (len(Endpoint[1]), EndpointBytes) < (len(self.endpoint[1]), Bytes):
+                self.endpoint, Bytes = Endpoint, EndpointBytes
+        SavedMs = 0
+        if self.endpoint[1] != FullEndpoint[1]:
+            FullDurations = []
+            Durations = []
+            for i in range(self.TIMING_COUNT):
+                FullDurations.append(self.GetEndpointData(FullEndpoint)[2])
+                Durations.append(self.GetEndpointData(self.endpoint)[2])
+            SavedMs = sorted(FullDurations)[self.TIMING_COUNT // 2] - sorted(Durations)[self.TIMING_COUNT // 2]
+        logger.info('Shelly: generation %s, reading %s: %s bytes per poll, saved %s bytes / %s ms per poll compared to the full status',
+            self.generation, ', '.join(self.endpoint[1]), Bytes, FullBytes - Bytes, round(SavedMs))
 
-class ShellyPlus1PM(Shelly):
     def GetPowermeterWatts(self):
-        return CastToInt(self.GetRpcJson('/Switch.GetStatus?id=0')['apower'])
+        if self.endpoint is None:
+            self.Probe()
+        try:
+            ParsedData = self.GetEndpointData(self.endpoint)[0]
+            return self.endpoint[2](ParsedData)
+        except:
+            # e.g. firmware update: probe again on the next poll
+            self.endpoint = None
+            raise
+
+class Shelly1PM(Shelly):
+    def GetEndpoints(self, pStatus):
+        if self.generation >= 2:
+            return [(True, ['/Shelly.GetStatus'], lambda data: CastToInt(data[0]['switch:0']['apower'])),
+                    (True, ['/Switch.GetStatus?id=0'], lambda data: CastToInt(data[0]['apower']))]
+        return [(False, ['/status'], lambda data: CastToInt(data[0]['meters'][0]['power'])),
+                (False, ['/meter/0'], lambda data: CastToInt(data[0]['power']))]
+
+class ShellyPlus1PM(Shelly1PM):
+    pass
 
 class ShellyEM(Shelly):
-    def GetPowermeterWatts(self):
-        return sum(CastToInt(emeter['power']) for emeter in self.GetJson('/status')['emeters'])
+    def GetEndpoints(self, pStatus):
+        if self.generation >= 2:
+            EMeters = [key for key in pStatus if key.startswith('em1:')]
+            return [(True, ['/Shelly.GetStatus'], lambda data: sum(CastToInt(data[0][key]['act_power']) for key in EMeters)),
+                    (True, [f'/EM1.GetStatus?id={key[4:]}' for key in EMeters], lambda data: sum(CastToInt(emeter['act_power']) for emeter in data))]
+        return [(False, ['/status'], lambda data: sum(CastToInt(emeter['power']) for emeter in data[0]['emeters'])),
+                (False, [f'/emeter/{i}' for i in range(len(pStatus['emeters']))], lambda data: sum(CastToInt(emeter['power']) for emeter in data))]
 
 class Shelly3EM(Shelly):
-    def GetPowermeterWatts(self):
-        return CastToInt(self.GetJson('/status')['total_power'])
+    def GetEndpoints(self, pStatus):
+        if self.generation >= 2:
+            return [(True, ['/Shelly.GetStatus'], lambda data: CastToInt(data[0]['em:0']['total_act_power'])),
+                    (True, ['/EM.GetStatus?id=0'], lambda data: CastToInt(data[0]['total_act_power']))]
+        return [(False, ['/status'], lambda data: CastToInt(data[0]['total_power'])),
+                (False, [f'/emeter/{i}' for i in range(len(pStatus['emeters']))], lambda data: sum(CastToInt(emeter['power']) for emeter in data))]
 
-class Shelly3EMPro(Shelly):
-    def GetPowermeterWatts(self):
-        return CastToInt(self.GetRpcJson('/EM.GetStatus?id=0')['total_act_power'])
+class Shelly3EMPro(Shelly3EM):
+    pass
 
 class ESPHome(Powermeter):
-    def __init__(self, ip: str, port: str, domain: str, id: str):
+    def __init__(self, ip: str, port: str, domain: str, id: str, use_sse: bool = False, sse_max_age: int = 30):
         self.ip = ip
         self.port = port
         self.domain = domain
         self.id = id
+        self.use_sse = use_sse
+        self.sse_max_age = sse_max_age
+        self.sse_thread = None
+        self.values = {}
+        self.values_lock = threading.Lock()
 
     def GetJson(self, path):
         url = f'http://{self.ip}:{self.port}{path}'
-        return requests.get(url, timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, timeout=10).json()
+
+    def SetValue(self, entity, value):
+        with self.values_lock:
+            self.values[entity] = (value, time.monotonic())
+
+    def ParseEvent(self, pEvent, pData):
+        if pEvent != 'state':
+            return
+        ParsedData = json.loads(pData)
+        if 'value' in ParsedData:
+            self.SetValue(ParsedData['id'], ParsedData['value'])
+
+    def SseLoop(self):
+        ReconnectDelay = 1
+        while True:
+            try:
+                with HTTP_TRANSPORT.Get(f'http://{self.ip}:{self.port}/events', stream=True, timeout=(10, 60)) as response:
+                    response.raise_for_status()
+                    logger.info('ESPHome: connected to event stream of %s', self.ip)
+                    ReconnectDelay = 1
+                    Buffer = b''
+                    Event = ''
+                    Data = []
+                    while True:
+                        # read1 (urllib3 >= 2.2.0) returns whatever already arrived, so every event is handled as soon as it is received
+                        Chunk = response.raw.read1(1024)
+                        if not Chunk:
+                            raise Exception("Error: event stream closed")
+                        Buffer = Buffer + Chunk
+                        Lines = Buffer.split(b'\n')
+                        Buffer = Lines.pop()
+                        for Line in Lines:
+                            Line = Line.rstrip(b'\r').decode('utf-8')
+                            if Line == '':
+                                if Data:
+                                    self.ParseEvent(Event, '\n'.join(Data))
+                                Event = ''
+                                Data = []
+                            elif Line.startswith('event:'):
+                                Event = Line[6:].strip()
+                            elif Line.startswith('data:'):
+                                Data.append(Line[5:].strip())
+            except Exception as e:
+                logger.error('ESPHome: event stream error, reconnect in %s seconds: %s', ReconnectDelay, e)
+            time.sleep(ReconnectDelay)
+            ReconnectDelay = min(ReconnectDelay * 2, 60)
 
     def GetPowermeterWatts(self):
+        if self.use_sse:
+            if self.sse_thread is None:
+                self.sse_thread = threading.Thread(target=self.SseLoop, name=f'ESPHome {self.ip}', daemon=True)
+                self.sse_thread.start()
+            with self.values_lock:
+                Value = self.values.get(f'{self.domain}-{self.id}')
+            if Value is not None and time.monotonic() - Value[1] <= self.sse_max_age:
+                return CastToInt(Value[0])
         ParsedData = self.GetJson(f'/{self.domain}/{self.id}')
+        if self.use_sse:
+            # no event within sse_max_age (stream not connected yet or broken): refresh the value once via REST
+            self.SetValue(f'{self.domain}-{self.id}', ParsedData['value'])
         return CastToInt(ParsedData['value'])
 
 class Shrdzm(Powermeter):
-    def __init__(self, ip: str, user: str, password: str):
+    def __init__(self, ip: str, user: str, password: str, use_udp: bool = False, udp_port: int = 9522, udp_max_age: int = 10):
         self.ip = ip
         self.user = user
         self.password = password
+        self.use_udp = use_udp
+        self.udp_port = udp_port
+        self.udp_max_age = udp_max_age
+        self.udp_thread = None
+        # latest reading (watts, monotonic time) received via UDP, replaced as a whole
+        self.udp_value = None
 
     def GetJson(self, path):
         url = f'http://{self.ip}{path}'
-        return requests.get(url, timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, timeout=10).json()
+
+    def GetObisValues(self, pDatagram: bytes):
+        # JSON (SHRDZM: {"data": {"1.7.0": ...}} or flat) or key/value text (1.7.0=123, 1-0:1.7.0*255(0.123*kW)): OBIS code -> watts
+        import re
+        Text = pDatagram.decode('utf-8', errors='ignore')
+        try:
+            ParsedData = json.loads(Text)
+            if isinstance(ParsedData.get('data'), dict):
+                ParsedData = ParsedData['data']
+            Text = '\n'.join(f'{key}={value}' for key, value in ParsedData.items() if isinstance(value, (str, int, float)))
+        except (ValueError, AttributeError):
+            pass
+        Values = {}
+        for obis, value, unit in re.findall(r'(?:\d+-\d+:)?(\d+\.\d+\.\d+)(?:\*\d+)?"?\s*[=(:]\s*"?(-?[\d.]+)(?:\s*\*?\s*(kW|W))?', Text):
+            Values[obis] = float(value) * (1000 if unit == 'kW' else 1)
+        return Values
+
+    def GetObisWatts(self, pValues: dict):
+        # import minus export, or the net power 16.7.0 of meters that only send this one
+        if '1.7.0' in pValues:
+            return pValues['1.7.0'] - pValues.get('2.7.0', 0)
+        return pValues.get('16.7.0')
+
+    def UdpLoop(self):
+        import socket
+        Host = self.ip.split(':')[0]
+        # one socket and one receive buffer for the lifetime of the process
+        Buffer = bytearray(2048)
+        while True:
+            try:
+                # the sender address is compared with the IP, a hostname is resolved once per (re)start of the listener
+                HostIp = socket.gethostbyname(Host)
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as Socket:
+                    Socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    Socket.bind(('', self.udp_port))
+                    logger.info('SHRDZM: listening for UDP readings of %s on port %s', Host, self.udp_port)
+                    while True:
+                        Size, Address = Socket.recvfrom_into(Buffer)
+                        if Address[0] != HostIp:
+                            continue
+                        Watts = self.GetObisWatts(self.GetObisValues(bytes(Buffer[:Size])))
+                        if Watts is not None:
+                            self.udp_value = (Watts, time.monotonic())
+            except Exception as e:
+                logger.error('SHRDZM: UDP listener error, restart in 10 seconds: %s', e)
+            time.sleep(10)
 
     def GetPowermeterWatts(self):
+        if self.use_udp:
+            if self.udp_thread is None:
+                self.udp_thread = threading.Thread(target=self.UdpLoop, name=f'SHRDZM {self.ip}', daemon=True)
+                self.udp_thread.start()
+            Value = self.udp_value
+            if Value is not None and time.monotonic() - Value[1] <= self.udp_max_age:
+                return CastToInt(Value[0])
+        # no datagram within udp_max_age (or UDP disabled): poll the last data via HTTP
         ParsedData = self.GetJson(f'/getLastData?user={self.user}&password={self.password}')
         return CastToInt(CastToInt(ParsedData['1.7.0']) - CastToInt(ParsedData['2.7.0']))
 
@@ -699,7 +926,7 @@ class Emlog(Powermeter):
 
     def GetJson(self, path):
         url = f'http://{self.ip}{path}'
-        return requests.get(url, timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, timeout=10).json()
 
     def GetPowermeterWatts(self):
         ParsedData = self.GetJson(f'/pages/getinformation.php?heute&meterindex={self.meterindex}')
@@ -721,7 +948,7 @@ class IoBroker(Powermeter):
 
     def GetJson(self, path):
         url = f'http://{self.ip}:{self.port}{path}'
-        return requests.get(url, timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, timeout=10).json()
 
     def GetPowermeterWatts(self):
         if not self.power_calculate:
@@ -739,7 +966,7 @@ class IoBroker(Powermeter):
             return CastToInt(input - output)
 
 class HomeAssistant(Powermeter):
-    def __init__(self, ip: str, port: str, access_token: str, current_power_entity: str, power_calculate: bool, power_input_alias: str, power_output_alias: str):
+    def __init__(self, ip: str, port: str, access_token: str, current_power_entity: str, power_calculate: bool, power_input_alias: str, power_output_alias: str, use_websocket: bool = False, websocket_max_age: int = 30):
         self.ip = ip
         self.port = port
         self.access_token = access_token
@@ -747,21 +974,87 @@ class HomeAssistant(Powermeter):
         self.power_calculate = power_calculate
         self.power_input_alias = power_input_alias
         self.power_output_alias = power_output_alias
+        self.use_websocket = use_websocket
+        self.websocket_max_age = websocket_max_age
+        self.websocket_thread = None
+        self.states = {}
+        self.states_lock = threading.Lock()
 
     def GetJson(self, path):
         url = f"http://{self.ip}:{self.port}{path}"
         headers = {"Authorization": "Bearer " + self.access_token, "content-type": "application/json"}
-        return requests.get(url, headers=headers, timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, headers=headers, timeout=10).json()
+
+    def GetEntities(self):
+        if not self.power_calculate:
+            return [self.current_power_entity]
+        return [self.power_input_alias, self.power_output_alias]
+
+    def SetState(self, entity, state):
+        with self.states_lock:
+            self.states[entity] = (state, time.monotonic())
+
+    def GetState(self, entity):
+        if self.use_websocket:
+            if self.websocket_thread is None:
+                self.websocket_thread = threading.Thread(target=self.WebsocketLoop, name=f'HomeAssistant {self.ip}', daemon=True)
+                self.websocket_thread.start()
+            with self.states_lock:
+                State = self.states.get(entity)
+            if State is not None and time.monotonic() - State[1] <= self.websocket_max_age:
+                return State[0]
+        ParsedData = self.GetJson(f"/api/states/{entity}")
+        if self.use_websocket:
+            # no state change within websocket_max_age (constant value or broken websocket): refresh it via REST once
+            self.SetState(entity, ParsedData['state'])
+        return ParsedData['state']
+
+    def WebsocketLoop(self):
+        import websocket
+        ReconnectDelay = 1
+        while True:
+            try:
+                ws = websocket.create_connection(f"ws://{self.ip}:{self.port}/api/websocket", timeout=10)
+                try:
+                    ws.recv() # auth_required
+                    ws.send(json.dumps({"type": "auth", "access_token": self.access_token}))
+                    if json.loads(ws.recv())['type'] != 'auth_ok':
+                        raise Exception("Error: HomeAssistant websocket authentication failed")
+                    ws.send(json.dumps({"id": 1, "type": "subscribe_trigger", "trigger": {"platform": "state", "entity_id": self.GetEntities()}}))
+                    logger.info('HomeAssistant: websocket connected, subscribed to %s', ', '.join(self.GetEntities()))
+                    ReconnectDelay = 1
+                    PingId = 1
+                    PingPending = False
+                    while True:
+                        try:
+                            Message = json.loads(ws.recv())
+                        except websocket.WebSocketTimeoutException:
+                            if PingPending:
+                                raise Exception("Error: HomeAssistant websocket does not answer")
+                            PingId = PingId + 1
+                            ws.send(json.dumps({"id": PingId, "type": "ping"}))
+                            PingPending = True
+                            continue
+                        PingPending = False
+                        if Message.get('type') == 'event':
+                            ToState = Message['event']['variables']['trigger']['to_state']
+                            if ToState is not None:
+                                self.SetState(ToState['entity_id'], ToState['state'])
+                        elif Message.get('type') == 'result' and not Message.get('success'):
+                            raise Exception(f"Error: HomeAssistant websocket subscription failed: {Message.get('error')}")
+                finally:
+                    ws.close()
+            except Exception as e:
+                logger.error('HomeAssistant: websocket error, reconnect in %s seconds: %s', ReconnectDelay, e)
+                time.sleep(ReconnectDelay)
+                ReconnectDelay = min(ReconnectDelay * 2, 60)
 
     def GetPowermeterWatts(self):
         if not self.power_calculate:
-            ParsedData = self.GetJson(f"/api/states/{self.current_power_entity}")
-            return CastToInt(ParsedData['state'])
+            return CastToInt(self.GetState(self.current_power_entity))
         else:
-            ParsedData = self.GetJson(f"/api/states/{self.power_input_alias}")
-            input = CastToInt(ParsedData['state'])
-            ParsedData = self.GetJson(f"/api/states/{self.power_output_alias}")
-            output = CastToInt(ParsedData['state'])
+            input = CastToInt(self.GetState(self.power_input_alias))
+            output = CastToInt(self.GetState(self.power_output_alias))
             return CastToInt(input - output)
 
 class VZLogger(Powermeter):
@@ -772,20 +1065,91 @@ class VZLogger(Powermeter):
 
     def GetJson(self):
         url = f"http://{self.ip}:{self.port}/{self.uuid}"
-        return requests.get(url, timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, timeout=10).json()
 
     def GetPowermeterWatts(self):
         return CastToInt(self.GetJson()['data'][0]['tuples'][0][1])
 
 class DTU(Powermeter):
-    def __init__(self, inverter_count: int):
+    # the DTU addresses the inverters by their serial number: it is read before the first limit, not in the background
+    NEEDS_SERIAL_NUMBER = False
+
+    def __init__(self, controller, inverter_count: int, use_push: bool = False, push_max_age: int = 30, max_requests_per_second: float = 0, max_request_burst: int = 10):
+        self.controller = controller
         self.inverter_count = inverter_count
+        self.max_requests_per_second = max_requests_per_second
+        self.max_request_burst = max_request_burst
+        # push mode: a background thread fills a per-inverter state table {key: (value, monotonic timestamp)} from the live stream of the DTU
+        self.use_push = use_push
+        self.push_max_age = push_max_age
+        self.push_thread = None
+        self.push_state = [{} for i in range(inverter_count)]
+        self.push_condition = threading.Condition()
+
+    def PushLoop(self):
+        raise NotImplementedError()
+
+    def AcquireRequest(self, pPriority: int):
+        if self.max_requests_per_second > 0:
+            GetRateLimiter(self.ip, self.max_requests_per_second, self.max_request_burst).Acquire(pPriority)
+
+    def SetPushState(self, pInverterId: int, pValues: dict):
+        with self.push_condition:
+            for key, value in pValues.items():
+                self.push_state[pInverterId][key] = (value, time.monotonic())
+            self.push_condition.notify_all()
+
+    def GetPushState(self, pInverterId: int, pKey: str):
+        # returns None if push mode is disabled or the value is missing or stale, the caller reads it via HTTP then
+        if not self.use_push:
+            return None
+        with self.push_condition:
+            # the inverters are read from several workers: only the first one starts the push loop
+            if self.push_thread is None:
+                self.push_thread = threading.Thread(target=self.PushLoop, name=f'{self.__class__.__name__} {self.ip}', daemon=True)
+                self.push_thread.start()
+            State = self.push_state[pInverterId].get(pKey)
+        if State is None or time.monotonic() - State[1] > self.push_max_age:
+            return None
+        return State[0]
+
+    def WaitForPushAck(self, pInverterId: int, pTimeoutInS: int):
+        # returns None without live push data, the caller polls the ack via HTTP then
+        if self.GetPushState(pInverterId, 'Reachable') is None:
+            return None
+        with self.push_condition:
+            return self.push_condition.wait_for(lambda: self.push_state[pInverterId].get('LimitAck', (False, 0))[0], pTimeoutInS)
+
+    def GetPanelMinVoltageFromPanels(self, pInverterId: int, pPanelVDC: list):
+        minVdc = float('inf')
+        for i in range(len(pPanelVDC)):
+            if (minVdc > pPanelVDC[i]) and (pPanelVDC[i] > 5):
+                minVdc = pPanelVDC[i]
+        if minVdc == float('inf'):
+            minVdc = 0
+
+        # save last 5 min-values in list and return the "highest" value.
+        self.controller.HOY_PANEL_VOLTAGE_LIST[pInverterId].append(minVdc)
+        if len(self.controller.HOY_PANEL_VOLTAGE_LIST[pInverterId]) > 5:
+            self.controller.HOY_PANEL_VOLTAGE_LIST[pInverterId].pop(0)
+        max_value = None
+        for num in self.controller.HOY_PANEL_VOLTAGE_LIST[pInverterId]:
+            if (max_value is None or num > max_value):
+                max_value = num
+        return max_value
+
+    def GetPushPanelVDC(self, pInverterId: int):
+        PanelVoltages = self.GetPushState(pInverterId, 'PanelVDC')
+        if PanelVoltages is None:
+            return None
+        ExcludedPanels = GetNumberArray(self.controller.HOY_BATTERY_IGNORE_PANELS[pInverterId])
+        return [PanelVoltages[i] for i in sorted(PanelVoltages) if i not in ExcludedPanels]
 
     def GetACPower(self, pInverterId: int):
         raise NotImplementedError()
 
     def GetPowermeterWatts(self):
-        return sum(self.GetACPower(pInverterId) for pInverterId in range(self.inverter_count) if AVAILABLE[pInverterId] and HOY_BATTERY_GOOD_VOLTAGE[pInverterId])
+        return sum(self.GetACPower(pInverterId) for pInverterId in range(self.inverter_count) if self.controller.AVAILABLE[pInverterId] and self.controller.HOY_BATTERY_GOOD_VOLTAGE[pInverterId])
     
     def CheckMinVersion(self):
         raise NotImplementedError()
@@ -805,6 +1169,19 @@ class DTU(Powermeter):
     def WaitForAck(self, pInverterId: int, pTimeoutInS: int):
         raise NotImplementedError()
     
+    def GetLimitOnWire(self, pInverterId: int, pLimit: int):
+        # the limit value as it is sent to the inverter: limits with the same value on the wire are the same command
+        return CastToInt(pLimit)
+
+    def GetActualLimit(self, pInverterId: int):
+        raise NotImplementedError()
+
+    def GetCheckpoint(self):
+        return {}
+
+    def SetCheckpoint(self, pCheckpoint: dict):
+        pass
+
     def SetLimit(self, pInverterId: int, pLimit: int):
         raise NotImplementedError()
     
@@ -812,110 +1189,192 @@ class DTU(Powermeter):
         raise NotImplementedError()
     
 class AhoyDTU(DTU):
-    def __init__(self, inverter_count: int, ip: str, password: str):
-        super().__init__(inverter_count)
+    def __init__(self, controller, inverter_count: int, ip: str, password: str, use_mqtt: bool = False, mqtt_broker: str = '', mqtt_port: int = 1883, mqtt_user: str = '', mqtt_password: str = '', mqtt_topic: str = 'inverter', push_max_age: int = 30, max_requests_per_second: float = 0, max_request_burst: int = 10):
+        super().__init__(controller, inverter_count, use_mqtt, push_max_age, max_requests_per_second, max_request_burst)
         self.ip = ip
         self.password = password
         self.Token = ''
+        self.mqtt_broker = mqtt_broker
+        self.mqtt_port = mqtt_port
+        self.mqtt_user = mqtt_user
+        self.mqtt_password = mqtt_password
+        self.mqtt_topic = mqtt_topic
+        # {Ahoy inverter name: inverter id} of the MQTT topics, read from the DTU before subscribing
+        self.mqtt_inverter_ids = None
+        self.version = None
+        self.field_names = {}
+
+    def LoadMqttInverterIds(self):
+        # the topics carry the inverter names configured in Ahoy, the names of the controller are only known after GetInfo
+        ParsedData = self.GetJson('/api/inverter/list')
+        self.mqtt_inverter_ids = {str(Inverter['name']): CastToInt(Inverter['id']) for Inverter in ParsedData['inverter'] if CastToInt(Inverter['id']) < self.inverter_count}
+        logger.info('Ahoy: MQTT topics of the inverters: %s', self.mqtt_inverter_ids)
+
+    def PushLoop(self):
+        import paho.mqtt.client as mqtt
+        # the retained available and ack_pwr_limit messages arrive right after subscribing: map the names first
+        ReconnectDelay = 1
+        while self.mqtt_inverter_ids is None:
+            try:
+                self.LoadMqttInverterIds()
+            except Exception as e:
+                logger.error('Ahoy: reading the inverter list failed: %s, retrying in %s seconds', e, ReconnectDelay)
+                time.sleep(ReconnectDelay)
+                ReconnectDelay = min(ReconnectDelay * 2, 60)
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        if self.mqtt_user != '':
+            client.username_pw_set(self.mqtt_user, self.mqtt_password)
+        client.on_connect = self.OnMqttConnect
+        client.on_message = self.OnMqttMessage
+        client.reconnect_delay_set(min_delay=1, max_delay=60)
+        client.connect_async(self.mqtt_broker, self.mqtt_port)
+        client.loop_forever(retry_first_connection=True)
+
+    def OnMqttConnect(self, client, userdata, flags, reason_code, properties):
+        logger.info('Ahoy: connected to MQTT broker %s: %s', self.mqtt_broker, reason_code)
+        client.subscribe(f'{self.mqtt_topic}/#')
+
+    def OnMqttMessage(self, client, userdata, message):
+        try:
+            # <topic>/<inverter name>/available, <topic>/<inverter name>/ack_pwr_limit, <topic>/<inverter name>/ch<n>/<field>
+            Topic = message.topic[len(self.mqtt_topic) + 1:].split('/')
+            if Topic[0] not in self.mqtt_inverter_ids:
+                return
+            pInverterId = self.mqtt_inverter_ids[Topic[0]]
+            Payload = message.payload.decode('utf-8')
+            if Topic[1:] == ['available']:
+                self.SetPushState(pInverterId, {'Reachable': CastToInt(Payload) > 0})
+            elif Topic[1:] == ['ack_pwr_limit']:
+                self.SetPushState(pInverterId, {'LimitAck': Payload.lower() == 'true'})
+            elif len(Topic) == 3 and Topic[1] == 'ch0' and Topic[2] == 'P_AC':
+                self.SetPushState(pInverterId, {'ACPower': CastToInt(Payload)})
+            elif len(Topic) == 3 and Topic[1] == 'ch0' and Topic[2] == 'Temp':
+                self.SetPushState(pInverterId, {'Temperature': float(Payload)})
+            elif len(Topic) == 3 and Topic[1].startswith('ch') and Topic[2] == 'U_DC':
+                with self.push_condition:
+                    PanelVoltages = dict(self.push_state[pInverterId].get('PanelVDC', ({}, 0))[0])
+                PanelVoltages[CastToInt(Topic[1][2:])] = float(Payload)
+                self.SetPushState(pInverterId, {'PanelVDC': PanelVoltages})
+        except Exception as e:
+            logger.error('Ahoy: invalid MQTT message %s: %s', message.topic, e)
 
-    def GetJson(self, path):
+    def GetJson(self, path, priority = PRIORITY_STATUS):
+        self.AcquireRequest(priority)
         url = f'http://{self.ip}{path}'
-        return requests.get(url, timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, timeout=10).json()
     
     def GetResponseJson(self, path, obj):
+        self.AcquireRequest(PRIORITY_CONTROL)
         url = f'http://{self.ip}{path}'
-        return requests.post(url, json = obj, timeout=10).json()
+        return HTTP_TRANSPORT.Post(url, json_data = obj, timeout=10).json()
 
     def GetACPower(self, pInverterId):
-        ParsedData = self.GetJson('/api/live')
-        ActualPower_index = ParsedData["ch0_fld_names"].index("P_AC")
+        ACPower = self.GetPushState(pInverterId, 'ACPower')
+        if ACPower is not None:
+            return ACPower
+        ActualPower_index = self.GetFieldIndex("ch0_fld_names", "P_AC")
         ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}')
         return CastToInt(ParsedData["ch"][0][ActualPower_index])
+
+    def GetFieldIndex(self, pFieldNames: str, pField: str, priority = PRIORITY_STATUS):
+        # the field layout of /api/live only changes with the Ahoy version: read it once
+        if pFieldNames not in self.field_names:
+            ParsedData = self.GetJson('/api/live', priority)
+            self.field_names = {'ch0_fld_names': ParsedData['ch0_fld_names'], 'fld_names': ParsedData['fld_names']}
+        return self.field_names[pFieldNames].index(pField)
+
+    def GetActualLimit(self, pInverterId: int):
+        ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}')
+        return CastToInt(float(ParsedData['power_limit_read']) * self.controller.HOY_INVERTER_WATT[pInverterId] / 100)
+
+    def GetCheckpoint(self):
+        return {'version': self.version, 'field_names': self.field_names}
+
+    def SetCheckpoint(self, pCheckpoint: dict):
+        if pCheckpoint.get('version') == self.version:
+            self.field_names = pCheckpoint.get('field_names', {})
     
     def CheckMinVersion(self):
         MinVersion = '0.8.80'
         ParsedData = self.GetJson('/api/system')
         AhoyVersion = str((ParsedData["version"]))
+        self.version = AhoyVersion
         logger.info('Ahoy: Current Version: %s',AhoyVersion)
+        from packaging import version
         if version.parse(AhoyVersion) < version.parse(MinVersion):
             logger.error('Error: Your AHOY Version is too old! Please update at least to Version %s - you can find the newest dev-releases here: https://github.com/lumapu/ahoy/actions',MinVersion)
             quit()
 
     def GetAvailable(self, pInverterId: int):
-        ParsedData = self.GetJson('/api/index')
-        Available = bool(ParsedData["inverter"][pInverterId]["is_avail"])
-        logger.info('Ahoy: Inverter "%s" Available: %s',NAME[pInverterId], Available)
+        Available = self.GetPushState(pInverterId, 'Reachable')
+        if Available is None:
+            ParsedData = self.GetJson('/api/index')
+            Available = bool(ParsedData["inverter"][pInverterId]["is_avail"])
+        logger.info('Ahoy: Inverter "%s" Available: %s',self.controller.NAME[pInverterId], Available)
         return Available
     
     def GetInfo(self, pInverterId: int):
-        ParsedData = self.GetJson('/api/live')
-        temp_index = ParsedData["ch0_fld_names"].index("Temp")
+        temp_index = self.GetFieldIndex("ch0_fld_names", "Temp", PRIORITY_INFO)
         
-        ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}')
-        SERIAL_NUMBER[pInverterId] = str(ParsedData['serial'])
-        NAME[pInverterId] = str(ParsedData['name'])
-        TEMPERATURE[pInverterId] = str(ParsedData["ch"][0][temp_index]) + ' degC'
-        logger.info('Ahoy: Inverter "%s" / serial number "%s" / temperature %s',NAME[pInverterId],SERIAL_NUMBER[pInverterId],TEMPERATURE[pInverterId])
+        ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}', PRIORITY_INFO)
+        self.controller.SERIAL_NUMBER[pInverterId] = str(ParsedData['serial'])
+        self.controller.NAME[pInverterId] = str(ParsedData['name'])
+        self.controller.TEMPERATURE[pInverterId] = str(ParsedData["ch"][0][temp_index]) + ' degC'
+        logger.info('Ahoy: Inverter "%s" / serial number "%s" / temperature %s',self.controller.NAME[pInverterId],self.controller.SERIAL_NUMBER[pInverterId],self.controller.TEMPERATURE[pInverterId])
 
     def GetTemperature(self, pInverterId: int):
-        ParsedData = self.GetJson('/api/live')
-        temp_index = ParsedData["ch0_fld_names"].index("Temp")
+        Temperature = self.GetPushState(pInverterId, 'Temperature')
+        if Temperature is not None:
+            self.controller.TEMPERATURE[pInverterId] = str(Temperature) + ' degC'
+        else:
+            temp_index = self.GetFieldIndex("ch0_fld_names", "Temp", PRIORITY_INFO)
 
-        ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}')
-        TEMPERATURE[pInverterId] = str(ParsedData["ch"][0][temp_index]) + ' degC'
-        logger.info('Ahoy: Inverter "%s" temperature: %s',NAME[pInverterId],TEMPERATURE[pInverterId])
+            ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}', PRIORITY_INFO)
+            self.controller.TEMPERATURE[pInverterId] = str(ParsedData["ch"][0][temp_index]) + ' degC'
+        logger.info('Ahoy: Inverter "%s" temperature: %s',self.controller.NAME[pInverterId],self.controller.TEMPERATURE[pInverterId])
 
     def GetPanelMinVoltage(self, pInverterId: int):
-        ParsedData = self.GetJson('/api/live')
-        PanelVDC_index = ParsedData["fld_names"].index("U_DC")
-
-        ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}')
-        PanelVDC = []
-        ExcludedPanels = GetNumberArray(HOY_BATTERY_IGNORE_PANELS[pInverterId])
-        for i in range(1, len(ParsedData['ch']), 1):
-            if i not in ExcludedPanels:
-                PanelVDC.append(float(ParsedData['ch'][i][PanelVDC_index]))
-        minVdc = float('inf')
-        for i in range(len(PanelVDC)):
-            if (minVdc > PanelVDC[i]) and (PanelVDC[i] > 5):
-                minVdc = PanelVDC[i]
-        if minVdc == float('inf'):
-            minVdc = 0
-
-        # save last 5 min-values in list and return the "highest" value.
-        HOY_PANEL_VOLTAGE_LIST[pInverterId].append(minVdc)
-        if len(HOY_PANEL_VOLTAGE_LIST[pInverterId]) > 5:
-            HOY_PANEL_VOLTAGE_LIST[pInverterId].pop(0)
-        max_value = None
-        for num in HOY_PANEL_VOLTAGE_LIST[pInverterId]:
-            if (max_value is None or num > max_value):
-                max_value = num
-
-        logger.info('Lowest panel voltage inverter "%s": %s Volt',NAME[pInverterId],max_value)
+        PanelVDC = self.GetPushPanelVDC(pInverterId)
+        if PanelVDC is None:
+            PanelVDC_index = self.GetFieldIndex("fld_names", "U_DC")
+
+            ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}')
+            PanelVDC = []
+            ExcludedPanels = GetNumberArray(self.controller.HOY_BATTERY_IGNORE_PANELS[pInverterId])
+            for i in range(1, len(ParsedData['ch']), 1):
+                if i not in ExcludedPanels:
+                    PanelVDC.append(float(ParsedData['ch'][i][PanelVDC_index]))
+        max_value = self.GetPanelMinVoltageFromPanels(pInverterId, PanelVDC)
+
+        logger.info('Lowest panel voltage inverter "%s": %s Volt',self.controller.NAME[pInverterId],max_value)
         return max_value
     
     def WaitForAck(self, pInverterId: int, pTimeoutInS: int):
         try:
-            timeout = pTimeoutInS
-            timeout_start = time.time()
-            while time.time() < timeout_start + timeout:
-                time.sleep(0.5)
-                ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}')
-                ack = bool(ParsedData['power_limit_ack'])
-                if ack:
-                    break
+            ack = self.WaitForPushAck(pInverterId, pTimeoutInS)
+            if ack is None:
+                timeout = pTimeoutInS
+                timeout_start = Monotonic()
+                while Monotonic() < timeout_start + timeout:
+                    Sleep(0.5)
+                    ParsedData = self.GetJson(f'/api/inverter/id/{pInverterId}', PRIORITY_CONTROL)
+                    ack = bool(ParsedData['power_limit_ack'])
+                    if ack:
+                        break
             if ack:
-                logger.info('Ahoy: Inverter "%s": Limit acknowledged', NAME[pInverterId])
+                logger.info('Ahoy: Inverter "%s": Limit acknowledged', self.controller.NAME[pInverterId])
             else:
-                logger.info('Ahoy: Inverter "%s": Limit timeout!', NAME[pInverterId])
+                logger.info('Ahoy: Inverter "%s": Limit timeout!', self.controller.NAME[pInverterId])
             return ack
         except:
-            logger.info('Ahoy: Inverter "%s": Limit timeout!', NAME[pInverterId])
+            logger.info('Ahoy: Inverter "%s": Limit timeout!', self.controller.NAME[pInverterId])
             return False
     
     def SetLimit(self, pInverterId: int, pLimit: int):
-        logger.info('Ahoy: Inverter "%s": setting new limit from %s Watt to %s Watt',NAME[pInverterId],CastToInt(CURRENT_LIMIT[pInverterId]),CastToInt(pLimit))
+        logger.info('Ahoy: Inverter "%s": setting new limit from %s Watt to %s Watt',self.controller.NAME[pInverterId],CastToInt(self.controller.CURRENT_LIMIT[pInverterId]),CastToInt(pLimit))
         myobj = {'cmd': 'limit_nonpersistent_absolute', 'val': pLimit, "id": pInverterId, "token": self.Token}
+        # cleared before sending: an ack pushed while the request is still running belongs to this limit
+        self.SetPushState(pInverterId, {'LimitAck': False})
         response = self.GetResponseJson('/api/ctrl', myobj)
         if response["success"] == False and response["error"] == "ERR_PROTECTED":
             self.Authenticate()
@@ -923,13 +1382,13 @@ class AhoyDTU(DTU):
             return
         if response["success"] == False:
             raise Exception("Error: SetLimitAhoy Request error")
-        CURRENT_LIMIT[pInverterId] = pLimit
+        self.controller.CURRENT_LIMIT[pInverterId] = pLimit
 
     def SetPowerStatus(self, pInverterId: int, pActive: bool):
         if pActive:
-            logger.info('Ahoy: Inverter "%s": Turn on',NAME[pInverterId])
+            logger.info('Ahoy: Inverter "%s": Turn on',self.controller.NAME[pInverterId])
         else:
-            logger.info('Ahoy: Inverter "%s": Turn off',NAME[pInverterId])
+            logger.info('Ahoy: Inverter "%s": Turn off',self.controller.NAME[pInverterId])
         myobj = {'cmd': 'power', 'val': CastToInt(pActive == True), "id": pInverterId, "token": self.Token}
         response = self.GetResponseJson('/api/ctrl', myobj)
         if response["success"] == False and response["error"] == "ERR_PROTECTED":
@@ -949,23 +1408,71 @@ class AhoyDTU(DTU):
         logger.info('Ahoy: Authenticating successful, received Token: %s', self.Token)
 
 class OpenDTU(DTU):
-    def __init__(self, inverter_count: int, ip: str, user: str, password: str):
-        super().__init__(inverter_count)
+    NEEDS_SERIAL_NUMBER = True
+
+    def __init__(self, controller, inverter_count: int, ip: str, user: str, password: str, use_websocket: bool = False, websocket_max_age: int = 30, max_requests_per_second: float = 0, max_request_burst: int = 10):
+        super().__init__(controller, inverter_count, use_websocket, websocket_max_age, max_requests_per_second, max_request_burst)
         self.ip = ip
         self.user = user
         self.password = password
+        self.ExpectedRelLimit = [None for i in range(inverter_count)]
 
-    def GetJson(self, path):
+    def PushLoop(self):
+        import websocket
+        ReconnectDelay = 1
+        while True:
+            try:
+                header = []
+                if self.password != '':
+                    header.append('Authorization: Basic ' + base64.b64encode(f'{self.user}:{self.password}'.encode('utf-8')).decode('ascii'))
+                ws = websocket.create_connection(f'ws://{self.ip}/livedata', timeout=60, header=header)
+                try:
+                    logger.info('OpenDTU: websocket connected')
+                    ReconnectDelay = 1
+                    while True:
+                        self.ParseLiveData(json.loads(ws.recv()))
+                finally:
+                    ws.close()
+            except Exception as e:
+                logger.error('OpenDTU: websocket error: %s, reconnecting in %s seconds', e, ReconnectDelay)
+                time.sleep(ReconnectDelay)
+                ReconnectDelay = min(ReconnectDelay * 2, 60)
+
+    def ParseLiveData(self, pParsedData: dict):
+        # the live stream only carries the inverters whose values changed
+        for Inverter in pParsedData.get('inverters', []):
+            if str(Inverter.get('serial')) not in self.controller.SERIAL_NUMBER:
+                continue
+            pInverterId = self.controller.SERIAL_NUMBER.index(str(Inverter['serial']))
+            Values = {}
+            if 'reachable' in Inverter:
+                Values['Reachable'] = bool(Inverter['reachable'])
+            if 'limit_relative' in Inverter and self.ExpectedRelLimit[pInverterId] is not None:
+                Values['LimitAck'] = abs(float(Inverter['limit_relative']) - self.ExpectedRelLimit[pInverterId]) < 1
+            if 'AC' in Inverter:
+                Values['ACPower'] = CastToInt(Inverter['AC']['0']['Power']['v'])
+            if 'INV' in Inverter:
+                Values['Temperature'] = round(float(Inverter['INV']['0']['Temperature']['v']),1)
+            if 'DC' in Inverter:
+                Values['PanelVDC'] = {CastToInt(k): float(v['Voltage']['v']) for k, v in Inverter['DC'].items()}
+            self.SetPushState(pInverterId, Values)
+
+    def GetJson(self, path, priority = PRIORITY_STATUS):
+        self.AcquireRequest(priority)
         url = f'http://{self.ip}{path}'
-        return requests.get(url, auth=HTTPBasicAuth(self.user, self.password), timeout=10).json()
+        return HTTP_TRANSPORT.Get(url, auth=(self.user, self.password), timeout=10).json()
     
     def GetResponseJson(self, path, sendStr):
+        self.AcquireRequest(PRIORITY_CONTROL)
         url = f'http://{self.ip}{path}'
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        return requests.post(url=url, headers=headers, data=sendStr, auth=HTTPBasicAuth(self.user, self.password), timeout=10).json()
+        return HTTP_TRANSPORT.Post(url, headers=headers, data=sendStr, auth=(self.user, self.password), timeout=10).json()
 
     def GetACPower(self, pInverterId):
-        ParsedData = self.GetJson(f'/api/livedata/status?inv={SERIAL_NUMBER[pInverterId]}')
+        ACPower = self.GetPushState(pInverterId, 'ACPower')
+        if ACPower is not None:
+            return ACPower
+        ParsedData = self.GetJson(f'/api/livedata/status?inv={self.controller.SERIAL_NUMBER[pInverterId]}')
         return CastToInt(ParsedData['inverters'][0]['AC']['0']['Power']['v'])
     
     def CheckMinVersion(self):
@@ -973,90 +1480,97 @@ class OpenDTU(DTU):
         ParsedData = self.GetJson('/api/system/status')
         OpenDTUVersion = str((ParsedData["git_hash"]))
         logger.info('OpenDTU: Current Version: %s',OpenDTUVersion)
+        from packaging import version
         if version.parse(OpenDTUVersion) < version.parse(MinVersion):
             logger.error('Error: Your OpenDTU Version is too old! Please update at least to Version %s - you can find the newest dev-releases here: https://github.com/tbnobody/OpenDTU/actions',MinVersion)
             quit()
 
     def GetAvailable(self, pInverterId: int):
-        ParsedData = self.GetJson(f'/api/livedata/status?inv={SERIAL_NUMBER[pInverterId]}')
-        Reachable = bool(ParsedData['inverters'][0]["reachable"])
-        logger.info('OpenDTU: Inverter "%s" reachable: %s',NAME[pInverterId],Reachable)
+        Reachable = self.GetPushState(pInverterId, 'Reachable')
+        if Reachable is None:
+            ParsedData = self.GetJson(f'/api/livedata/status?inv={self.controller.SERIAL_NUMBER[pInverterId]}')
+            Reachable = bool(ParsedData['inverters'][0]["reachable"])
+        logger.info('OpenDTU: Inverter "%s" reachable: %s',self.controller.NAME[pInverterId],Reachable)
         return Reachable
     
     def GetInfo(self, pInverterId: int):
-        if SERIAL_NUMBER[pInverterId] == '':
+        # the serial number addresses the inverter for the regulation, only name and temperature are informational
+        if self.controller.SERIAL_NUMBER[pInverterId] == '':
             ParsedData = self.GetJson('/api/livedata/status')
-            SERIAL_NUMBER[pInverterId] = str(ParsedData['inverters'][pInverterId]['serial'])
+            self.controller.SERIAL_NUMBER[pInverterId] = str(ParsedData['inverters'][pInverterId]['serial'])
 
-        ParsedData = self.GetJson(f'/api/livedata/status?inv={SERIAL_NUMBER[pInverterId]}')
-        TEMPERATURE[pInverterId] = str(round(float((ParsedData['inverters'][0]['INV']['0']['Temperature']['v'])),1)) + ' degC'
-        NAME[pInverterId] = str(ParsedData['inverters'][0]['name'])
-        logger.info('OpenDTU: Inverter "%s" / serial number "%s" / temperature %s',NAME[pInverterId],SERIAL_NUMBER[pInverterId],TEMPERATURE[pInverterId])
+        ParsedData = self.GetJson(f'/api/livedata/status?inv={self.controller.SERIAL_NUMBER[pInverterId]}', PRIORITY_INFO)
+        self.controller.TEMPERATURE[pInverterId] = str(round(float((ParsedData['inverters'][0]['INV']['0']['Temperature']['v'])),1)) + ' degC'
+        self.controller.NAME[pInverterId] = str(ParsedData['inverters'][0]['name'])
+        logger.info('OpenDTU: Inverter "%s" / serial number "%s" / temperature %s',self.controller.NAME[pInverterId],self.controller.SERIAL_NUMBER[pInverterId],self.controller.TEMPERATURE[pInverterId])
 
     def GetTemperature(self, pInverterId: int):
-        ParsedData = self.GetJson(f'/api/livedata/status?inv={SERIAL_NUMBER[pInverterId]}')
-        TEMPERATURE[pInverterId] = str(round(float((ParsedData['inverters'][0]['INV']['0']['Temperature']['v'])),1)) + ' degC'
-        logger.info('OpenDTU: Inverter "%s" temperature: %s',NAME[pInverterId],TEMPERATURE[pInverterId])
+        Temperature = self.GetPushState(pInverterId, 'Temperature')
+        if Temperature is not None:
+            self.controller.TEMPERATURE[pInverterId] = str(Temperature) + ' degC'
+        else:
+            ParsedData = self.GetJson(f'/api/livedata/status?inv={self.controller.SERIAL_NUMBER[pInverterId]}', PRIORITY_INFO)
+            self.controller.TEMPERATURE[pInverterId] = str(round(float((ParsedData['inverters'][0]['INV']['0']['Temperature']['v'])),1)) + ' degC'
+        logger.info('OpenDTU: Inverter "%s" temperature: %s',self.controller.NAME[pInverterId],self.controller.TEMPERATURE[pInverterId])
 
     def GetPanelMinVoltage(self, pInverterId: int):
-        ParsedData = self.GetJson(f'/api/livedata/status?inv={SERIAL_NUMBER[pInverterId]}')
-        PanelVDC = []
-        ExcludedPanels = GetNumberArray(HOY_BATTERY_IGNORE_PANELS[pInverterId])
-        for i in range(len(ParsedData['inverters'][0]['DC'])):
-            if i not in ExcludedPanels:
-                PanelVDC.append(float(ParsedData['inverters'][0]['DC'][str(i)]['Voltage']['v']))
-        minVdc = float('inf')
-        for i in range(len(PanelVDC)):
-            if (minVdc > PanelVDC[i]) and (PanelVDC[i] > 5):
-                minVdc = PanelVDC[i]
-        if minVdc == float('inf'):
-            minVdc = 0
-
-        # save last 5 min-values in list and return the "highest" value.
-        HOY_PANEL_VOLTAGE_LIST[pInverterId].append(minVdc)
-        if len(HOY_PANEL_VOLTAGE_LIST[pInverterId]) > 5:
-            HOY_PANEL_VOLTAGE_LIST[pInverterId].pop(0)
-        max_value = None
-        for num in HOY_PANEL_VOLTAGE_LIST[pInverterId]:
-            if (max_value is None or num > max_value):
-                max_value = num
-
-        return max_value
+        PanelVDC = self.GetPushPanelVDC(pInverterId)
+        if PanelVDC is None:
+            ParsedData = self.GetJson(f'/api/livedata/status?inv={self.controller.SERIAL_NUMBER[pInverterId]}')
+            PanelVDC = []
+            ExcludedPanels = GetNumberArray(self.controller.HOY_BATTERY_IGNORE_PANELS[pInverterId])
+            for i in range(len(ParsedData['inverters'][0]['DC'])):
+                if i not in ExcludedPanels:
+                    PanelVDC.append(float(ParsedData['inverters'][0]['DC'][str(i)]['Voltage']['v']))
+        return self.GetPanelMinVoltageFromPanels(pInverterId, PanelVDC)
 
     def WaitForAck(self, pInverterId: int, pTimeoutInS: int):
         try:
-            timeout = pTimeoutInS
-            timeout_start = time.time()
-            while time.time() < timeout_start + timeout:
-                time.sleep(0.5)
-                ParsedData = self.GetJson('/api/limit/status')
-                ack = (ParsedData[SERIAL_NUMBER[pInverterId]]['limit_set_status'] == 'Ok')
-                if ack:
-                    break
+            ack = self.WaitForPushAck(pInverterId, pTimeoutInS)
+            if ack is None:
+                timeout = pTimeoutInS
+                timeout_start = Monotonic()
+                while Monotonic() < timeout_start + timeout:
+                    Sleep(0.5)
+                    ParsedData = self.GetJson('/api/limit/status', PRIORITY_CONTROL)
+                    ack = (ParsedData[self.controller.SERIAL_NUMBER[pInverterId]]['limit_set_status'] == 'Ok')
+                    if ack:
+                        break
             if ack:
-                logger.info('OpenDTU: Inverter "%s": Limit acknowledged', NAME[pInverterId])
+                logger.info('OpenDTU: Inverter "%s": Limit acknowledged', self.controller.NAME[pInverterId])
             else:
-                logger.info('OpenDTU: Inverter "%s": Limit timeout!', NAME[pInverterId])
+                logger.info('OpenDTU: Inverter "%s": Limit timeout!', self.controller.NAME[pInverterId])
             return ack
         except:
-            logger.info('OpenDTU: Inverter "%s": Limit timeout!', NAME[pInverterId])
+            logger.info('OpenDTU: Inverter "%s": Limit timeout!', self.controller.NAME[pInverterId])
             return False
 
+    def GetLimitOnWire(self, pInverterId: int, pLimit: int):
+        # OpenDTU sends the limit in whole percent of HOY_INVERTER_WATT
+        return CastToInt(pLimit / self.controller.HOY_INVERTER_WATT[pInverterId] * 100)
+
+    def GetActualLimit(self, pInverterId: int):
+        ParsedData = self.GetJson('/api/limit/status')
+        return CastToInt(float(ParsedData[self.controller.SERIAL_NUMBER[pInverterId]]['limit_relative']) * self.controller.HOY_INVERTER_WATT[pInverterId] / 100)
+
     def SetLimit(self, pInverterId: int, pLimit: int):
-        logger.info('OpenDTU: Inverter "%s": setting new limit from %s Watt to %s Watt',NAME[pInverterId],CastToInt(CURRENT_LIMIT[pInverterId]),CastToInt(pLimit))
-        relLimit = CastToInt(pLimit / HOY_INVERTER_WATT[pInverterId] * 100)
-        mySendStr = f'''data={{"serial":"{SERIAL_NUMBER[pInverterId]}", "limit_type":1, "limit_value":{relLimit}}}'''
+        logger.info('OpenDTU: Inverter "%s": setting new limit from %s Watt to %s Watt',self.controller.NAME[pInverterId],CastToInt(self.controller.CURRENT_LIMIT[pInverterId]),CastToInt(pLimit))
+        relLimit = self.GetLimitOnWire(pInverterId, pLimit)
+        mySendStr = f'''data={{"serial":"{self.controller.SERIAL_NUMBER[pInverterId]}", "limit_type":1, "limit_value":{relLimit}}}'''
+        # set before sending: live data pushed while the request is still running is matched against this limit
+        self.ExpectedRelLimit[pInverterId] = relLimit
+        self.SetPushState(pInverterId, {'LimitAck': False})
         response = self.GetResponseJson('/api/limit/config', mySendStr)
         if response['type'] != 'success':
             raise Exception(f"Error: SetLimit error: {response['message']}")
-        CURRENT_LIMIT[pInverterId] = pLimit
+        self.controller.CURRENT_LIMIT[pInverterId] = pLimit
 
     def SetPowerStatus(self, pInverterId: int, pActive: bool):
         if pActive:
-            logger.info('OpenDTU: Inverter "%s": Turn on',NAME[pInverterId])
+            logger.info('OpenDTU: Inverter "%s": Turn on',self.controller.NAME[pInverterId])
         else:
-            logger.info('OpenDTU: Inverter "%s": Turn off',NAME[pInverterId])
-        mySendStr = f'''data={{"serial":"{SERIAL_NUMBER[pInverterId]}", "power":{CastToInt(pActive == True)}}}'''
+            logger.info('OpenDTU: Inverter "%s": Turn off',self.controller.NAME[pInverterId])
+        mySendStr = f'''data={{"serial":"{self.controller.SERIAL_NUMBER[pInverterId]}", "power":{CastToInt(pActive == True)}}}'''
         response = self.GetResponseJson('/api/power/config', mySendStr)
         if response['type'] != 'success':
             raise Exception(f"Error: SetPowerStatus error: {response['message']}")
@@ -1069,420 +1583,2470 @@ class Script(Powermeter):
         self.password = password
 
     def GetPowermeterWatts(self):
-        power = subprocess.check_output([self.file, self.ip, self.user, self.password])
-        return CastToInt(power)
-
-
-def CreatePowermeter() -> Powermeter:
-    SHELLY_IP = TASMOTA_IP = SHRDZM_IP = EMLOG_IP = IOBROKER_IP = HA_IP = SCRIPT_IP = "xxx.xxx.xxx.xxx"
-    SHELLY_USER = SHELLY_PASS = SHRDZM_USER = SHRDZM_PASS = SCRIPT_USER = SCRIPT_PASS = EMLOG_IP = EMLOG_METERINDEX = ""
-    USE_TASMOTA = USE_SHELLY_EM = USE_SHELLY_3EM = USE_SHELLY_3EM_PRO = USE_SHRDZM = USE_EMLOG = USE_IOBROKER = USE_HOMEASSISTANT = USE_VZLOGGER = USE_SCRIPT = False
-    TASMOTA_JSON_STATUS = "StatusSNS"
-    TASMOTA_JSON_PAYLOAD_MQTT_PREFIX = "SML"
-    TASMOTA_JSON_POWER_MQTT_LABEL = "curr_w"
-    ESPHOME_PORT = "80"
-    IOBROKER_PORT = "8087"
-    IOBROKER_CURRENT_POWER_ALIAS = "alias.0.Zaehler.Zaehler_CurrentWatt"
-    IOBROKER_POWER_INPUT_ALIAS = "alias.0.Zaehler.Zaehler_CurrentInputWatt"
-    IOBROKER_POWER_OUTPUT_ALIAS = "alias.0.Zaehler.Zaehler_CurrentOutputWatt"
-    HA_PORT = "8123"
-    HA_ACCESSTOKEN = "xxx"
-    HA_CURRENT_POWER_ENTITY = "sensor.dtz541_sml_curr_w"
-    HA_POWER_INPUT_ALIAS = "sensor.dtz541_sml_170"
-    HA_POWER_OUTPUT_ALIAS = "sensor.dtz541_sml_270"
-    VZL_IP = "127.0.0.1"
-    VZL_PORT = "2081"
-    VZL_UUID = "30c6c501-9a3c-4b0f-bda5-1d1769904463"
-    TASMOTA_JSON_POWER_CALCULATE =  IOBROKER_POWER_CALCULATE = HA_POWER_CALCULATE = HA_POWER_CALCULATE = False
-    EMLOG_JSON_POWER_CALCULATE = True
-    TASMOTA_JSON_POWER_INPUT_MQTT_LABEL = TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL = IOBROKER_POWER_INPUT_ALIAS = IOBROKER_POWER_OUTPUT_ALIAS = HA_POWER_INPUT_ALIAS = HA_POWER_OUTPUT_ALIAS = None
-    SCRIPT_FILE = "GetPowerFromVictronMultiplus.sh"
-
-    shelly_ip = config.get('SHELLY', 'SHELLY_IP', fallback = SHELLY_IP)
-    shelly_user = config.get('SHELLY', 'SHELLY_USER', fallback = SHELLY_USER)
-    shelly_pass = config.get('SHELLY', 'SHELLY_PASS', fallback = SHELLY_PASS)
-    if config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_EM', fallback = USE_SHELLY_EM):
-        return ShellyEM(shelly_ip, shelly_user, shelly_pass)
-    elif config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_3EM', fallback = USE_SHELLY_3EM):
-        return Shelly3EM(shelly_ip, shelly_user, shelly_pass)
-    elif config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_3EM_PRO', fallback = USE_SHELLY_3EM_PRO):
-        return Shelly3EMPro(shelly_ip, shelly_user, shelly_pass)
-    elif config.getboolean('SELECT_POWERMETER', 'USE_TASMOTA', fallback = USE_TASMOTA):
-        return Tasmota(
-            config.get('TASMOTA', 'TASMOTA_IP', fallback = TASMOTA_IP),
-            config.get('TASMOTA', 'TASMOTA_JSON_STATUS', fallback = TASMOTA_JSON_STATUS),
-            config.get('TASMOTA', 'TASMOTA_JSON_PAYLOAD_MQTT_PREFIX', fallback = TASMOTA_JSON_PAYLOAD_MQTT_PREFIX),
-            config.get('TASMOTA', 'TASMOTA_JSON_POWER_MQTT_LABEL', fallback = TASMOTA_JSON_POWER_MQTT_LABEL),
-            config.get('TASMOTA', 'TASMOTA_JSON_POWER_INPUT_MQTT_LABEL', fallback = TASMOTA_JSON_POWER_INPUT_MQTT_LABEL),
-            config.get('TASMOTA', 'TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL', fallback = TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL),
-            config.getboolean('TASMOTA', 'TASMOTA_JSON_POWER_CALCULATE', fallback = TASMOTA_JSON_POWER_CALCULATE)
-        )
-    elif config.getboolean('SELECT_POWERMETER', 'USE_SHRDZM', fallback = USE_SHRDZM):
-        return Shrdzm(
-            config.get('SHRDZM', 'SHRDZM_IP', fallback = SHRDZM_IP),
-            config.get('SHRDZM', 'SHRDZM_USER', fallback = SHRDZM_USER),
-            config.get('SHRDZM', 'SHRDZM_PASS', fallback = SHRDZM_PASS)
-        )
-    elif config.getboolean('SELECT_POWERMETER', 'USE_EMLOG', fallback = USE_EMLOG):
-        return Emlog(
-            config.get('EMLOG', 'EMLOG_IP', fallback = EMLOG_IP),
-            config.get('EMLOG', 'EMLOG_METERINDEX', fallback = EMLOG_METERINDEX),
-            config.getboolean('EMLOG', 'EMLOG_JSON_POWER_CALCULATE', fallback = EMLOG_JSON_POWER_CALCULATE)
-        )
-    elif config.getboolean('SELECT_POWERMETER', 'USE_IOBROKER', fallback = USE_IOBROKER):
-        return IoBroker(
-            config.get('IOBROKER', 'IOBROKER_IP', fallback = IOBROKER_IP),
-            config.get('IOBROKER', 'IOBROKER_PORT', fallback = IOBROKER_PORT),
-            config.get('IOBROKER', 'IOBROKER_CURRENT_POWER_ALIAS', fallback = IOBROKER_CURRENT_POWER_ALIAS),
-            config.getboolean('IOBROKER', 'IOBROKER_POWER_CALCULATE', fallback = IOBROKER_POWER_CALCULATE),
-            config.get('IOBROKER', 'IOBROKER_POWER_INPUT_ALIAS', fallback = IOBROKER_POWER_INPUT_ALIAS),
-            config.get('IOBROKER', 'IOBROKER_POWER_OUTPUT_ALIAS', fallback = IOBROKER_POWER_OUTPUT_ALIAS)
-        )
-    elif config.getboolean('SELECT_POWERMETER', 'USE_HOMEASSISTANT', fallback = USE_HOMEASSISTANT):
-        return HomeAssistant(
-            config.get('HOMEASSISTANT', 'HA_IP', fallback = HA_IP),
-            config.get('HOMEASSISTANT', 'HA_PORT', fallback = HA_PORT),
-            config.get('HOMEASSISTANT', 'HA_ACCESSTOKEN', fallback = HA_ACCESSTOKEN),
-            config.get('HOMEASSISTANT', 'HA_CURRENT_POWER_ENTITY', fallback = HA_CURRENT_POWER_ENTITY),
-            config.getboolean('HOMEASSISTANT', 'HA_POWER_CALCULATE', fallback = HA_POWER_CALCULATE),
-            config.get('HOMEASSISTANT', 'HA_POWER_INPUT_ALIAS', fallback = HA_POWER_INPUT_ALIAS),
-            config.get('HOMEASSISTANT', 'HA_POWER_OUTPUT_ALIAS', fallback = HA_POWER_OUTPUT_ALIAS)
-        )
-    elif config.getboolean('SELECT_POWERMETER', 'USE_VZLOGGER', fallback = USE_VZLOGGER):
-        return VZLogger(
-            config.get('VZLOGGER', 'VZL_IP', fallback = VZL_IP),
-            config.get('VZLOGGER', 'VZL_PORT', fallback = VZL_PORT),
-            config.get('VZLOGGER', 'VZL_UUID', fallback = VZL_UUID)
-        )
-    elif config.getboolean('SELECT_POWERMETER', 'USE_SCRIPT', fallback = USE_SCRIPT):
-        return Script(
-            config.get('SCRIPT', 'SCRIPT_FILE', fallback = SCRIPT_FILE),
-            config.get('SCRIPT', 'SCRIPT_IP', fallback = SCRIPT_IP),
-            config.get('SCRIPT', 'SCRIPT_USER', fallback = SCRIPT_USER),
-            config.get('SCRIPT', 'SCRIPT_PASS', fallback = SCRIPT_PASS)
-        )
-    else:
-        raise Exception("Error: no powermeter defined!")
-
-def CreateIntermediatePowermeter(dtu: DTU) -> Powermeter:
-    SHELLY_IP_INTERMEDIATE = TASMOTA_IP_INTERMEDIATE = ESPHOME_IP_INTERMEDIATE = SHRDZM_IP_INTERMEDIATE = EMLOG_IP_INTERMEDIATE = IOBROKER_IP_INTERMEDIATE = HA_IP_INTERMEDIATE = "xxx.xxx.xxx.xxx"
-    SHELLY_USER_INTERMEDIATE = SHELLY_PASS_INTERMEDIATE = ESPHOME_DOMAIN_INTERMEDIATE = ESPHOME_ID_INTERMEDIATE = SHRDZM_USER_INTERMEDIATE = SHRDZM_PASS_INTERMEDIATE = EMLOG_IP_INTERMEDIATE = EMLOG_METERINDEX_INTERMEDIATE = ""
-    USE_TASMOTA_INTERMEDIATE = USE_SHELLY_EM_INTERMEDIATE = USE_SHELLY_3EM_INTERMEDIATE = USE_SHELLY_3EM_PRO_INTERMEDIATE = USE_SHELLY_1PM_INTERMEDIATE = USE_SHELLY_PLUS_1PM_INTERMEDIATE = USE_ESPHOME_INTERMEDIATE = USE_SHRDZM_INTERMEDIATE = USE_EMLOG_INTERMEDIATE = USE_IOBROKER_INTERMEDIATE = USE_HOMEASSISTANT_INTERMEDIATE = USE_VZLOGGER_INTERMEDIATE = False
-    TASMOTA_JSON_STATUS_INTERMEDIATE = "StatusSNS"
-    TASMOTA_JSON_PAYLOAD_MQTT_PREFIX_INTERMEDIATE = "SML"
-    TASMOTA_JSON_POWER_MQTT_LABEL_INTERMEDIATE = "curr_w"
-    ESPHOME_PORT_INTERMEDIATE = "80"
-    IOBROKER_PORT_INTERMEDIATE = "8087"
-    IOBROKER_CURRENT_POWER_ALIAS_INTERMEDIATE = "alias.0.Zaehler.Zaehler_SolarCurrentWatt"
-    HA_PORT_INTERMEDIATE = "8123"
-    HA_ACCESSTOKEN_INTERMEDIATE = "xxx"
-    HA_CURRENT_POWER_ENTITY_INTERMEDIATE = "sensor.dtz541_sml_curr_w"
-    VZL_IP_INTERMEDIATE = "127.0.0.1"
-    VZL_PORT_INTERMEDIATE = "2081"
-    VZL_UUID_INTERMEDIATE = "06ec9562-a490-49fe-92ea-ffe0758d181c"
-    TASMOTA_JSON_POWER_CALCULATE_INTERMEDIATE = EMLOG_JSON_POWER_CALCULATE = IOBROKER_POWER_CALCULATE = HA_POWER_CALCULATE_INTERMEDIATE = HA_POWER_CALCULATE_INTERMEDIATE = False
-    TASMOTA_JSON_POWER_INPUT_MQTT_LABEL_INTERMEDIATE = TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL_INTERMEDIATE = IOBROKER_POWER_INPUT_ALIAS_INTERMEDIATE = IOBROKER_POWER_OUTPUT_ALIAS_INTERMEDIATE = HA_POWER_INPUT_ALIAS_INTERMEDIATE = HA_POWER_OUTPUT_ALIAS_INTERMEDIATE = None
-
-    shelly_ip = config.get('INTERMEDIATE_SHELLY', 'SHELLY_IP_INTERMEDIATE', fallback = SHELLY_IP_INTERMEDIATE)
-    shelly_user = config.get('INTERMEDIATE_SHELLY', 'SHELLY_USER_INTERMEDIATE', fallback = SHELLY_USER_INTERMEDIATE)
-    shelly_pass = config.get('INTERMEDIATE_SHELLY', 'SHELLY_PASS_INTERMEDIATE', fallback = SHELLY_PASS_INTERMEDIATE)
-    if config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_TASMOTA_INTERMEDIATE', fallback = USE_TASMOTA_INTERMEDIATE):
-        return Tasmota(
-            config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_IP_INTERMEDIATE', fallback = TASMOTA_IP_INTERMEDIATE),
-            config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_STATUS_INTERMEDIATE', fallback = TASMOTA_JSON_STATUS_INTERMEDIATE),
-            config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_PAYLOAD_MQTT_PREFIX_INTERMEDIATE', fallback = TASMOTA_JSON_PAYLOAD_MQTT_PREFIX_INTERMEDIATE),
-            config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_MQTT_LABEL_INTERMEDIATE', fallback = TASMOTA_JSON_POWER_MQTT_LABEL_INTERMEDIATE),
-            config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_INPUT_MQTT_LABEL_INTERMEDIATE', fallback = TASMOTA_JSON_POWER_INPUT_MQTT_LABEL_INTERMEDIATE),
-            config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL_INTERMEDIATE', fallback = TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL_INTERMEDIATE),
-            config.getboolean('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_CALCULATE_INTERMEDIATE', fallback = TASMOTA_JSON_POWER_CALCULATE_INTERMEDIATE)
-        )
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_EM_INTERMEDIATE', fallback = USE_SHELLY_EM_INTERMEDIATE):
-        return ShellyEM(shelly_ip, shelly_user, shelly_pass)
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_3EM_INTERMEDIATE', fallback = USE_SHELLY_3EM_INTERMEDIATE):
-        return Shelly3EM(shelly_ip, shelly_user, shelly_pass)
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_3EM_PRO_INTERMEDIATE', fallback = USE_SHELLY_3EM_PRO_INTERMEDIATE):
-        return Shelly3EMPro(shelly_ip, shelly_user, shelly_pass)
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_1PM_INTERMEDIATE', fallback = USE_SHELLY_1PM_INTERMEDIATE):
-        return Shelly1PM(shelly_ip, shelly_user, shelly_pass)
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_PLUS_1PM_INTERMEDIATE', fallback = USE_SHELLY_PLUS_1PM_INTERMEDIATE):
-        return ShellyPlus1PM(shelly_ip, shelly_user, shelly_pass)
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_ESPHOME_INTERMEDIATE', fallback = USE_ESPHOME_INTERMEDIATE):
-        return ESPHome(
-            config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_IP_INTERMEDIATE', fallback = ESPHOME_IP_INTERMEDIATE),
-            config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_PORT_INTERMEDIATE', fallback = ESPHOME_PORT_INTERMEDIATE),
-            config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_DOMAIN_INTERMEDIATE', fallback = ESPHOME_DOMAIN_INTERMEDIATE),
-            config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_ID_INTERMEDIATE', fallback = ESPHOME_ID_INTERMEDIATE)
-        )
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHRDZM_INTERMEDIATE', fallback = USE_SHRDZM_INTERMEDIATE):
-        return Shrdzm(
-            config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_IP_INTERMEDIATE', fallback = SHRDZM_IP_INTERMEDIATE),
-            config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_USER_INTERMEDIATE', fallback = SHRDZM_USER_INTERMEDIATE),
-            config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_PASS_INTERMEDIATE', fallback = SHRDZM_PASS_INTERMEDIATE)
-        )
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_EMLOG_INTERMEDIATE', fallback = USE_EMLOG_INTERMEDIATE):
-        return Emlog(
-            config.get('INTERMEDIATE_EMLOG', 'EMLOG_IP_INTERMEDIATE', fallback = EMLOG_IP_INTERMEDIATE),
-            config.get('INTERMEDIATE_EMLOG', 'EMLOG_METERINDEX_INTERMEDIATE', fallback = EMLOG_METERINDEX_INTERMEDIATE),
-            config.getboolean('INTERMEDIATE_EMLOG', 'EMLOG_JSON_POWER_CALCULATE', fallback = EMLOG_JSON_POWER_CALCULATE)
-        )
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_IOBROKER_INTERMEDIATE', fallback = USE_IOBROKER_INTERMEDIATE):
-        return IoBroker(
-            config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_IP_INTERMEDIATE', fallback = IOBROKER_IP_INTERMEDIATE),
-            config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_PORT_INTERMEDIATE', fallback = IOBROKER_PORT_INTERMEDIATE),
-            config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_CURRENT_POWER_ALIAS_INTERMEDIATE', fallback = IOBROKER_CURRENT_POWER_ALIAS_INTERMEDIATE),
-            config.getboolean('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_CALCULATE', fallback = IOBROKER_POWER_CALCULATE),
-            config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_INPUT_ALIAS_INTERMEDIATE', fallback = IOBROKER_POWER_INPUT_ALIAS_INTERMEDIATE),
-            config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_OUTPUT_ALIAS_INTERMEDIATE', fallback = IOBROKER_POWER_OUTPUT_ALIAS_INTERMEDIATE)
-        )
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_HOMEASSISTANT_INTERMEDIATE', fallback = USE_HOMEASSISTANT_INTERMEDIATE):
-        return HomeAssistant(
-            config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_IP_INTERMEDIATE', fallback = HA_IP_INTERMEDIATE),
-            config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_PORT_INTERMEDIATE', fallback = HA_PORT_INTERMEDIATE),
-            config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_ACCESSTOKEN_INTERMEDIATE', fallback = HA_ACCESSTOKEN_INTERMEDIATE),
-            config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_CURRENT_POWER_ENTITY_INTERMEDIATE', fallback = HA_CURRENT_POWER_ENTITY_INTERMEDIATE),
-            config.getboolean('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_CALCULATE_INTERMEDIATE', fallback = HA_POWER_CALCULATE_INTERMEDIATE),
-            config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_INPUT_ALIAS_INTERMEDIATE', fallback = HA_POWER_INPUT_ALIAS_INTERMEDIATE),
-            config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_OUTPUT_ALIAS_INTERMEDIATE', fallback = HA_POWER_OUTPUT_ALIAS_INTERMEDIATE)
-        )
-    elif config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_VZLOGGER_INTERMEDIATE', fallback = USE_VZLOGGER_INTERMEDIATE):
-        return VZLogger(
-            config.get('INTERMEDIATE_VZLOGGER', 'VZL_IP_INTERMEDIATE', fallback = VZL_IP_INTERMEDIATE),
-            config.get('INTERMEDIATE_VZLOGGER', 'VZL_PORT_INTERMEDIATE', fallback = VZL_PORT_INTERMEDIATE),
-            config.get('INTERMEDIATE_VZLOGGER', 'VZL_UUID_INTERMEDIATE', fallback = VZL_UUID_INTERMEDIATE)
-        )
-    else:
-        return dtu
-
-def CreateDTU() -> DTU:
-    inverter_count = config.getint('COMMON', 'INVERTER_COUNT', fallback = INVERTER_COUNT)
-    if config.getboolean('SELECT_DTU', 'USE_AHOY', fallback = False):
-        return AhoyDTU(
-            inverter_count,
-            config.get('AHOY_DTU', 'AHOY_IP', fallback = AHOY_IP),
-            config.get('AHOY_DTU', 'AHOY_PASS', fallback = AHOY_PASS)
-        )
-    elif config.getboolean('SELECT_DTU', 'USE_OPENDTU', fallback = False):
-        return OpenDTU(
-            inverter_count,
-            config.get('OPEN_DTU', 'OPENDTU_IP', fallback = OPENDTU_IP),
-            config.get('OPEN_DTU', 'OPENDTU_USER', fallback = OPENDTU_USER),
-            config.get('OPEN_DTU', 'OPENDTU_PASS', fallback = OPENDTU_PASS)
-        )
-    else:
-        raise Exception("Error: no DTU defined!")
+        if CASSETTE is not None:
+            return CastToInt(CASSETTE.Call(f'SCRIPT {self.file} {self.ip}', lambda: (0, self.Run())).content)
+        return CastToInt(self.Run())
+
+    def Run(self):
+        import subprocess
+        # the script runs in its own process group: a hanging script is killed by the watchdog together with its children
+        with subprocess.Popen([self.file, self.ip, self.user, self.password], stdout=subprocess.PIPE, start_new_session=(os.name == 'posix')) as process:
+            if os.name == 'posix':
+                import signal
+                WATCHDOG.SetAbort(lambda: os.killpg(process.pid, signal.SIGKILL))
+            else:
+                WATCHDOG.SetAbort(process.kill)
+            try:
+                power = process.communicate()[0]
+            finally:
+                WATCHDOG.SetAbort(None)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, self.file)
+        return power
+
+class InfoScheduler:
+    # informational DTU reads (version check, inverter names, temperatures) of one controller in a background thread: they run
+    # one at a time at most once per second, only while the controller has no limit command or limit step in progress, and
+    # write their results to the controller state. the regulation never waits for them
+    def __init__(self, controller):
+        self.controller = controller
+        # key -> [due (monotonic), periodic, function]
+        self.tasks = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def Add(self, pKey: str, pFunction, pPeriodic: bool = False):
+        with self.condition:
+            if pKey not in self.tasks:
+                self.tasks[pKey] = [time.monotonic(), pPeriodic, pFunction]
+                self.condition.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.Loop, name=f'{self.controller.Name} info', daemon=True)
+            self.thread.start()
+
+    def Remove(self, pKey: str):
+        with self.condition:
+            self.tasks.pop(pKey, None)
+
+    def Loop(self):
+        while True:
+            with self.condition:
+                Now = time.monotonic()
+                Due = min(self.tasks.items(), key=lambda item: item[1][0], default=None)
+                if Due is None or Due[1][0] > Now:
+                    self.condition.wait(None if Due is None else Due[1][0] - Now)
+                    continue
+                Key, Task = Due
+            if not self.controller.IsControlIdle():
+                time.sleep(0.5)
+                continue
+            Success = True
+            try:
+                Task[2]()
+            except SystemExit as e:
+                # e.g. the DTU firmware is too old: the regulation loop stops like before
+                self.controller.StopReason = str(e) or Key
+                Success = False
+            except Exception as e:
+                logger.error('Exception at %s: %s', Key, e)
+                Success = False
+            with self.condition:
+                if self.tasks.get(Key) is Task:
+                    if Task[1] or not Success:
+                        Task[0] = time.monotonic() + self.controller.INFO_INTERVAL_IN_SECONDS
+                    else:
+                        del self.tasks[Key]
+            time.sleep(1)
+
+class MqttPublisher:
+    # publishes the state of a controller to MQTT from a background thread: the regulation loop only hands over
+    # one snapshot per loop (a newer snapshot replaces one not yet published), only changed values are published
+    def __init__(self, broker: str, port: int, user: str, password: str, topic: str, deadband_watt: int, deadband_volt: float, deadband_seconds: int):
+        self.broker = broker
+        self.port = port
+        self.user = user
+        self.password = password
+        self.topic = topic
+        self.deadband_watt = deadband_watt
+        self.deadband_volt = deadband_volt
+        self.deadband_seconds = deadband_seconds
+        self.client = None
+        self.condition = threading.Condition()
+        self.pending = None
+        self.published = {}
+        self.thread = None
+
+    def Publish(self, pStatus: dict):
+        with self.condition:
+            self.pending = pStatus
+            self.condition.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.PublishLoop, name=f'MQTT {self.topic}', daemon=True)
+            self.thread.start()
+
+    def OnConnect(self, client, userdata, flags, reason_code, properties):
+        logger.info('MQTT: connected to broker %s: %s', self.broker, reason_code)
+        # publish everything again after a reconnect
+        with self.condition:
+            self.published = {}
+
+    def GetDeadband(self, pKey: str):
+        if pKey.endswith('voltage'):
+            return self.deadband_volt
+        if pKey.endswith('watts') or pKey.endswith('limit') or pKey.endswith('setpoint') or pKey.endswith('watt'):
+            return self.deadband_watt
+        # the KPI counters and averages change every loop: energy gets the watt deadband (in Wh), durations and rates their own
+        if '/kpi/' in pKey:
+            if pKey.endswith('_wh'):
+                return self.deadband_watt
+            if 'seconds' in pKey.rsplit('/', 1)[-1]:
+                return self.deadband_seconds
+            if pKey.endswith('_per_hour'):
+                return 1
+        return 0
+
+    def Flatten(self, pPrefix: str, pValue, pResult: dict):
+        if isinstance(pValue, dict):
+            for key, value in pValue.items():
+                self.Flatten(f'{pPrefix}/{key}', value, pResult)
+        elif isinstance(pValue, list):
+            for i, value in enumerate(pValue):
+                self.Flatten(f'{pPrefix}/{i + 1}', value, pResult)
+        else:
+            pResult[pPrefix] = pValue
+        return pResult
 
-# ----- START -----
+    def IsChanged(self, pTopic: str, pValue):
+        if pTopic not in self.published:
+            return True
+        LastValue = self.published[pTopic]
+        if isinstance(pValue, (int, float)) and not isinstance(pValue, bool) and isinstance(LastValue, (int, float)) and not isinstance(LastValue, bool):
+            return abs(pValue - LastValue) >= max(self.GetDeadband(pTopic), sys.float_info.epsilon)
+        return pValue != LastValue
+
+    def PublishLoop(self):
+        import paho.mqtt.client as mqtt
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        if self.user != '':
+            self.client.username_pw_set(self.user, self.password)
+        self.client.on_connect = self.OnConnect
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+        self.client.connect_async(self.broker, self.port)
+        self.client.loop_start()
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None)
+                Status = self.pending
+                self.pending = None
+            if not self.client.is_connected():
+                continue
+            try:
+                Values = self.Flatten(self.topic, Status, {})
+                with self.condition:
+                    Changed = {topic: value for topic, value in Values.items() if self.IsChanged(topic, value)}
+                for topic, value in Changed.items():
+                    self.client.publish(topic, value if isinstance(value, str) else json.dumps(value), retain = True)
+                with self.condition:
+                    self.published.update(Changed)
+            except Exception as e:
+                logger.error('MQTT: publish failed: %s', e)
+
+class RedundantPowermeter(Powermeter):
+    # asks the powermeters in the configured order: the next one gets a hedged request if the previous did not answer
+    # within hedge_percentile of its recent latencies (or failed), the first valid answer wins
+    def __init__(self, powermeters: list, hedge_percentile: int):
+        self.powermeters = powermeters
+        self.hedge_percentile = hedge_percentile
+        # own pool: a hanging meter must not block the worker pool of the controllers
+        self.pool = ThreadPoolExecutor(max_workers = len(powermeters), thread_name_prefix = 'powermeter')
+        self.pending = [None for i in range(len(powermeters))]
+        # latencies and errors are written by the pool threads, also by a request still running from an earlier read
+        self.lock = threading.Lock()
+        self.latencies = [deque(maxlen = 100) for i in range(len(powermeters))]
+        self.requests = [0 for i in range(len(powermeters))]
+        self.wins = [0 for i in range(len(powermeters))]
+        self.errors = [0 for i in range(len(powermeters))]
+        self.hedges = 0
+        self.reads = 0
+
+    def GetName(self, pIndex: int):
+        return f'{pIndex}:{self.powermeters[pIndex].__class__.__name__}'
+
+    def GetHedgeDelay(self, pIndex: int):
+        # no hedging before we know the usual latency of a source
+        with self.lock:
+            Latencies = sorted(self.latencies[pIndex])
+        if len(Latencies) < 10:
+            return 1.0
+        return Latencies[min(len(Latencies) - 1, len(Latencies) * self.hedge_percentile // 100)]
+
+    def Read(self, pIndex: int):
+        Start = time.monotonic()
+        try:
+            with WATCHDOG.Phase('redundant powermeter ' + self.GetName(pIndex)):
+                return CastToInt(self.powermeters[pIndex].GetPowermeterWatts())
+        except:
+            with self.lock:
+                self.errors[pIndex] += 1
+            raise
+        finally:
+            with self.lock:
+                self.latencies[pIndex].append(time.monotonic() - Start)
+
+    def GetStatistics(self):
+        Statistics = {}
+        for i in range(len(self.powermeters)):
+            with self.lock:
+                Latencies = sorted(self.latencies[i])
+                Errors = self.errors[i]
+            Statistics[self.GetName(i)] = {
+                'requests': self.requests[i],
+                'wins': self.wins[i],
+                'errors': Errors,
+                'p50_ms': CastToInt(Latencies[len(Latencies) // 2] * 1000) if Latencies else None,
+                'p95_ms': CastToInt(Latencies[len(Latencies) * 95 // 100] * 1000) if Latencies else None
+            }
+        return Statistics
 
-logger.info("Author: %s / Script Version: %s",__author__, __version__)
-
-# read config:
-logger.info("read config file: " + str(Path.joinpath(Path(__file__).parent.resolve(), "HoymilesZeroExport_Config.ini")))
-if args.config:
-    logger.info("read additional config file: " + args.config)
-
-VERSION = config.get('VERSION', 'VERSION')
-logger.info("Config file V %s", VERSION)
-
-USE_AHOY = USE_OPENDTU = LOG_TEMPERATURE = SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR = False
-AHOY_IP = OPENDTU_IP = SHELLY_IP_INTERMEDIATE = "xxx.xxx.xxx.xxx"
-AHOY_PASS = OPENDTU_USER = OPENDTU_PASS = ""
-INVERTER_COUNT = POLL_INTERVAL_IN_SECONDS = 1
-LOOP_INTERVAL_IN_SECONDS = SLOW_APPROX_FACTOR_IN_PERCENT = 20
-SET_LIMIT_TIMEOUT_SECONDS = SET_POWER_STATUS_DELAY_IN_SECONDS = SET_POWERSTATUS_CNT = 10
-ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT = MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER = 100
-POWERMETER_TARGET_POINT = -75
-POWERMETER_TOLERANCE = 25
-POWERMETER_MAX_POINT = 0
-
-USE_AHOY = config.getboolean('SELECT_DTU', 'USE_AHOY', fallback = USE_AHOY)
-USE_OPENDTU = config.getboolean('SELECT_DTU', 'USE_OPENDTU', fallback = USE_OPENDTU)
-AHOY_IP = config.get('AHOY_DTU', 'AHOY_IP', fallback = AHOY_IP)
-OPENDTU_IP = config.get('OPEN_DTU', 'OPENDTU_IP', fallback = OPENDTU_IP)
-OPENDTU_USER = config.get('OPEN_DTU', 'OPENDTU_USER', fallback = OPENDTU_USER)
-OPENDTU_PASS = config.get('OPEN_DTU', 'OPENDTU_PASS', fallback = USE_AHOY)
-DTU = CreateDTU()
-POWERMETER = CreatePowermeter()
-INTERMEDIATE_POWERMETER = CreateIntermediatePowermeter(DTU)
-INVERTER_COUNT = config.getint('COMMON', 'INVERTER_COUNT', fallback = INVERTER_COUNT)
-LOOP_INTERVAL_IN_SECONDS = config.getint('COMMON', 'LOOP_INTERVAL_IN_SECONDS', fallback = LOOP_INTERVAL_IN_SECONDS)
-SET_LIMIT_TIMEOUT_SECONDS = config.getint('COMMON', 'SET_LIMIT_TIMEOUT_SECONDS', fallback = SET_LIMIT_TIMEOUT_SECONDS)
-SET_POWER_STATUS_DELAY_IN_SECONDS = config.getint('COMMON', 'SET_POWER_STATUS_DELAY_IN_SECONDS', fallback = SET_POWER_STATUS_DELAY_IN_SECONDS)
-POLL_INTERVAL_IN_SECONDS = config.getint('COMMON', 'POLL_INTERVAL_IN_SECONDS', fallback = POLL_INTERVAL_IN_SECONDS)
-ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT = config.getint('COMMON', 'ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT', fallback = ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT)
-MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER = config.getint('COMMON', 'MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER', fallback = MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER)
-SET_POWERSTATUS_CNT = config.getint('COMMON', 'SET_POWERSTATUS_CNT', fallback = SET_POWERSTATUS_CNT)
-SLOW_APPROX_FACTOR_IN_PERCENT = config.getint('COMMON', 'SLOW_APPROX_FACTOR_IN_PERCENT', fallback = SLOW_APPROX_FACTOR_IN_PERCENT)
-LOG_TEMPERATURE = config.getboolean('COMMON', 'LOG_TEMPERATURE', fallback = LOG_TEMPERATURE)
-SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR = config.getboolean('COMMON', 'SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR', fallback = SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR)
-POWERMETER_TARGET_POINT = config.getint('CONTROL', 'POWERMETER_TARGET_POINT', fallback = POWERMETER_TARGET_POINT)
-POWERMETER_TOLERANCE = config.getint('CONTROL', 'POWERMETER_TOLERANCE', fallback = POWERMETER_TOLERANCE)
-POWERMETER_MAX_POINT = config.getint('CONTROL', 'POWERMETER_MAX_POINT', fallback = POWERMETER_MAX_POINT)
-if POWERMETER_MAX_POINT < (POWERMETER_TARGET_POINT + POWERMETER_TOLERANCE):
-    POWERMETER_MAX_POINT = POWERMETER_TARGET_POINT + POWERMETER_TOLERANCE + 50
-    logger.info('Warning: POWERMETER_MAX_POINT < POWERMETER_TARGET_POINT + POWERMETER_TOLERANCE. Setting POWERMETER_MAX_POINT to ' + str(POWERMETER_MAX_POINT))
-SERIAL_NUMBER = []
-NAME = []
-TEMPERATURE = []
-HOY_MAX_WATT = []
-HOY_INVERTER_WATT = []
-HOY_MIN_WATT = []
-CURRENT_LIMIT = []
-AVAILABLE = []
-LASTLIMITACKNOWLEDGED = []
-HOY_BATTERY_GOOD_VOLTAGE = []
-HOY_COMPENSATE_WATT_FACTOR = []
-HOY_BATTERY_MODE = []
-HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V = []
-HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V = []
-HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V = []
-HOY_BATTERY_NORMAL_WATT = []
-HOY_BATTERY_REDUCE_WATT = []
-HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V = []
-HOY_BATTERY_IGNORE_PANELS = []
-HOY_BATTERY_PRIORITY = []
-HOY_PANEL_VOLTAGE_LIST = []
-HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST = []
-HOY_BATTERY_AVERAGE_CNT = []
-
-DEFAULT_SERIAL_NUMBER = ""
-DEFAULT_HOY_INVERTER_WATT = DEFAULT_HOY_BATTERY_IGNORE_PANELS = None
-DEFAULT_HOY_MAX_WATT = DEFAULT_HOY_BATTERY_NORMAL_WATT = 1500
-DEFAULT_HOY_MIN_WATT_IN_PERCENT = 5
-DEFAULT_HOY_COMPENSATE_WATT_FACTOR = DEFAULT_HOY_BATTERY_PRIORITY = DEFAULT_HOY_BATTERY_AVERAGE_CNT = 1
-DEFAULT_HOY_BATTERY_MODE = False
-DEFAULT_HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V = 47
-DEFAULT_HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V = 48
-DEFAULT_HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V = 48.5
-DEFAULT_HOY_BATTERY_REDUCE_WATT = 300
-DEFAULT_HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V = 51
-DEFAULT_SLOW_APPROX_LIMIT_IN_PERCENT = 20
-
-for i in range(INVERTER_COUNT):
-    SERIAL_NUMBER.append(config.get('INVERTER_' + str(i + 1), 'SERIAL_NUMBER', fallback = DEFAULT_SERIAL_NUMBER))
-    NAME.append(str('yet unknown'))
-    TEMPERATURE.append(str('--- degC'))
-    HOY_MAX_WATT.append(config.getint('INVERTER_' + str(i + 1), 'HOY_MAX_WATT', fallback = DEFAULT_HOY_MAX_WATT))
-    
-    if (config.get('INVERTER_' + str(i + 1), 'HOY_INVERTER_WATT', fallback = DEFAULT_HOY_INVERTER_WATT) != ''):
-        HOY_INVERTER_WATT.append(config.getint('INVERTER_' + str(i + 1), 'HOY_INVERTER_WATT', fallback = DEFAULT_HOY_INVERTER_WATT))
-    else:
-        HOY_INVERTER_WATT.append(HOY_MAX_WATT[i])
-        
-    HOY_MIN_WATT.append(int(HOY_INVERTER_WATT[i] * config.getint('INVERTER_' + str(i + 1), 'HOY_MIN_WATT_IN_PERCENT', fallback = DEFAULT_HOY_MIN_WATT_IN_PERCENT) / 100))
-    CURRENT_LIMIT.append(int(0))
-    AVAILABLE.append(bool(False))
-    LASTLIMITACKNOWLEDGED.append(bool(False))
-    HOY_BATTERY_GOOD_VOLTAGE.append(bool(True))
-    HOY_BATTERY_MODE.append(config.getboolean('INVERTER_' + str(i + 1), 'HOY_BATTERY_MODE', fallback = DEFAULT_HOY_BATTERY_MODE))
-    HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V', fallback = DEFAULT_HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V))
-    HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V', fallback = DEFAULT_HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V))
-    HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V', fallback = DEFAULT_HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V))
-    HOY_BATTERY_NORMAL_WATT.append(config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_NORMAL_WATT', fallback = DEFAULT_HOY_BATTERY_NORMAL_WATT))
-    if HOY_BATTERY_NORMAL_WATT[i] > HOY_MAX_WATT[i]:
-        HOY_BATTERY_NORMAL_WATT[i] = HOY_MAX_WATT[i]
-    HOY_BATTERY_REDUCE_WATT.append(config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_REDUCE_WATT', fallback = DEFAULT_HOY_BATTERY_REDUCE_WATT))
-    HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V', fallback = DEFAULT_HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V))
-    HOY_COMPENSATE_WATT_FACTOR.append(config.getfloat('INVERTER_' + str(i + 1), 'HOY_COMPENSATE_WATT_FACTOR', fallback = DEFAULT_HOY_COMPENSATE_WATT_FACTOR))
-    HOY_BATTERY_IGNORE_PANELS.append(config.get('INVERTER_' + str(i + 1), 'HOY_BATTERY_IGNORE_PANELS', fallback = DEFAULT_HOY_BATTERY_IGNORE_PANELS))
-    HOY_BATTERY_PRIORITY.append(config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_PRIORITY', fallback = DEFAULT_HOY_BATTERY_PRIORITY))
-    HOY_PANEL_VOLTAGE_LIST.append([])
-    HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST.append([])
-    HOY_BATTERY_AVERAGE_CNT.append(config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_AVERAGE_CNT', fallback = DEFAULT_HOY_BATTERY_AVERAGE_CNT))
-SLOW_APPROX_LIMIT = CastToInt(GetMaxWattFromAllInverters() * config.getint('COMMON', 'SLOW_APPROX_LIMIT_IN_PERCENT', fallback = DEFAULT_SLOW_APPROX_LIMIT_IN_PERCENT) / 100)
-
-try:
-    logger.info("---Init---")
-    newLimitSetpoint = 0
-    DTU.CheckMinVersion()
-    if GetHoymilesAvailable():
-        for i in range(INVERTER_COUNT):
-            SetHoymilesPowerStatus(i, True)
-        SetLimit(GetMinWattFromAllInverters())
-        GetHoymilesActualPower()
-        GetCheckBattery()
-    GetPowermeterWatts()
-except Exception as e:
-    if hasattr(e, 'message'):
-        logger.error(e.message)
-    else:
-        logger.error(e)
-    time.sleep(LOOP_INTERVAL_IN_SECONDS)
-logger.info("---Start Zero Export---")
+    def GetPowermeterWatts(self):
+        self.reads += 1
+        if self.reads % 100 == 0:
+            logger.info('redundant powermeter: %s hedged requests, statistics: %s', self.hedges, self.GetStatistics())
+        Running = {}
+        LastError = None
+        Next = 0
+        while True:
+            # start the next source, a source still busy with an older request is skipped
+            while Next < len(self.powermeters) and (self.pending[Next] is not None and not self.pending[Next].done()):
+                Next += 1
+            if Next < len(self.powermeters):
+                if Running:
+                    self.hedges += 1
+                    logger.info('redundant powermeter: hedged request to %s', self.GetName(Next))
+                self.requests[Next] += 1
+                self.pending[Next] = self.pool.submit(self.Read, Next)
+                Running[self.pending[Next]] = Next
+                HedgeDelay = self.GetHedgeDelay(Next)
+                Next += 1
+            elif not Running:
+                raise LastError if LastError is not None else Exception("Error: no powermeter available")
+            else:
+                HedgeDelay = None
+            Done = wait(Running, timeout = HedgeDelay, return_when = FIRST_COMPLETED)[0]
+            for Future in Done:
+                Index = Running.pop(Future)
+                if Future.exception() is None:
+                    self.wins[Index] += 1
+                    if Index != 0:
+                        logger.info('redundant powermeter: answer from %s', self.GetName(Index))
+                    return Future.result()
+                LastError = Future.exception()
+                logger.error('redundant powermeter: %s failed: %s', self.GetName(Index), LastError)
+
+class HttpPushPowermeter(Powermeter):
+    # local HTTP listener for meters which push their readings (vzlogger push, Tasmota WebSend/WebQuery, Shelly scripts and actions):
+    # the latest pushed value is returned without any outbound I/O, the polled powermeter is only asked while no push arrived within max_age
+    def __init__(self, powermeter: Powermeter, bind: str, port: int, allowed_ips: list, json_path: str, vzl_uuid: str, max_age: int):
+        self.powermeter = powermeter
+        self.bind = bind
+        self.port = port
+        self.allowed_ips = allowed_ips
+        self.json_path = json_path
+        self.vzl_uuid = vzl_uuid
+        self.max_age = max_age
+        self.value = None
+        self.value_lock = threading.Lock()
+        self.pushes = 0
+        self.polling = None
+        self.server = None
+
+    def StartServer(self):
+        # started with the first read, like the other push modes: creating the powermeter does not bind the port
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from urllib.parse import urlsplit, parse_qs
+        import socket
+        Receiver = self
+        # hostnames are resolved once, pushes from any other source are rejected
+        AllowedIps = {socket.gethostbyname(Host) for Host in self.allowed_ips}
+
+        class PushRequestHandler(BaseHTTPRequestHandler):
+            def Receive(self, pBody: bytes):
+                if AllowedIps and self.client_address[0] not in AllowedIps:
+                    logger.error('HTTP push: reading from %s rejected, it is not in HTTP_PUSH_ALLOWED_IPS', self.client_address[0])
+                    self.send_error(403)
+                    return
+                try:
+                    Query = parse_qs(urlsplit(self.path).query)
+                    Receiver.SetValue(Receiver.ParseReading(Query, pBody))
+                except Exception as e:
+                    logger.error('HTTP push: invalid reading from %s: %s', self.client_address[0], e)
+                    self.send_error(400)
+                    return
+                self.send_response(204)
+                self.end_headers()
+
+            def do_GET(self):
+                self.Receive(b'')
+
+            def do_POST(self):
+                self.Receive(self.rfile.read(CastToInt(self.headers.get('Content-Length', 0))))
+
+            def do_PUT(self):
+                self.do_POST()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.bind, self.port), PushRequestHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name=f'http push {self.port}', daemon=True).start()
+        logger.info('HTTP push: listening on http://%s:%s', self.bind, self.port)
+
+    def GetJsonValue(self, pData, pPath: str):
+        # dotted path into the pushed JSON, list elements by index (e.g. "em:0.total_act_power" or "StatusSNS.SML.curr_w")
+        for Key in pPath.split('.'):
+            pData = pData[CastToInt(Key)] if isinstance(pData, list) else pData[Key]
+        return pData
+
+    def ParseReading(self, pQuery: dict, pBody: bytes):
+        # query parameter (GET /?power=123), vzlogger push JSON, JSON object with json_path, a JSON number or a plain number
+        Key = self.json_path.split('.')[-1]
+        if Key in pQuery:
+            return float(pQuery[Key][0])
+        Text = pBody.decode('utf-8').strip()
+        try:
+            ParsedData = json.loads(Text)
+        except ValueError:
+            return float(Text)
+        if isinstance(ParsedData, dict) and isinstance(ParsedData.get('data'), list):
+            Channels = [channel for channel in ParsedData['data'] if channel.get('uuid') == self.vzl_uuid] or ParsedData['data']
+            return float(Channels[0]['tuples'][-1][1])
+        if isinstance(ParsedData, dict):
+            return float(self.GetJsonValue(ParsedData, self.json_path))
+        return float(ParsedData)
+
+    def SetValue(self, pValue: float):
+        with self.value_lock:
+            self.value = (pValue, time.monotonic())
+            self.pushes += 1
 
-while True:
-    try:
-        PreviousLimitSetpoint = newLimitSetpoint
-        if GetHoymilesAvailable() and GetCheckBattery():
-            if LOG_TEMPERATURE:
-                GetHoymilesTemperature()
-            for x in range(CastToInt(LOOP_INTERVAL_IN_SECONDS / POLL_INTERVAL_IN_SECONDS)):
-                powermeterWatts = GetPowermeterWatts()
-                if powermeterWatts > POWERMETER_MAX_POINT:
-                    if ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT > 0:
-                        newLimitSetpoint = CastToInt(GetMaxInverterWattFromAllInverters() * ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT / 100)
-                        if (newLimitSetpoint <= PreviousLimitSetpoint) and (ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT != 100):
-                            newLimitSetpoint = PreviousLimitSetpoint + powermeterWatts - POWERMETER_TARGET_POINT
-                    else:
-                        newLimitSetpoint = PreviousLimitSetpoint + powermeterWatts - POWERMETER_TARGET_POINT
-                    newLimitSetpoint = ApplyLimitsToSetpoint(newLimitSetpoint)
-                    SetLimit(newLimitSetpoint)
-                    RemainingDelay = CastToInt((LOOP_INTERVAL_IN_SECONDS / POLL_INTERVAL_IN_SECONDS - x) * POLL_INTERVAL_IN_SECONDS)
-                    if RemainingDelay > 0:
-                        time.sleep(RemainingDelay)
-                        break
+    def GetPowermeterWatts(self):
+        if self.server is None:
+            self.StartServer()
+        with self.value_lock:
+            Value = self.value
+        Polling = Value is None or time.monotonic() - Value[1] > self.max_age
+        if Polling != self.polling:
+            if Polling:
+                logger.info('HTTP push: no reading within %s seconds, polling %s', self.max_age, self.powermeter.__class__.__name__)
+            else:
+                logger.info('HTTP push: receiving readings (%s so far)', self.pushes)
+            self.polling = Polling
+        if Polling:
+            return self.powermeter.GetPowermeterWatts()
+        return CastToInt(Value[0])
+
+class ValueCache:
+    # the last good reading per source with its monotonic time: a failed read can be bridged by it while it is younger
+    # than the staleness limit, its confidence decays linearly from 1 (just read) to 0 (at the limit)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def Set(self, pSource, pValue):
+        with self.lock:
+            self.values[pSource] = (pValue, time.monotonic())
+
+    def Get(self, pSource, pMaxAge):
+        # returns (value, age, confidence) or None if there is no value younger than pMaxAge seconds
+        with self.lock:
+            Entry = self.values.get(pSource)
+        if Entry is None or pMaxAge <= 0:
+            return None
+        Age = time.monotonic() - Entry[1]
+        if Age >= pMaxAge:
+            return None
+        return Entry[0], Age, 1 - Age / pMaxAge
+
+class Controller:
+    # one Controller regulates one site (one config file): it owns the config, the DTU, the powermeters and all inverter state
+
+    # settings which are applied while running when the config file changes, all others need a restart
+    RELOADABLE_SETTINGS = [
+        ('COMMON', 'LOOP_INTERVAL_IN_SECONDS', int),
+        ('COMMON', 'SET_LIMIT_TIMEOUT_SECONDS', int),
+        ('COMMON', 'SET_POWER_STATUS_DELAY_IN_SECONDS', int),
+        ('COMMON', 'POLL_INTERVAL_IN_SECONDS', int),
+        ('COMMON', 'ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT', int),
+        ('COMMON', 'MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER', int),
+        ('COMMON', 'SET_POWERSTATUS_CNT', int),
+        ('COMMON', 'SLOW_APPROX_FACTOR_IN_PERCENT', int),
+        ('COMMON', 'SLOW_APPROX_LIMIT_IN_PERCENT', int),
+        ('COMMON', 'LOG_TEMPERATURE', bool),
+        ('COMMON', 'INFO_INTERVAL_IN_SECONDS', int),
+        ('COMMON', 'SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR', bool),
+        ('COMMON', 'LAST_GOOD_VALUE_MAX_AGE_IN_SECONDS', int),
+        ('COMMON', 'MAX_SAMPLE_SKEW_IN_MILLISECONDS', int),
+        ('COMMON', 'CHECKPOINT_INTERVAL_IN_SECONDS', int),
+        ('COMMON', 'CHECKPOINT_MAX_AGE_IN_SECONDS', int),
+        ('COMMON', 'ADAPTIVE_LOOP_INTERVAL', bool),
+        ('COMMON', 'ADAPTIVE_LOOP_SETTLE_PERCENT', int),
+        ('CONTROL', 'POWERMETER_TARGET_POINT', int),
+        ('CONTROL', 'POWERMETER_TOLERANCE', int),
+        ('CONTROL', 'POWERMETER_MAX_POINT', int),
+        ('CONTROL', 'FILTER_WINDOW', int),
+        ('CONTROL', 'FILTER_HAMPEL_SIGMA', float),
+        ('CONTROL', 'FILTER_EWMA_ALPHA', float),
+        ('CONTROL', 'FILTER_PULSE_MIN_WATT', int),
+        ('CONTROL', 'FILTER_PULSE_MIN_CYCLES', int)
+    ]
+    RELOADABLE_INVERTER_SETTINGS = [
+        ('HOY_MAX_WATT', int),
+        ('HOY_MIN_WATT_IN_PERCENT', int),
+        ('HOY_COMPENSATE_WATT_FACTOR', float),
+        ('HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V', float),
+        ('HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V', float),
+        ('HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V', float),
+        ('HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V', float),
+        ('HOY_BATTERY_NORMAL_WATT', int),
+        ('HOY_BATTERY_REDUCE_WATT', int),
+        ('HOY_BATTERY_IGNORE_PANELS', str),
+        ('HOY_BATTERY_PRIORITY', int),
+        ('HOY_BATTERY_AVERAGE_CNT', int)
+    ]
+
+    def __init__(self, configFiles: list, name: str, settingsOnly: bool = False):
+        # settingsOnly: only the settings are read (tuner), no DTU, powermeter or MQTT objects are created and the KPI files are not touched
+        self.Name = name
+        self.ConfigFiles = configFiles
+        self.ConfigMtimes = self.GetConfigMtimes()
+        self.config = ConfigParser()
+        self.config.read(configFiles)
+        self.ConfigDir = Path(configFiles[-1]).parent.resolve()
+        logger.info("read config file: " + configFiles[0])
+        for configFile in configFiles[1:]:
+            logger.info("read additional config file: " + configFile)
+
+        VERSION = self.config.get('VERSION', 'VERSION')
+        logger.info("Config file V %s", VERSION)
+
+        self.INVERTER_COUNT = self.POLL_INTERVAL_IN_SECONDS = 1
+        self.LOOP_INTERVAL_IN_SECONDS = self.SLOW_APPROX_FACTOR_IN_PERCENT = 20
+        self.SET_LIMIT_TIMEOUT_SECONDS = self.SET_POWER_STATUS_DELAY_IN_SECONDS = self.SET_POWERSTATUS_CNT = 10
+        self.ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT = self.MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER = 100
+        self.LOG_TEMPERATURE = self.SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR = False
+        self.INFO_INTERVAL_IN_SECONDS = 60
+        self.LAST_GOOD_VALUE_MAX_AGE_IN_SECONDS = 10
+        self.POWERMETER_TARGET_POINT = -75
+        self.POWERMETER_TOLERANCE = 25
+        self.POWERMETER_MAX_POINT = 0
+        self.FILTER_WINDOW = 0
+        self.FILTER_HAMPEL_SIGMA = 3.0
+        self.FILTER_EWMA_ALPHA = 1.0
+        self.FILTER_PULSE_MIN_WATT = 300
+        self.FILTER_PULSE_MIN_CYCLES = 2
+        self.MAX_SAMPLE_SKEW_IN_MILLISECONDS = 1000
+        self.CHECKPOINT_INTERVAL_IN_SECONDS = 60
+        self.CHECKPOINT_MAX_AGE_IN_SECONDS = 600
+        self.ADAPTIVE_LOOP_INTERVAL = False
+        self.ADAPTIVE_LOOP_SETTLE_PERCENT = 50
+
+        self.INVERTER_COUNT = self.config.getint('COMMON', 'INVERTER_COUNT', fallback = self.INVERTER_COUNT)
+        if settingsOnly:
+            self.DTU = self.POWERMETER = self.INTERMEDIATE_POWERMETER = self.MQTT_PUBLISHER = None
+        else:
+            self.DTU = self.CreateDTU()
+            self.POWERMETER = self.CreatePowermeter()
+            self.INTERMEDIATE_POWERMETER = self.CreateIntermediatePowermeter(self.DTU)
+            self.MQTT_PUBLISHER = self.CreateMqttPublisher()
+        self.LOOP_INTERVAL_IN_SECONDS = self.config.getint('COMMON', 'LOOP_INTERVAL_IN_SECONDS', fallback = self.LOOP_INTERVAL_IN_SECONDS)
+        self.SET_LIMIT_TIMEOUT_SECONDS = self.config.getint('COMMON', 'SET_LIMIT_TIMEOUT_SECONDS', fallback = self.SET_LIMIT_TIMEOUT_SECONDS)
+        self.SET_POWER_STATUS_DELAY_IN_SECONDS = self.config.getint('COMMON', 'SET_POWER_STATUS_DELAY_IN_SECONDS', fallback = self.SET_POWER_STATUS_DELAY_IN_SECONDS)
+        self.POLL_INTERVAL_IN_SECONDS = self.config.getint('COMMON', 'POLL_INTERVAL_IN_SECONDS', fallback = self.POLL_INTERVAL_IN_SECONDS)
+        self.ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT = self.config.getint('COMMON', 'ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT', fallback = self.ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT)
+        self.MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER = self.config.getint('COMMON', 'MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER', fallback = self.MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER)
+        self.SET_POWERSTATUS_CNT = self.config.getint('COMMON', 'SET_POWERSTATUS_CNT', fallback = self.SET_POWERSTATUS_CNT)
+        self.SLOW_APPROX_FACTOR_IN_PERCENT = self.config.getint('COMMON', 'SLOW_APPROX_FACTOR_IN_PERCENT', fallback = self.SLOW_APPROX_FACTOR_IN_PERCENT)
+        self.LOG_TEMPERATURE = self.config.getboolean('COMMON', 'LOG_TEMPERATURE', fallback = self.LOG_TEMPERATURE)
+        self.INFO_INTERVAL_IN_SECONDS = self.config.getint('COMMON', 'INFO_INTERVAL_IN_SECONDS', fallback = self.INFO_INTERVAL_IN_SECONDS)
+        self.SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR = self.config.getboolean('COMMON', 'SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR', fallback = self.SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR)
+        self.LAST_GOOD_VALUE_MAX_AGE_IN_SECONDS = self.config.getint('COMMON', 'LAST_GOOD_VALUE_MAX_AGE_IN_SECONDS', fallback = self.LAST_GOOD_VALUE_MAX_AGE_IN_SECONDS)
+        self.MAX_SAMPLE_SKEW_IN_MILLISECONDS = self.config.getint('COMMON', 'MAX_SAMPLE_SKEW_IN_MILLISECONDS', fallback = self.MAX_SAMPLE_SKEW_IN_MILLISECONDS)
+        self.CHECKPOINT_INTERVAL_IN_SECONDS = self.config.getint('COMMON', 'CHECKPOINT_INTERVAL_IN_SECONDS', fallback = self.CHECKPOINT_INTERVAL_IN_SECONDS)
+        self.CHECKPOINT_MAX_AGE_IN_SECONDS = self.config.getint('COMMON', 'CHECKPOINT_MAX_AGE_IN_SECONDS', fallback = self.CHECKPOINT_MAX_AGE_IN_SECONDS)
+        self.ADAPTIVE_LOOP_INTERVAL = self.config.getboolean('COMMON', 'ADAPTIVE_LOOP_INTERVAL', fallback = self.ADAPTIVE_LOOP_INTERVAL)
+        self.ADAPTIVE_LOOP_SETTLE_PERCENT = self.config.getint('COMMON', 'ADAPTIVE_LOOP_SETTLE_PERCENT', fallback = self.ADAPTIVE_LOOP_SETTLE_PERCENT)
+        self.TRACE_FILE = self.config.get('COMMON', 'TRACE_FILE', fallback = '')
+        self.TraceFile = Path.joinpath(self.ConfigDir, self.TRACE_FILE) if self.TRACE_FILE else None
+        self.CheckpointFile = Path.joinpath(self.ConfigDir, Path(configFiles[-1]).stem + '_checkpoint.json')
+        self.LastCheckpoint = None
+        self.LastCheckpointTime = 0
+        self.KpiFile = Path.joinpath(self.ConfigDir, Path(configFiles[-1]).stem + '_kpi.json')
+        self.KpiHistoryFile = Path.joinpath(self.ConfigDir, Path(configFiles[-1]).stem + '_kpi_history.jsonl')
+        self.LastKpiTime = 0
+        self.POWERMETER_TARGET_POINT = self.config.getint('CONTROL', 'POWERMETER_TARGET_POINT', fallback = self.POWERMETER_TARGET_POINT)
+        self.POWERMETER_TOLERANCE = self.config.getint('CONTROL', 'POWERMETER_TOLERANCE', fallback = self.POWERMETER_TOLERANCE)
+        self.POWERMETER_MAX_POINT = self.config.getint('CONTROL', 'POWERMETER_MAX_POINT', fallback = self.POWERMETER_MAX_POINT)
+        if self.POWERMETER_MAX_POINT < (self.POWERMETER_TARGET_POINT + self.POWERMETER_TOLERANCE):
+            self.POWERMETER_MAX_POINT = self.POWERMETER_TARGET_POINT + self.POWERMETER_TOLERANCE + 50
+            logger.info('Warning: POWERMETER_MAX_POINT < POWERMETER_TARGET_POINT + POWERMETER_TOLERANCE. Setting POWERMETER_MAX_POINT to ' + str(self.POWERMETER_MAX_POINT))
+        self.FILTER_WINDOW = self.config.getint('CONTROL', 'FILTER_WINDOW', fallback = self.FILTER_WINDOW)
+        self.FILTER_HAMPEL_SIGMA = self.config.getfloat('CONTROL', 'FILTER_HAMPEL_SIGMA', fallback = self.FILTER_HAMPEL_SIGMA)
+        self.FILTER_EWMA_ALPHA = self.config.getfloat('CONTROL', 'FILTER_EWMA_ALPHA', fallback = self.FILTER_EWMA_ALPHA)
+        self.FILTER_PULSE_MIN_WATT = self.config.getint('CONTROL', 'FILTER_PULSE_MIN_WATT', fallback = self.FILTER_PULSE_MIN_WATT)
+        self.FILTER_PULSE_MIN_CYCLES = self.config.getint('CONTROL', 'FILTER_PULSE_MIN_CYCLES', fallback = self.FILTER_PULSE_MIN_CYCLES)
+        self.PowermeterFilter = PowermeterFilter()
+        self.ValueCache = ValueCache()
+        self.PowermeterConfidence = self.ActualPowerConfidence = 1.0
+        self.SERIAL_NUMBER = []
+        self.NAME = []
+        self.TEMPERATURE = []
+        self.HOY_MAX_WATT = []
+        self.HOY_INVERTER_WATT = []
+        self.HOY_MIN_WATT = []
+        self.HOY_MIN_WATT_IN_PERCENT = []
+        self.CURRENT_LIMIT = []
+        self.AVAILABLE = []
+        self.LASTLIMITACKNOWLEDGED = []
+        self.HOY_BATTERY_GOOD_VOLTAGE = []
+        self.HOY_COMPENSATE_WATT_FACTOR = []
+        self.HOY_BATTERY_MODE = []
+        self.HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V = []
+        self.HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V = []
+        self.HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V = []
+        self.HOY_BATTERY_NORMAL_WATT = []
+        self.HOY_BATTERY_REDUCE_WATT = []
+        self.HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V = []
+        self.HOY_BATTERY_IGNORE_PANELS = []
+        self.HOY_BATTERY_PRIORITY = []
+        self.HOY_PANEL_VOLTAGE_LIST = []
+        self.HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST = []
+        self.HOY_BATTERY_AVERAGE_CNT = []
+
+        DEFAULT_SERIAL_NUMBER = ""
+        DEFAULT_HOY_INVERTER_WATT = DEFAULT_HOY_BATTERY_IGNORE_PANELS = None
+        DEFAULT_HOY_MAX_WATT = DEFAULT_HOY_BATTERY_NORMAL_WATT = 1500
+        DEFAULT_HOY_MIN_WATT_IN_PERCENT = 5
+        DEFAULT_HOY_COMPENSATE_WATT_FACTOR = DEFAULT_HOY_BATTERY_PRIORITY = DEFAULT_HOY_BATTERY_AVERAGE_CNT = 1
+        DEFAULT_HOY_BATTERY_MODE = False
+        DEFAULT_HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V = 47
+        DEFAULT_HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V = 48
+        DEFAULT_HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V = 48.5
+        DEFAULT_HOY_BATTERY_REDUCE_WATT = 300
+        DEFAULT_HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V = 51
+        DEFAULT_SLOW_APPROX_LIMIT_IN_PERCENT = 20
+
+        for i in range(self.INVERTER_COUNT):
+            self.SERIAL_NUMBER.append(self.config.get('INVERTER_' + str(i + 1), 'SERIAL_NUMBER', fallback = DEFAULT_SERIAL_NUMBER))
+            self.NAME.append(str('yet unknown'))
+            self.TEMPERATURE.append(str('--- degC'))
+            self.HOY_MAX_WATT.append(self.config.getint('INVERTER_' + str(i + 1), 'HOY_MAX_WATT', fallback = DEFAULT_HOY_MAX_WATT))
+
+            if (self.config.get('INVERTER_' + str(i + 1), 'HOY_INVERTER_WATT', fallback = DEFAULT_HOY_INVERTER_WATT) != ''):
+                self.HOY_INVERTER_WATT.append(self.config.getint('INVERTER_' + str(i + 1), 'HOY_INVERTER_WATT', fallback = DEFAULT_HOY_INVERTER_WATT))
+            else:
+                self.HOY_INVERTER_WATT.append(self.HOY_MAX_WATT[i])
+
+            self.HOY_MIN_WATT_IN_PERCENT.append(self.config.getint('INVERTER_' + str(i + 1), 'HOY_MIN_WATT_IN_PERCENT', fallback = DEFAULT_HOY_MIN_WATT_IN_PERCENT))
+            self.HOY_MIN_WATT.append(int(self.HOY_INVERTER_WATT[i] * self.HOY_MIN_WATT_IN_PERCENT[i] / 100))
+            self.CURRENT_LIMIT.append(int(0))
+            self.AVAILABLE.append(bool(False))
+            self.LASTLIMITACKNOWLEDGED.append(bool(False))
+            self.HOY_BATTERY_GOOD_VOLTAGE.append(bool(True))
+            self.HOY_BATTERY_MODE.append(self.config.getboolean('INVERTER_' + str(i + 1), 'HOY_BATTERY_MODE', fallback = DEFAULT_HOY_BATTERY_MODE))
+            self.HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V.append(self.config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V', fallback = DEFAULT_HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V))
+            self.HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V.append(self.config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V', fallback = DEFAULT_HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V))
+            self.HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V.append(self.config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V', fallback = DEFAULT_HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V))
+            self.HOY_BATTERY_NORMAL_WATT.append(self.config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_NORMAL_WATT', fallback = DEFAULT_HOY_BATTERY_NORMAL_WATT))
+            if self.HOY_BATTERY_NORMAL_WATT[i] > self.HOY_MAX_WATT[i]:
+                self.HOY_BATTERY_NORMAL_WATT[i] = self.HOY_MAX_WATT[i]
+            self.HOY_BATTERY_REDUCE_WATT.append(self.config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_REDUCE_WATT', fallback = DEFAULT_HOY_BATTERY_REDUCE_WATT))
+            self.HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V.append(self.config.getfloat('INVERTER_' + str(i + 1), 'HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V', fallback = DEFAULT_HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V))
+            self.HOY_COMPENSATE_WATT_FACTOR.append(self.config.getfloat('INVERTER_' + str(i + 1), 'HOY_COMPENSATE_WATT_FACTOR', fallback = DEFAULT_HOY_COMPENSATE_WATT_FACTOR))
+            self.HOY_BATTERY_IGNORE_PANELS.append(self.config.get('INVERTER_' + str(i + 1), 'HOY_BATTERY_IGNORE_PANELS', fallback = DEFAULT_HOY_BATTERY_IGNORE_PANELS))
+            self.HOY_BATTERY_PRIORITY.append(self.config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_PRIORITY', fallback = DEFAULT_HOY_BATTERY_PRIORITY))
+            self.HOY_PANEL_VOLTAGE_LIST.append([])
+            self.HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST.append([])
+            self.HOY_BATTERY_AVERAGE_CNT.append(self.config.getint('INVERTER_' + str(i + 1), 'HOY_BATTERY_AVERAGE_CNT', fallback = DEFAULT_HOY_BATTERY_AVERAGE_CNT))
+        self.SLOW_APPROX_LIMIT_IN_PERCENT = self.config.getint('COMMON', 'SLOW_APPROX_LIMIT_IN_PERCENT', fallback = DEFAULT_SLOW_APPROX_LIMIT_IN_PERCENT)
+        self.SLOW_APPROX_LIMIT = CastToInt(self.GetMaxWattFromAllInverters() * self.SLOW_APPROX_LIMIT_IN_PERCENT / 100)
+
+        # state of the last limit command, separate for every SetLimit mode
+        self.LastLimit = self.LastLimitWithPriority = self.LastLimitMixedMode = CastToInt(0)
+        self.LastLimitAck = self.LastLimitAckWithPriority = self.LastLimitAckMixedMode = bool(False)
+        self.LastPowerStatus = [False for i in range(self.INVERTER_COUNT)]
+        self.SamePowerStatusCnt = [0 for i in range(self.INVERTER_COUNT)]
+        # per inverter limit command: the newest limit waiting to be sent and whether a command is in flight (sent, ack not yet received)
+        self.LimitCommandLock = threading.Lock()
+        self.PendingLimit = [None for i in range(self.INVERTER_COUNT)]
+        self.LimitCommandActive = [False for i in range(self.INVERTER_COUNT)]
+        # adaptive cadence: per inverter ack latency (limit sent -> acknowledged) and ramp latency (acknowledged -> visible at the powermeter),
+        # the inverters which got a new command from the last SetLimit and the limit step the regulation waits for
+        self.AckLatency = [deque(maxlen = 20) for i in range(self.INVERTER_COUNT)]
+        self.RampLatency = [deque(maxlen = 20) for i in range(self.INVERTER_COUNT)]
+        self.LastAckTime = [None for i in range(self.INVERTER_COUNT)]
+        self.StepInverters = set()
+        self.Step = None
+        # informational reads in the background, the reason to stop the regulation found by one of them
+        self.InfoScheduler = InfoScheduler(self)
+        self.StopReason = None
+        # cached values for the status API
+        self.LastPowermeterWatts = (None, None)
+        self.LimitSetpoint = None
+        # control quality of the current day: the counters, the last powermeter sample and the load step in progress (start, direction)
+        self.Kpi = self.GetEmptyKpi()
+        self.LastKpiSample = None
+        self.KpiStep = None
+        if not settingsOnly:
+            self.LoadKpi()
+
+    def GetStatus(self):
+        # the cached state of this controller, built from memory only
+        Status = {
+            'powermeter_watts': self.LastPowermeterWatts[0],
+            'powermeter_time': self.LastPowermeterWatts[1],
+            'powermeter_confidence': round(self.PowermeterConfidence, 2),
+            'actual_power_confidence': round(self.ActualPowerConfidence, 2),
+            'limit_setpoint': self.LimitSetpoint,
+            'inverters': [{
+                'serial_number': self.SERIAL_NUMBER[i],
+                'name': self.NAME[i],
+                'available': self.AVAILABLE[i],
+                'limit': self.CURRENT_LIMIT[i],
+                'limit_acknowledged': self.LASTLIMITACKNOWLEDGED[i],
+                'temperature': self.TEMPERATURE[i],
+                'max_watt': self.HOY_MAX_WATT[i],
+                'battery_mode': self.HOY_BATTERY_MODE[i],
+                'battery_good_voltage': self.HOY_BATTERY_GOOD_VOLTAGE[i],
+                'panel_min_voltage': self.HOY_PANEL_VOLTAGE_LIST[i][-1] if self.HOY_PANEL_VOLTAGE_LIST[i] else None,
+                'ack_seconds': self.GetMedianLatency(self.AckLatency[i]),
+                'ramp_seconds': self.GetMedianLatency(self.RampLatency[i])
+            } for i in range(self.INVERTER_COUNT)],
+            'kpi': self.GetKpi(self.Kpi)
+        }
+        if getattr(self.DTU, 'ip', None) in RATE_LIMITERS:
+            Status['dtu_requests'] = RATE_LIMITERS[self.DTU.ip].GetStatistics()
+        return Status
+
+    def GetConfigMtimes(self):
+        Mtimes = []
+        for configFile in self.ConfigFiles:
+            try:
+                Mtimes.append(os.stat(configFile).st_mtime_ns)
+            except OSError:
+                Mtimes.append(None)
+        return Mtimes
+
+    def GetConfigValue(self, pConfig: ConfigParser, pSection: str, pKey: str, pType, pFallback):
+        if pType == int:
+            return pConfig.getint(pSection, pKey, fallback = pFallback)
+        if pType == float:
+            return pConfig.getfloat(pSection, pKey, fallback = pFallback)
+        if pType == bool:
+            return pConfig.getboolean(pSection, pKey, fallback = pFallback)
+        return pConfig.get(pSection, pKey, fallback = pFallback)
+
+    def ReloadConfig(self):
+        # called once per loop: re-read the config files if they changed and apply the changed reloadable settings all at once
+        Mtimes = self.GetConfigMtimes()
+        if Mtimes == self.ConfigMtimes:
+            return
+        self.ConfigMtimes = Mtimes
+        try:
+            config = ConfigParser()
+            config.read(self.ConfigFiles)
+            ChangedSections = [section for section in set(config.sections()) | set(self.config.sections())
+                               if (not config.has_section(section)) or (not self.config.has_section(section)) or (dict(config[section]) != dict(self.config[section]))]
+            if not ChangedSections:
+                return
+
+            # read and validate everything first, nothing is applied if one value is invalid
+            Settings = {}
+            for section, key, valueType in self.RELOADABLE_SETTINGS:
+                Settings[key] = self.GetConfigValue(config, section, key, valueType, getattr(self, key))
+            InverterSettings = {key: [] for key, valueType in self.RELOADABLE_INVERTER_SETTINGS}
+            for i in range(self.INVERTER_COUNT):
+                for key, valueType in self.RELOADABLE_INVERTER_SETTINGS:
+                    InverterSettings[key].append(self.GetConfigValue(config, 'INVERTER_' + str(i + 1), key, valueType, getattr(self, key)[i]))
+                InverterSettings['HOY_BATTERY_NORMAL_WATT'][i] = min(InverterSettings['HOY_BATTERY_NORMAL_WATT'][i], InverterSettings['HOY_MAX_WATT'][i])
+            if (Settings['POLL_INTERVAL_IN_SECONDS'] <= 0) or (Settings['POLL_INTERVAL_IN_SECONDS'] > Settings['LOOP_INTERVAL_IN_SECONDS']):
+                raise ValueError('POLL_INTERVAL_IN_SECONDS must be > 0 and <= LOOP_INTERVAL_IN_SECONDS')
+            if any(maxWatt <= 0 for maxWatt in InverterSettings['HOY_MAX_WATT']):
+                raise ValueError('HOY_MAX_WATT must be > 0')
+            if (Settings['FILTER_EWMA_ALPHA'] <= 0) or (Settings['FILTER_EWMA_ALPHA'] > 1):
+                raise ValueError('FILTER_EWMA_ALPHA must be > 0 and <= 1')
+            if Settings['POWERMETER_MAX_POINT'] < (Settings['POWERMETER_TARGET_POINT'] + Settings['POWERMETER_TOLERANCE']):
+                Settings['POWERMETER_MAX_POINT'] = Settings['POWERMETER_TARGET_POINT'] + Settings['POWERMETER_TOLERANCE'] + 50
+                logger.info('Warning: POWERMETER_MAX_POINT < POWERMETER_TARGET_POINT + POWERMETER_TOLERANCE. Setting POWERMETER_MAX_POINT to ' + str(Settings['POWERMETER_MAX_POINT']))
+        except Exception as e:
+            logger.error('Config reload failed, keeping the current settings: %s', e)
+            return
+
+        ReloadableSections = ['COMMON', 'CONTROL'] + ['INVERTER_' + str(i + 1) for i in range(self.INVERTER_COUNT)]
+        Changes = []
+        for section in ChangedSections:
+            if section not in ReloadableSections:
+                logger.info('Config reload: changes in section [%s] need a restart', section)
+        for key, value in Settings.items():
+            if getattr(self, key) != value:
+                Changes.append(f'{key}={value}')
+                setattr(self, key, value)
+        for i in range(self.INVERTER_COUNT):
+            if self.HOY_BATTERY_MODE[i]:
+                # HOY_MAX_WATT of battery inverters follows the battery state
+                if self.HOY_MAX_WATT[i] == self.HOY_BATTERY_REDUCE_WATT[i]:
+                    InverterSettings['HOY_MAX_WATT'][i] = InverterSettings['HOY_BATTERY_REDUCE_WATT'][i]
+                elif self.HOY_MAX_WATT[i] == self.HOY_BATTERY_NORMAL_WATT[i]:
+                    InverterSettings['HOY_MAX_WATT'][i] = InverterSettings['HOY_BATTERY_NORMAL_WATT'][i]
+        for key, values in InverterSettings.items():
+            for i in range(self.INVERTER_COUNT):
+                if getattr(self, key)[i] != values[i]:
+                    Changes.append(f'INVERTER_{i + 1}.{key}={values[i]}')
+                    getattr(self, key)[i] = values[i]
+        for i in range(self.INVERTER_COUNT):
+            self.HOY_MIN_WATT[i] = int(self.HOY_INVERTER_WATT[i] * self.HOY_MIN_WATT_IN_PERCENT[i] / 100)
+        self.SLOW_APPROX_LIMIT = CastToInt(self.GetMaxWattFromAllInverters() * self.SLOW_APPROX_LIMIT_IN_PERCENT / 100)
+        self.config = config
+        if Changes:
+            # force the next SetLimit to distribute the limit with the new settings
+            self.LastLimit = self.LastLimitWithPriority = self.LastLimitMixedMode = -1
+            logger.info('Config reloaded: %s', ', '.join(Changes))
+
+    def GetCheckpoint(self, pSetpoint):
+        return {
+            'inverter_count': self.INVERTER_COUNT,
+            'setpoint': CastToInt(pSetpoint),
+            'serial_number': self.SERIAL_NUMBER,
+            'name': self.NAME,
+            'available': self.AVAILABLE,
+            'current_limit': self.CURRENT_LIMIT,
+            'limit_acknowledged': self.LASTLIMITACKNOWLEDGED,
+            'power_status': self.LastPowerStatus,
+            'battery_good_voltage': self.HOY_BATTERY_GOOD_VOLTAGE,
+            'max_watt': self.HOY_MAX_WATT,
+            'panel_voltage_list': self.HOY_PANEL_VOLTAGE_LIST,
+            'dtu': self.DTU.GetCheckpoint()
+        }
+
+    def WriteCheckpoint(self, pSetpoint):
+        if (self.CHECKPOINT_INTERVAL_IN_SECONDS <= 0) or (Monotonic() - self.LastCheckpointTime < self.CHECKPOINT_INTERVAL_IN_SECONDS):
+            return
+        Checkpoint = self.GetCheckpoint(pSetpoint)
+        # an unchanged state is only written again to keep the checkpoint from expiring, the time is not compared
+        State = json.dumps(Checkpoint)
+        if (State == self.LastCheckpoint) and (Monotonic() - self.LastCheckpointTime < self.CHECKPOINT_MAX_AGE_IN_SECONDS / 2):
+            return
+        self.LastCheckpointTime = Monotonic()
+        try:
+            WriteFileAtomic(self.CheckpointFile, json.dumps(dict(Checkpoint, time=time.time())))
+            self.LastCheckpoint = State
+        except Exception as e:
+            logger.error('Exception at WriteCheckpoint: %s', e)
+
+    def ResumeFromCheckpoint(self):
+        # warm start: take over the state of the last run if the checkpoint is recent and matches the live DTU. returns the limit setpoint or None
+        if self.CHECKPOINT_INTERVAL_IN_SECONDS <= 0:
+            return None
+        try:
+            with open(self.CheckpointFile) as f:
+                Checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error('Checkpoint %s is not readable: %s', self.CheckpointFile, e)
+            return None
+        try:
+            Age = time.time() - Checkpoint['time']
+            if (Checkpoint['inverter_count'] != self.INVERTER_COUNT) or (Age < 0) or (Age > self.CHECKPOINT_MAX_AGE_IN_SECONDS):
+                logger.info('Checkpoint is outdated or does not match the configuration: cold start')
+                return None
+            for i in range(self.INVERTER_COUNT):
+                if (self.SERIAL_NUMBER[i] != '') and (self.SERIAL_NUMBER[i] != Checkpoint['serial_number'][i]):
+                    logger.info('Checkpoint serial number of inverter %s does not match the configuration: cold start', i)
+                    return None
+            # the DTU is asked by serial number (OpenDTU: an empty one reads the first inverter), so the serials of the checkpoint are used from here
+            ConfiguredSerialNumbers = list(self.SERIAL_NUMBER)
+            self.SERIAL_NUMBER[:] = Checkpoint['serial_number']
+            for i in range(self.INVERTER_COUNT):
+                if self.DTU.GetAvailable(i) != Checkpoint['available'][i]:
+                    logger.info('Checkpoint availability of inverter %s does not match the DTU: cold start', i)
+                    self.SERIAL_NUMBER[:] = ConfiguredSerialNumbers
+                    return None
+            self.NAME[:] = Checkpoint['name']
+            self.AVAILABLE[:] = Checkpoint['available']
+            self.CURRENT_LIMIT[:] = Checkpoint['current_limit']
+            self.LASTLIMITACKNOWLEDGED[:] = Checkpoint['limit_acknowledged']
+            self.LastPowerStatus[:] = Checkpoint['power_status']
+            # only the battery state is taken over, the configured max watt of all other inverters wins over the checkpoint.
+            # A saved max which is neither the configured reduce nor normal watt is recomputed by GetCheckBattery
+            for i in range(self.INVERTER_COUNT):
+                if not self.HOY_BATTERY_MODE[i]:
+                    continue
+                if Checkpoint['max_watt'][i] in (self.HOY_BATTERY_REDUCE_WATT[i], self.HOY_BATTERY_NORMAL_WATT[i]):
+                    self.HOY_BATTERY_GOOD_VOLTAGE[i] = Checkpoint['battery_good_voltage'][i]
+                    self.HOY_MAX_WATT[i] = Checkpoint['max_watt'][i]
+                self.HOY_PANEL_VOLTAGE_LIST[i] = Checkpoint['panel_voltage_list'][i]
+            self.DTU.SetCheckpoint(Checkpoint['dtu'])
+            # a limit the inverter does not report any more (e.g. restarted inverter) is sent again
+            for i in range(self.INVERTER_COUNT):
+                if not self.AVAILABLE[i]:
+                    continue
+                try:
+                    if abs(self.DTU.GetActualLimit(i) - self.CURRENT_LIMIT[i]) > self.HOY_INVERTER_WATT[i] * 2 / 100:
+                        self.LASTLIMITACKNOWLEDGED[i] = False
+                except Exception as e:
+                    logger.error('Exception at GetActualLimit, Inverter "%s": %s', self.NAME[i], e)
+                    self.LASTLIMITACKNOWLEDGED[i] = False
+            Setpoint = CastToInt(Checkpoint['setpoint'])
+            self.LastLimit = self.LastLimitWithPriority = self.LastLimitMixedMode = Setpoint
+            self.LastLimitAck = self.LastLimitAckWithPriority = self.LastLimitAckMixedMode = all(self.LASTLIMITACKNOWLEDGED[i] for i in range(self.INVERTER_COUNT) if self.AVAILABLE[i])
+            logger.info('Warm start from checkpoint (%s seconds old): limit setpoint %s Watt', CastToInt(Age), Setpoint)
+            return Setpoint
+        except Exception as e:
+            logger.error('Exception at ResumeFromCheckpoint: %s', e)
+            return None
+
+    def SendInverterLimit(self, pInverterId, pLimit):
+        # skip limits the DTU would send with the same value as the acknowledged one (e.g. same percent for OpenDTU).
+        # while a command waits for its ack, newer limits replace each other and only the newest is sent afterwards
+        with self.LimitCommandLock:
+            if self.LimitCommandActive[pInverterId]:
+                if self.PendingLimit[pInverterId] is not None:
+                    logger.info('Inverter "%s": limit %s Watt superseded by %s Watt', self.NAME[pInverterId], CastToInt(self.PendingLimit[pInverterId]), CastToInt(pLimit))
+                self.PendingLimit[pInverterId] = pLimit
+                self.StepInverters.add(pInverterId)
+                return
+            if self.IsLimitOnWire(pInverterId, pLimit):
+                return
+            self.StepInverters.add(pInverterId)
+            self.PendingLimit[pInverterId] = pLimit
+            self.LimitCommandActive[pInverterId] = True
+        if (WORKER_POOL is not None) and not ((CASSETTE is not None) and CASSETTE.replay and CASSETTE.fast):
+            WORKER_POOL.submit(self.RunOnSiteThread, self.RunLimitCommands, pInverterId)
+        else:
+            self.RunLimitCommands(pInverterId)
+
+    def IsLimitOnWire(self, pInverterId, pLimit):
+        return self.LASTLIMITACKNOWLEDGED[pInverterId] and (self.DTU.GetLimitOnWire(pInverterId, pLimit) == self.DTU.GetLimitOnWire(pInverterId, self.CURRENT_LIMIT[pInverterId]))
+
+    def RunLimitCommands(self, pInverterId):
+        while True:
+            with self.LimitCommandLock:
+                Limit = self.PendingLimit[pInverterId]
+                self.PendingLimit[pInverterId] = None
+                if (Limit is None) or self.IsLimitOnWire(pInverterId, Limit):
+                    self.LimitCommandActive[pInverterId] = False
+                    return
+                self.LASTLIMITACKNOWLEDGED[pInverterId] = True
+                self.LastAckTime[pInverterId] = None
+            Start = Monotonic()
+            with self.LimitCommandLock:
+                self.Kpi['limit_commands'] += 1
+            try:
+                with WATCHDOG.Phase(self.Name + ': set limit of inverter ' + self.NAME[pInverterId], self.SET_LIMIT_TIMEOUT_SECONDS):
+                    self.DTU.SetLimit(pInverterId, Limit)
+                    Ack = self.DTU.WaitForAck(pInverterId, self.SET_LIMIT_TIMEOUT_SECONDS)
+            except Exception as e:
+                logger.error('Exception at SetLimit of inverter "%s": %s', self.NAME[pInverterId], e)
+                Ack = False
+            with self.LimitCommandLock:
+                if Ack:
+                    self.LastAckTime[pInverterId] = Monotonic()
+                    self.AckLatency[pInverterId].append(self.LastAckTime[pInverterId] - Start)
+                else:
+                    # a timeout counts with the full timeout, so an inverter which often misses its ack becomes slow
+                    self.AckLatency[pInverterId].append(self.SET_LIMIT_TIMEOUT_SECONDS)
+                    self.LASTLIMITACKNOWLEDGED[pInverterId] = False
+                    self.LastLimitAck = self.LastLimitAckWithPriority = self.LastLimitAckMixedMode = False
+
+    def GetMedianLatency(self, pLatencies):
+        if not pLatencies:
+            return None
+        return round(sorted(pLatencies)[len(pLatencies) // 2], 1)
+
+    def IsSlowInverter(self, pInverterId):
+        # slow inverters usually need more than half the loop interval to acknowledge and apply a limit: the regulation does not wait for them
+        AckLatency = self.GetMedianLatency(self.AckLatency[pInverterId])
+        if AckLatency is None:
+            return False
+        return AckLatency + (self.GetMedianLatency(self.RampLatency[pInverterId]) or 0) > self.LOOP_INTERVAL_IN_SECONDS / 2
+
+    def SetLimitStep(self, pLimit, pPreviousLimit, pPowermeterWatts):
+        # set the limit and remember which inverters got a new command: the adaptive cadence waits for exactly these
+        with self.LimitCommandLock:
+            self.StepInverters = set()
+        self.SetLimit(pLimit)
+        with self.LimitCommandLock:
+            Inverters = self.StepInverters
+        if Inverters:
+            self.PowermeterFilter.Reset()
+        self.Step = None
+        if self.ADAPTIVE_LOOP_INTERVAL and Inverters:
+            self.Step = {'inverters': Inverters, 'start': Monotonic(), 'watts': pPowermeterWatts, 'change': pLimit - pPreviousLimit}
+
+    def IsStepApplied(self, pPowermeterWatts):
+        # the last limit step is applied when all fast inverters of the step acknowledged their limit and the powermeter
+        # moved by ADAPTIVE_LOOP_SETTLE_PERCENT of the limit change (or is within the tolerance of the target point)
+        if self.Step is None:
+            return False
+        with self.LimitCommandLock:
+            FastInverters = [i for i in self.Step['inverters'] if not self.IsSlowInverter(i)]
+            if not FastInverters:
+                return False
+            if any(self.LimitCommandActive[i] or (self.LastAckTime[i] is None) for i in FastInverters):
+                return False
+            AckTimes = [self.LastAckTime[i] for i in FastInverters]
+        Change = self.Step['change']
+        Moved = self.Step['watts'] - pPowermeterWatts
+        InTolerance = abs(pPowermeterWatts - self.POWERMETER_TARGET_POINT) <= self.POWERMETER_TOLERANCE
+        if not InTolerance and ((Change == 0) or (Moved * (1 if Change > 0 else -1) < abs(Change) * self.ADAPTIVE_LOOP_SETTLE_PERCENT / 100)):
+            return False
+        Now = Monotonic()
+        for i, AckTime in zip(FastInverters, AckTimes):
+            self.RampLatency[i].append(Now - AckTime)
+        logger.info('Adaptive cadence: limit step applied after %.1f seconds', Now - self.Step['start'])
+        self.Step = None
+        return True
+
+    def WaitForLimitStep(self, pSeconds):
+        # sleep for pSeconds, with the adaptive cadence only until the last limit step is applied: returns the powermeter reading
+        # which showed the applied step or None
+        if self.Step is None:
+            Sleep(pSeconds)
+            return None
+        End = Monotonic() + pSeconds
+        while Monotonic() < End:
+            Sleep(max(0, min(self.POLL_INTERVAL_IN_SECONDS, End - Monotonic())))
+            powermeterWatts = self.GetPowermeterWatts()
+            if self.PowermeterConfidence == 1 and self.IsStepApplied(powermeterWatts):
+                return powermeterWatts
+        return None
+
+    def SetLimitWithPriority(self, pLimit):
+        try:
+            if (self.LastLimitWithPriority == CastToInt(pLimit)) and self.LastLimitAckWithPriority:
+                logger.info("Inverterlimit was already accepted at %s Watt",CastToInt(pLimit))
+                return
+            if (self.LastLimitWithPriority == CastToInt(pLimit)) and not self.LastLimitAckWithPriority:
+                logger.info("Inverterlimit %s Watt was previously not accepted by at least one inverter, trying again...",CastToInt(pLimit))
+
+            logger.info("setting new limit to %s Watt",CastToInt(pLimit))
+            self.LastLimitWithPriority = CastToInt(pLimit)
+            self.LastLimitAckWithPriority = True
+            if (CastToInt(pLimit) <= self.GetMinWattFromAllInverters()):
+                pLimit = 0 # set only minWatt for every inv.
+            RemainingLimit = CastToInt(pLimit)
+            for j in range (1,6):
+                if self.GetMaxWattFromAllInvertersSamePrio(j) <= 0:
+                    continue
+                if RemainingLimit >= self.GetMaxWattFromAllInvertersSamePrio(j):
+                    LimitPrio = self.GetMaxWattFromAllInvertersSamePrio(j)
+                else:
+                    LimitPrio = RemainingLimit
+                RemainingLimit = RemainingLimit - LimitPrio
+
+                for i in range(self.INVERTER_COUNT):
+                    if (not self.AVAILABLE[i]) or (not self.HOY_BATTERY_GOOD_VOLTAGE[i]):
+                        continue
+                    if self.HOY_BATTERY_PRIORITY[i] != j:
+                        continue
+                    Factor = self.HOY_MAX_WATT[i] / self.GetMaxWattFromAllInvertersSamePrio(j)
+                    NewLimit = CastToInt(LimitPrio*Factor)
+                    NewLimit = self.ApplyLimitsToSetpointInverter(i, NewLimit)
+                    if self.HOY_COMPENSATE_WATT_FACTOR[i] != 1:
+                        logger.info('Ahoy: Inverter "%s": compensate Limit from %s Watt to %s Watt', self.NAME[i], CastToInt(NewLimit), CastToInt(NewLimit*self.HOY_COMPENSATE_WATT_FACTOR[i]))
+                        NewLimit = CastToInt(NewLimit * self.HOY_COMPENSATE_WATT_FACTOR[i])
+                        NewLimit = self.ApplyLimitsToMaxInverterLimits(i, NewLimit)
+
+                    self.SendInverterLimit(i, NewLimit)
+        except:
+            logger.error("Exception at SetLimitWithPriority")
+            self.LastLimitAckWithPriority = False
+            raise
+
+    def SetLimitMixedModeWithPriority(self, pLimit):
+        try:
+            if (self.LastLimitMixedMode == CastToInt(pLimit)) and self.LastLimitAckMixedMode:
+                logger.info("Inverterlimit was already accepted at %s Watt",CastToInt(pLimit))
+                return
+            if (self.LastLimitMixedMode == CastToInt(pLimit)) and not self.LastLimitAckMixedMode:
+                logger.info("Inverterlimit %s Watt was previously not accepted by at least one inverter, trying again...",CastToInt(pLimit))
+
+            logger.info("setting new limit to %s Watt",CastToInt(pLimit))
+            self.LastLimitMixedMode = CastToInt(pLimit)
+            self.LastLimitAckMixedMode = True
+            if (CastToInt(pLimit) <= self.GetMinWattFromAllInverters()):
+                pLimit = 0 # set only minWatt for every inv.
+            RemainingLimit = CastToInt(pLimit)
+
+            # Handle non-battery inverters first
+            if RemainingLimit >= self.GetMaxInverterWattFromAllNonBatteryInverters():
+                nonBatteryInvertersLimit = self.GetMaxInverterWattFromAllNonBatteryInverters()
+            else:
+                nonBatteryInvertersLimit = RemainingLimit
+
+            for i in range(self.INVERTER_COUNT):
+                if not self.AVAILABLE[i] or self.HOY_BATTERY_MODE[i]:
+                    continue
+
+                # Calculate proportional limit for non-battery inverters
+                nonBatteryMaxWatt = sum(self.HOY_MAX_WATT[i] for i in range(self.INVERTER_COUNT) if not self.HOY_BATTERY_MODE[i] and self.AVAILABLE[i])
+                Factor = self.HOY_MAX_WATT[i] / nonBatteryMaxWatt
+                NewLimit = CastToInt(nonBatteryInvertersLimit * Factor)
+
+                # Apply the calculated limit to the inverter
+                NewLimit = self.ApplyLimitsToSetpointInverter(i, NewLimit)
+                if self.HOY_COMPENSATE_WATT_FACTOR[i] != 1:
+                    logger.info('Ahoy: Inverter "%s": compensate Limit from %s Watt to %s Watt', self.NAME[i], CastToInt(NewLimit), CastToInt(NewLimit*self.HOY_COMPENSATE_WATT_FACTOR[i]))
+                    NewLimit = CastToInt(NewLimit * self.HOY_COMPENSATE_WATT_FACTOR[i])
+                    NewLimit = self.ApplyLimitsToMaxInverterLimits(i, NewLimit)
+
+                self.SendInverterLimit(i, NewLimit)
+
+            # Adjust RemainingLimit based on what was assigned to non-battery inverters
+            RemainingLimit -= nonBatteryInvertersLimit
+
+            # Then handle battery inverters based on priority
+            for j in range(1, 6):
+                batteryMaxWattSamePrio = self.GetMaxWattFromAllBatteryInvertersSamePrio(j)
+                if batteryMaxWattSamePrio <= 0:
+                    continue
+
+                if RemainingLimit >= batteryMaxWattSamePrio:
+                    LimitPrio = batteryMaxWattSamePrio
                 else:
-                    time.sleep(POLL_INTERVAL_IN_SECONDS)
+                    LimitPrio = RemainingLimit
+                RemainingLimit = RemainingLimit - LimitPrio
+
+                for i in range(self.INVERTER_COUNT):
+                    if (not self.HOY_BATTERY_MODE[i]):
+                        continue
+                    if (not self.AVAILABLE[i]) or (not self.HOY_BATTERY_GOOD_VOLTAGE[i]):
+                        continue
+                    if self.HOY_BATTERY_PRIORITY[i] != j:
+                        continue
+                    Factor = self.HOY_MAX_WATT[i] / batteryMaxWattSamePrio
+                    NewLimit = CastToInt(LimitPrio*Factor)
+                    NewLimit = self.ApplyLimitsToSetpointInverter(i, NewLimit)
+                    if self.HOY_COMPENSATE_WATT_FACTOR[i] != 1:
+                        logger.info('Ahoy: Inverter "%s": compensate Limit from %s Watt to %s Watt', self.NAME[i], CastToInt(NewLimit), CastToInt(NewLimit*self.HOY_COMPENSATE_WATT_FACTOR[i]))
+                        NewLimit = CastToInt(NewLimit * self.HOY_COMPENSATE_WATT_FACTOR[i])
+                        NewLimit = self.ApplyLimitsToMaxInverterLimits(i, NewLimit)
+
+                    self.SendInverterLimit(i, NewLimit)
+        except:
+            logger.error("Exception at SetLimitMixedModeWithPriority")
+            self.LastLimitAckMixedMode = False
+            raise
 
-            if MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER != 100:
-                CutLimit = CutLimitToProduction(newLimitSetpoint)
-                if CutLimit != newLimitSetpoint:
-                    newLimitSetpoint = CutLimit
-                    PreviousLimitSetpoint = newLimitSetpoint
+    def SetLimit(self, pLimit):
+        try:
+            if self.GetMixedMode():
+                self.SetLimitMixedModeWithPriority(CastToInt(pLimit))
+                return
+            if self.GetBatteryMode() and self.GetPriorityMode():
+                self.SetLimitWithPriority(CastToInt(pLimit))
+                return
 
-            if powermeterWatts > POWERMETER_MAX_POINT:
-                continue
 
-            # producing too much power: reduce limit
-            if powermeterWatts < (POWERMETER_TARGET_POINT - POWERMETER_TOLERANCE):
-                if PreviousLimitSetpoint >= GetMaxWattFromAllInverters():
-                    hoymilesActualPower = GetHoymilesActualPower()
-                    newLimitSetpoint = hoymilesActualPower + powermeterWatts - POWERMETER_TARGET_POINT
-                    LimitDifference = abs(hoymilesActualPower - newLimitSetpoint)
-                    if LimitDifference > SLOW_APPROX_LIMIT:
-                        newLimitSetpoint = newLimitSetpoint + (LimitDifference * SLOW_APPROX_FACTOR_IN_PERCENT / 100)
-                    if newLimitSetpoint > hoymilesActualPower:
-                        newLimitSetpoint = hoymilesActualPower
-                    logger.info("overproducing: reduce limit based on actual power")
+            if (self.LastLimit == CastToInt(pLimit)) and self.LastLimitAck:
+                logger.info("Inverterlimit was already accepted at %s Watt",CastToInt(pLimit))
+                return
+            if (self.LastLimit == CastToInt(pLimit)) and not self.LastLimitAck:
+                logger.info("Inverterlimit %s Watt was previously not accepted by at least one inverter, trying again...",CastToInt(pLimit))
+
+            logger.info("setting new limit to %s Watt",CastToInt(pLimit))
+            self.LastLimit = CastToInt(pLimit)
+            self.LastLimitAck = True
+            if (CastToInt(pLimit) <= self.GetMinWattFromAllInverters()):
+                pLimit = 0 # set only minWatt for every inv.
+            for i in range(self.INVERTER_COUNT):
+                if (not self.AVAILABLE[i]) or (not self.HOY_BATTERY_GOOD_VOLTAGE[i]):
+                    continue
+                Factor = self.HOY_MAX_WATT[i] / self.GetMaxWattFromAllInverters()
+                NewLimit = CastToInt(pLimit*Factor)
+                NewLimit = self.ApplyLimitsToSetpointInverter(i, NewLimit)
+                if self.HOY_COMPENSATE_WATT_FACTOR[i] != 1:
+                    logger.info('Ahoy: Inverter "%s": compensate Limit from %s Watt to %s Watt', self.NAME[i], CastToInt(NewLimit), CastToInt(NewLimit*self.HOY_COMPENSATE_WATT_FACTOR[i]))
+                    NewLimit = CastToInt(NewLimit * self.HOY_COMPENSATE_WATT_FACTOR[i])
+                    NewLimit = self.ApplyLimitsToMaxInverterLimits(i, NewLimit)
+
+                self.SendInverterLimit(i, NewLimit)
+
+        except:
+            logger.error("Exception at SetLimit")
+            self.LastLimitAck = False
+            raise
+
+    def ForEachInverter(self, pFunction):
+        # call pFunction(i) for all inverters in parallel on the worker pool and return the results
+        if (WORKER_POOL is None) or (self.INVERTER_COUNT == 1):
+            return [pFunction(i) for i in range(self.INVERTER_COUNT)]
+        return list(WORKER_POOL.map(lambda i: self.RunOnSiteThread(pFunction, i), range(self.INVERTER_COUNT)))
+
+    def RunOnSiteThread(self, pFunction, *args):
+        # a pool thread is named like the site while it works for it, so its log lines keep the [site] prefix
+        Thread = threading.current_thread()
+        ThreadName = Thread.name
+        Thread.name = self.Name
+        try:
+            return pFunction(*args)
+        finally:
+            Thread.name = ThreadName
+
+    def GetInverterAvailable(self, pInverterId):
+        try:
+            with WATCHDOG.Phase(self.Name + ': availability of inverter ' + self.NAME[pInverterId]):
+                return self.DTU.GetAvailable(pInverterId)
+        except Exception as e:
+            logger.error("Exception at GetHoymilesAvailable, Inverter %s (%s) not reachable", pInverterId, self.NAME[pInverterId])
+            if hasattr(e, 'message'):
+                logger.error(e.message)
+            else:
+                logger.error(e)
+            return False
+
+    def GetHoymilesAvailable(self):
+        try:
+            WasAvail = list(self.AVAILABLE)
+            self.AVAILABLE[:] = self.ForEachInverter(self.GetInverterAvailable)
+            NewAvailable = False
+            for i in range(self.INVERTER_COUNT):
+                if self.AVAILABLE[i] and not WasAvail[i]:
+                    NewAvailable = True
+                    self.LastLimit = CastToInt(0)
+                    self.LastLimitAck = bool(False)
+                    self.LastLimitWithPriority = CastToInt(0)
+                    self.LastLimitAckWithPriority = bool(False)
+                    self.LASTLIMITACKNOWLEDGED[i] = False
+            if NewAvailable:
+                self.GetHoymilesInfo()
+            return any(self.AVAILABLE)
+        except:
+            logger.error('Exception at GetHoymilesAvailable')
+            raise
+
+    def GetInverterInfo(self, pInverterId, pRaise = False):
+        # pRaise: the info scheduler retries the read later, e.g. after the rate limiter dropped it
+        try:
+            if not self.AVAILABLE[pInverterId]:
+                return
+            with WATCHDOG.Phase(self.Name + ': info of inverter ' + self.NAME[pInverterId]):
+                self.DTU.GetInfo(pInverterId)
+        except Exception as e:
+            logger.error('Exception at GetHoymilesInfo, Inverter "%s" not reachable', self.NAME[pInverterId])
+            if hasattr(e, 'message'):
+                logger.error(e.message)
+            else:
+                logger.error(e)
+            if pRaise:
+                raise
+
+    def GetHoymilesInfo(self):
+        try:
+            # only a serial number the DTU needs to address the inverter is read right away, names and temperatures in the background
+            Missing = [i for i in range(self.INVERTER_COUNT) if self.DTU.NEEDS_SERIAL_NUMBER and self.SERIAL_NUMBER[i] == '']
+            self.ForEachInverter(lambda i: self.GetInverterInfo(i) if i in Missing else None)
+            for i in range(self.INVERTER_COUNT):
+                if i not in Missing:
+                    self.InfoScheduler.Add(f'info of inverter {i}', lambda i=i: self.GetInverterInfo(i, True))
+        except:
+            logger.error("Exception at GetHoymilesInfo")
+            raise
+
+    def IsControlIdle(self):
+        # no limit command in flight and no limit step the regulation waits for
+        with self.LimitCommandLock:
+            if any(self.LimitCommandActive):
+                return False
+        Step = self.Step
+        return (Step is None) or (Monotonic() - Step['start'] > self.LOOP_INTERVAL_IN_SECONDS)
+
+    def ScheduleInfoReads(self):
+        for i in range(self.INVERTER_COUNT):
+            if self.LOG_TEMPERATURE:
+                self.InfoScheduler.Add(f'temperature of inverter {i}', lambda i=i: self.GetInverterTemperature(i), True)
+            else:
+                self.InfoScheduler.Remove(f'temperature of inverter {i}')
+
+    def CheckDtuVersion(self):
+        with WATCHDOG.Phase(self.Name + ': DTU version'):
+            self.DTU.CheckMinVersion()
+
+    def GetHoymilesPanelMinVoltage(self, pInverterId):
+        try:
+            if not self.AVAILABLE[pInverterId]:
+                return 0
+
+            with WATCHDOG.Phase(self.Name + ': panel voltage of inverter ' + self.NAME[pInverterId]):
+                self.HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId].append(self.DTU.GetPanelMinVoltage(pInverterId))
+
+            # calculate mean over last x values
+            if len(self.HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId]) > 5:
+                self.HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId].pop(0)
+            from statistics import mean
+
+            logger.info('Average min-panel voltage, inverter "%s": %s Volt',self.NAME[pInverterId], mean(self.HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId]))
+            return mean(self.HOY_PANEL_MIN_VOLTAGE_HISTORY_LIST[pInverterId])
+        except:
+            logger.error("Exception at GetHoymilesPanelMinVoltage, Inverter %s not reachable", pInverterId)
+            raise
+
+    def SetHoymilesPowerStatus(self, pInverterId, pActive):
+        try:
+            if not self.AVAILABLE[pInverterId]:
+                return
+            if self.SET_POWERSTATUS_CNT > 0:
+                if self.LastPowerStatus[pInverterId] == pActive:
+                    self.SamePowerStatusCnt[pInverterId] = self.SamePowerStatusCnt[pInverterId] + 1
                 else:
-                    newLimitSetpoint = PreviousLimitSetpoint + powermeterWatts - POWERMETER_TARGET_POINT
-                    # check if it is necessary to approximate to the setpoint with some more passes. this reduce overshoot
-                    LimitDifference = abs(PreviousLimitSetpoint - newLimitSetpoint)
-                    if LimitDifference > SLOW_APPROX_LIMIT:
-                        logger.info("overproducing: reduce limit based on previous limit setpoint by approximation")
-                        newLimitSetpoint = newLimitSetpoint + (LimitDifference * SLOW_APPROX_FACTOR_IN_PERCENT / 100)
+                    self.LastPowerStatus[pInverterId] = pActive
+                    self.SamePowerStatusCnt[pInverterId] = 0
+                if self.SamePowerStatusCnt[pInverterId] > self.SET_POWERSTATUS_CNT:
+                    if pActive:
+                        logger.info("Retry Counter exceeded: Inverter PowerStatus already ON")
                     else:
-                        logger.info("overproducing: reduce limit based on previous limit setpoint")
+                        logger.info("Retry Counter exceeded: Inverter PowerStatus already OFF")
+                    return
+            with WATCHDOG.Phase(self.Name + ': power status of inverter ' + self.NAME[pInverterId], self.SET_POWER_STATUS_DELAY_IN_SECONDS):
+                self.DTU.SetPowerStatus(pInverterId, pActive)
+                Sleep(self.SET_POWER_STATUS_DELAY_IN_SECONDS)
+        except:
+            logger.error("Exception at SetHoymilesPowerStatus")
+            raise
+
+    def GetCheckBattery(self):
+        try:
+            result = False
+            for i in range(self.INVERTER_COUNT):
+                try:
+                    if not self.AVAILABLE[i]:
+                        continue
+                    if not self.HOY_BATTERY_MODE[i]:
+                        result = True
+                        continue
+                    # every battery inverter may need a power status delay and a voltage read: the progress deadline is per inverter
+                    self.SetWatchdogProgress()
+                    minVoltage = self.GetHoymilesPanelMinVoltage(i)
+
+                    if minVoltage <= self.HOY_BATTERY_THRESHOLD_OFF_LIMIT_IN_V[i]:
+                        self.SetHoymilesPowerStatus(i, False)
+                        self.HOY_BATTERY_GOOD_VOLTAGE[i] = False
+                        self.HOY_MAX_WATT[i] = self.HOY_BATTERY_REDUCE_WATT[i]
+
+                    elif minVoltage <= self.HOY_BATTERY_THRESHOLD_REDUCE_LIMIT_IN_V[i]:
+                        if self.HOY_MAX_WATT[i] != self.HOY_BATTERY_REDUCE_WATT[i]:
+                            self.HOY_MAX_WATT[i] = self.HOY_BATTERY_REDUCE_WATT[i]
+                            self.LastLimit = -1
+
+                    elif minVoltage >= self.HOY_BATTERY_THRESHOLD_ON_LIMIT_IN_V[i]:
+                        self.SetHoymilesPowerStatus(i, True)
+                        if not self.HOY_BATTERY_GOOD_VOLTAGE[i]:
+                            # through the command layer: it does not race a queued regulation command for this inverter
+                            self.SendInverterLimit(i, self.HOY_MIN_WATT[i])
+                            self.LastLimit = -1
+                        self.HOY_BATTERY_GOOD_VOLTAGE[i] = True
+                        self.HOY_MAX_WATT[i] = self.HOY_BATTERY_NORMAL_WATT[i]
+
+                    elif minVoltage >= self.HOY_BATTERY_THRESHOLD_NORMAL_LIMIT_IN_V[i]:
+                        if self.HOY_MAX_WATT[i] != self.HOY_BATTERY_NORMAL_WATT[i]:
+                            self.HOY_MAX_WATT[i] = self.HOY_BATTERY_NORMAL_WATT[i]
+                            self.LastLimit = -1
+
+                    if self.HOY_BATTERY_GOOD_VOLTAGE[i]:
+                        result = True
+                except:
+                    logger.error("Exception at CheckBattery, Inverter %s not reachable", i)
+            return result
+        except:
+            logger.error("Exception at CheckBattery")
+            raise
+
+    def GetInverterTemperature(self, pInverterId):
+        if not self.AVAILABLE[pInverterId]:
+            return
+        try:
+            with WATCHDOG.Phase(self.Name + ': temperature of inverter ' + self.NAME[pInverterId]):
+                self.DTU.GetTemperature(pInverterId)
+        except:
+            logger.error("Exception at GetHoymilesTemperature, Inverter %s not reachable", pInverterId)
+
+    def GetHoymilesActualPower(self):
+        try:
+            try:
+                with WATCHDOG.Phase(self.Name + ': intermediate meter'):
+                    Watts = abs(self.INTERMEDIATE_POWERMETER.GetPowermeterWatts())
+                logger.info(f"intermediate meter {self.INTERMEDIATE_POWERMETER.__class__.__name__}: {Watts} Watt")
+                self.ValueCache.Set('intermediate meter', Watts)
+                self.ActualPowerConfidence = 1.0
+                return Watts
+            except Exception as e:
+                logger.error("Exception at GetHoymilesActualPower")
+                if hasattr(e, 'message'):
+                    logger.error(e.message)
+                else:
+                    logger.error(e)
+                # a recent reading is cheaper than a request to every inverter, ActualPowerConfidence < 1 tells the regulation it is not current
+                LastGood = self.GetLastGoodValue('intermediate meter')
+                if LastGood is not None:
+                    Watts, self.ActualPowerConfidence = LastGood
+                    return Watts
+                logger.error("try reading actual power from DTU:")
+                with WATCHDOG.Phase(self.Name + ': actual power from DTU'):
+                    Watts = self.DTU.GetPowermeterWatts()
+                logger.info(f"intermediate meter {self.DTU.__class__.__name__}: {Watts} Watt")
+                self.ActualPowerConfidence = 1.0
+                return Watts
+        except:
+            logger.error("Exception at GetHoymilesActualPower")
+            if self.SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR:
+                self.SetLimit(0)
+            raise
+
+    def GetLastGoodValue(self, pSource, pError = None):
+        # the cached (value, confidence) of pSource after a failed read, None if it is older than LAST_GOOD_VALUE_MAX_AGE_IN_SECONDS
+        Cached = self.ValueCache.Get(pSource, self.LAST_GOOD_VALUE_MAX_AGE_IN_SECONDS)
+        if Cached is None:
+            return None
+        if pError is not None:
+            logger.error('Exception at reading the %s: %s', pSource, pError)
+        Value, Age, Confidence = Cached
+        logger.info('%s: using the last good value %s Watt (%.1f s old, confidence %.2f)', pSource, Value, Age, Confidence)
+        return Value, Confidence
+
+    def GetPowermeterWatts(self, pRecord = True):
+        # after a failed read the last good value is returned with PowermeterConfidence < 1, the regulation holds the limit then
+        # with pRecord = False the raw reading is returned and not yet traced, counted or filtered, see RecordPowermeterWatts
+        try:
+            try:
+                with WATCHDOG.Phase(self.Name + ': powermeter'):
+                    Watts = self.POWERMETER.GetPowermeterWatts()
+            except Exception as e:
+                LastGood = self.GetLastGoodValue('powermeter', e)
+                if LastGood is None:
+                    raise
+                Watts, self.PowermeterConfidence = LastGood
+                return Watts
+            logger.info(f"powermeter {self.POWERMETER.__class__.__name__}: {Watts} Watt")
+            self.ValueCache.Set('powermeter', Watts)
+            self.PowermeterConfidence = 1.0
+            if not pRecord:
+                return Watts
+            return self.RecordPowermeterWatts(Watts)
+        except:
+            logger.error("Exception at GetPowermeterWatts")
+            if self.SET_INVERTER_TO_MIN_ON_POWERMETER_ERROR:
+                self.SetLimit(0)        
+            raise
+
+    def RecordPowermeterWatts(self, pWatts):
+        # one call per regulation loop: every call adds a trace line, a KPI sample and a filter sample
+        self.LastPowermeterWatts = (pWatts, time.time())
+        self.WriteTrace(pWatts)
+        self.UpdateKpi(pWatts)
+        FilteredWatts = self.PowermeterFilter.Filter(self.GetRegulationSettings(), pWatts)
+        if FilteredWatts != pWatts:
+            logger.info('powermeter filtered: %s Watt%s', FilteredWatts, ' (pulsing load)' if self.PowermeterFilter.pulsing else '')
+        return FilteredWatts
+
+    def GetEmptyKpi(self):
+        return {
+            'date': time.strftime('%Y-%m-%d'),
+            'seconds': 0.0,
+            'imported_wh': 0.0,
+            'exported_wh': 0.0,
+            'outside_tolerance_seconds': 0.0,
+            'limit_commands': 0,
+            'load_steps': 0,
+            'settled_steps': 0,
+            'settling_seconds_sum': 0.0,
+            'settling_seconds_max': 0.0,
+            'overshoot_steps': 0,
+            'overshoot_watts_max': 0
+        }
+
+    def GetKpi(self, pKpi: dict):
+        # the counters rounded, with the averages and the limit commands per hour
+        Kpi = {key: round(value, 2) if isinstance(value, float) else value for key, value in pKpi.items()}
+        Kpi['settling_seconds_avg'] = round(pKpi['settling_seconds_sum'] / pKpi['settled_steps'], 1) if pKpi['settled_steps'] else None
+        Kpi['limit_commands_per_hour'] = round(pKpi['limit_commands'] * 3600 / pKpi['seconds'], 1) if pKpi['seconds'] else None
+        return Kpi
+
+    def UpdateKpi(self, pWatts):
+        # integrate the powermeter samples over monotonic time, O(1) memory
+        Now = Monotonic()
+        self.RollupKpi()
+        Kpi = self.Kpi
+        if self.LastKpiSample is not None:
+            LastTime, LastWatts = self.LastKpiSample
+            Duration = Now - LastTime
+            # a gap of more than a minute (e.g. DTU not reachable) is not integrated
+            if Duration <= 60:
+                Kpi['seconds'] += Duration
+                if LastWatts > 0:
+                    Kpi['imported_wh'] += LastWatts * Duration / 3600
+                else:
+                    Kpi['exported_wh'] -= LastWatts * Duration / 3600
+                if abs(LastWatts - self.POWERMETER_TARGET_POINT) > self.POWERMETER_TOLERANCE:
+                    Kpi['outside_tolerance_seconds'] += Duration
+        self.LastKpiSample = (Now, pWatts)
+
+        # a load step starts when the powermeter leaves the tolerance band and is settled when it is back in the band,
+        # overshoot is the deviation beyond the band on the opposite side of the step
+        Deviation = pWatts - self.POWERMETER_TARGET_POINT
+        if self.KpiStep is None:
+            if abs(Deviation) > self.POWERMETER_TOLERANCE:
+                self.KpiStep = [Now, 1 if Deviation > 0 else -1, 0]
+                Kpi['load_steps'] += 1
+        elif abs(Deviation) <= self.POWERMETER_TOLERANCE:
+            Settling = Now - self.KpiStep[0]
+            Kpi['settled_steps'] += 1
+            Kpi['settling_seconds_sum'] += Settling
+            Kpi['settling_seconds_max'] = max(Kpi['settling_seconds_max'], Settling)
+            if self.KpiStep[2] > 0:
+                Kpi['overshoot_steps'] += 1
+            self.KpiStep = None
+        else:
+            Overshoot = CastToInt(-self.KpiStep[1] * Deviation - self.POWERMETER_TOLERANCE)
+            if Overshoot > 0:
+                self.KpiStep[2] = max(self.KpiStep[2], Overshoot)
+                Kpi['overshoot_watts_max'] = max(Kpi['overshoot_watts_max'], Overshoot)
+
+    def RollupKpi(self):
+        # on a new day the counters of the last day are appended to the history and start from zero
+        if self.Kpi['date'] == time.strftime('%Y-%m-%d'):
+            return
+        self.WriteKpiHistory(self.Kpi)
+        with self.LimitCommandLock:
+            self.Kpi = self.GetEmptyKpi()
+        self.KpiStep = None
+
+    def WriteKpiHistory(self, pKpi: dict):
+        Kpi = self.GetKpi(pKpi)
+        logger.info('KPI %s: imported %s Wh, exported %s Wh, %s%% outside tolerance, %s load steps (settling avg %s s, max %s s, %s with overshoot up to %s Watt), %s limit commands per hour',
+                    Kpi['date'], Kpi['imported_wh'], Kpi['exported_wh'], round(100 * pKpi['outside_tolerance_seconds'] / pKpi['seconds'], 1) if pKpi['seconds'] else 0,
+                    Kpi['load_steps'], Kpi['settling_seconds_avg'], Kpi['settling_seconds_max'], Kpi['overshoot_steps'], Kpi['overshoot_watts_max'], Kpi['limit_commands_per_hour'])
+        try:
+            with open(self.KpiHistoryFile, 'a') as f:
+                f.write(json.dumps(Kpi) + '\n')
+        except Exception as e:
+            logger.error('Exception at WriteKpiHistory: %s', e)
+
+    def WriteKpi(self):
+        # the counters of the current day survive a restart, saved as often as the checkpoint
+        if (self.CHECKPOINT_INTERVAL_IN_SECONDS <= 0) or (Monotonic() - self.LastKpiTime < self.CHECKPOINT_INTERVAL_IN_SECONDS):
+            return
+        self.LastKpiTime = Monotonic()
+        try:
+            WriteFileAtomic(self.KpiFile, json.dumps(self.Kpi))
+        except Exception as e:
+            logger.error('Exception at WriteKpi: %s', e)
+
+    def LoadKpi(self):
+        try:
+            with open(self.KpiFile) as f:
+                Kpi = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error('KPI file %s is not readable: %s', self.KpiFile, e)
+            return
+        Kpi = dict(self.GetEmptyKpi(), **Kpi)
+        if Kpi['date'] == self.Kpi['date']:
+            self.Kpi = Kpi
+        else:
+            # the last run ended on an earlier day
+            self.WriteKpiHistory(Kpi)
 
-            # producing too little power: increase limit
-            elif powermeterWatts > (POWERMETER_TARGET_POINT + POWERMETER_TOLERANCE):
-                if PreviousLimitSetpoint < GetMaxWattFromAllInverters():
-                    newLimitSetpoint = PreviousLimitSetpoint + powermeterWatts - POWERMETER_TARGET_POINT
-                    logger.info("Not enough energy producing: increasing limit")
+    def WriteTrace(self, pWatts):
+        # one line per powermeter reading for the tuner (--tune): time, powermeter and the limit sent to the inverters
+        if self.TraceFile is None:
+            return
+        try:
+            with open(self.TraceFile, 'a') as f:
+                f.write(f'{time.time():.1f},{CastToInt(pWatts)},{CastToInt(sum(self.CURRENT_LIMIT))}\n')
+        except Exception as e:
+            logger.error('Exception at WriteTrace: %s', e)
+
+    def GetSample(self, pRead):
+        # stamp a reading with the monotonic middle of its request
+        Start = Monotonic()
+        Value = pRead()
+        return Value, (Start + Monotonic()) / 2
+
+    def ReadPowermeterWatts(self):
+        return self.GetPowermeterWatts(pRecord = False)
+
+    def GetUsedPowermeterWatts(self, pWatts):
+        # a last good value was already returned as is by GetPowermeterWatts and is not recorded again
+        if self.PowermeterConfidence < 1:
+            return pWatts
+        return self.RecordPowermeterWatts(pWatts)
+
+    def GetPowermeterAndActualPower(self):
+        # read grid meter and intermediate meter in parallel and return (powermeterWatts, hoymilesActualPower).
+        # hoymilesActualPower is None if both readings are more than MAX_SAMPLE_SKEW_IN_MILLISECONDS apart, they must not be combined then
+        # a skew miss reads both meters again, only the grid reading that is used is traced, counted and filtered
+        for Attempt in range(2):
+            if WORKER_POOL is not None:
+                ActualPowerFuture = WORKER_POOL.submit(self.RunOnSiteThread, self.GetSample, self.GetHoymilesActualPower)
+                PowermeterSample = self.GetSample(self.ReadPowermeterWatts)
+                ActualPowerSample = ActualPowerFuture.result()
+            else:
+                ActualPowerSample = self.GetSample(self.GetHoymilesActualPower)
+                PowermeterSample = self.GetSample(self.ReadPowermeterWatts)
+            Skew = abs(PowermeterSample[1] - ActualPowerSample[1]) * 1000
+            if Skew <= self.MAX_SAMPLE_SKEW_IN_MILLISECONDS:
+                if self.ActualPowerConfidence < 1:
+                    # a last good value of the intermediate meter is not used to cut or reduce the limit
+                    logger.info('Skip the actual power: no current intermediate meter reading (confidence %.2f)', self.ActualPowerConfidence)
+                    return self.GetUsedPowermeterWatts(PowermeterSample[0]), None
+                return self.GetUsedPowermeterWatts(PowermeterSample[0]), ActualPowerSample[0]
+            logger.info('powermeter and intermediate meter readings are %s ms apart (max %s ms)', CastToInt(Skew), self.MAX_SAMPLE_SKEW_IN_MILLISECONDS)
+        return self.GetUsedPowermeterWatts(PowermeterSample[0]), None
+
+    def CutLimitToProduction(self, pSetpoint, pActualPower):
+        if pSetpoint != self.GetMaxWattFromAllInverters():
+            if pActualPower is None:
+                logger.info('Skip cutting the limit to live-production: no coherent reading of the actual power')
+                return CastToInt(pSetpoint)
+            ActualPower = pActualPower
+            # prevent the setpoint from running away...
+            if pSetpoint > ActualPower + (self.GetMaxWattFromAllInverters() * self.MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER / 100):
+                pSetpoint = CastToInt(ActualPower + (self.GetMaxWattFromAllInverters() * self.MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER / 100))
+                logger.info('Cut limit to %s Watt, limit was higher than %s percent of live-production', CastToInt(pSetpoint), self.MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER)
+        return CastToInt(pSetpoint)
+
+    def ApplyLimitsToSetpoint(self, pSetpoint):
+        if pSetpoint > self.GetMaxWattFromAllInverters():
+            pSetpoint = self.GetMaxWattFromAllInverters()
+        if pSetpoint < self.GetMinWattFromAllInverters():
+            pSetpoint = self.GetMinWattFromAllInverters()
+        return pSetpoint
+
+    def ApplyLimitsToSetpointInverter(self, pInverter, pSetpoint):
+        if pSetpoint > self.HOY_MAX_WATT[pInverter]:
+            pSetpoint = self.HOY_MAX_WATT[pInverter]
+        if pSetpoint < self.HOY_MIN_WATT[pInverter]:
+            pSetpoint = self.HOY_MIN_WATT[pInverter]
+        return pSetpoint
+
+    def ApplyLimitsToMaxInverterLimits(self, pInverter, pSetpoint):
+        if pSetpoint > self.HOY_INVERTER_WATT[pInverter]:
+            pSetpoint = self.HOY_INVERTER_WATT[pInverter]
+        if pSetpoint < self.HOY_MIN_WATT[pInverter]:
+            pSetpoint = self.HOY_MIN_WATT[pInverter]
+        return pSetpoint
+
+    # Max possible Watts, can be reduced on battery mode
+    def GetMaxWattFromAllInverters(self):
+        maxWatt = 0
+        for i in range(self.INVERTER_COUNT):
+            if (not self.AVAILABLE[i]) or (not self.HOY_BATTERY_GOOD_VOLTAGE[i]):
+                continue
+            maxWatt = maxWatt + self.HOY_MAX_WATT[i]
+        return maxWatt
+
+    # Max possible Watts, can be reduced on battery mode
+    def GetMaxWattFromAllInvertersSamePrio(self, pPriority):
+        maxWatt = 0
+        for i in range(self.INVERTER_COUNT):
+            if (not self.AVAILABLE[i]) or (not self.HOY_BATTERY_GOOD_VOLTAGE[i]):
+                continue
+            if self.HOY_BATTERY_PRIORITY[i] == pPriority:
+                maxWatt = maxWatt + self.HOY_MAX_WATT[i]
+        return maxWatt
+
+    def GetMaxWattFromAllBatteryInvertersSamePrio(self, pPriority):
+        return sum(
+            self.HOY_MAX_WATT[i] for i in range(self.INVERTER_COUNT)
+            if self.AVAILABLE[i] and self.HOY_BATTERY_GOOD_VOLTAGE[i] and self.HOY_BATTERY_MODE[i] and self.HOY_BATTERY_PRIORITY[i] == pPriority
+        )
+
+    # Max possible Watts (physically) - Inverter Specification!
+    def GetMaxInverterWattFromAllInverters(self):
+        maxWatt = 0
+        for i in range(self.INVERTER_COUNT):
+            if (not self.AVAILABLE[i]) or (not self.HOY_BATTERY_GOOD_VOLTAGE[i]):
+                continue
+            maxWatt = maxWatt + self.HOY_INVERTER_WATT[i]
+        return maxWatt
+
+    def GetMaxInverterWattFromAllNonBatteryInverters(self):
+        return sum(
+            self.HOY_INVERTER_WATT[i] for i in range(self.INVERTER_COUNT)
+            if self.AVAILABLE[i] and not self.HOY_BATTERY_MODE[i] and self.HOY_BATTERY_GOOD_VOLTAGE[i]
+        )
+
+    def GetMinWattFromAllInverters(self):
+        minWatt = 0
+        for i in range(self.INVERTER_COUNT):
+            if (not self.AVAILABLE[i]) or (not self.HOY_BATTERY_GOOD_VOLTAGE[i]):
+                continue
+            minWatt = minWatt + self.HOY_MIN_WATT[i]
+        return minWatt
+
+    def GetRegulationSettings(self):
+        # everything GetLimitSetpoint needs, taken once per loop after availability and battery state are known
+        return {
+            'POWERMETER_TARGET_POINT': self.POWERMETER_TARGET_POINT,
+            'POWERMETER_TOLERANCE': self.POWERMETER_TOLERANCE,
+            'POWERMETER_MAX_POINT': self.POWERMETER_MAX_POINT,
+            'ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT': self.ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT,
+            'SLOW_APPROX_LIMIT': self.SLOW_APPROX_LIMIT,
+            'SLOW_APPROX_FACTOR_IN_PERCENT': self.SLOW_APPROX_FACTOR_IN_PERCENT,
+            'LOOP_INTERVAL_IN_SECONDS': self.LOOP_INTERVAL_IN_SECONDS,
+            'MAX_WATT': self.GetMaxWattFromAllInverters(),
+            'MAX_INVERTER_WATT': self.GetMaxInverterWattFromAllInverters(),
+            'MIN_WATT': self.GetMinWattFromAllInverters(),
+            'FILTER_WINDOW': self.FILTER_WINDOW,
+            'FILTER_HAMPEL_SIGMA': self.FILTER_HAMPEL_SIGMA,
+            'FILTER_EWMA_ALPHA': self.FILTER_EWMA_ALPHA,
+            'FILTER_PULSE_MIN_WATT': self.FILTER_PULSE_MIN_WATT,
+            'FILTER_PULSE_MIN_CYCLES': self.FILTER_PULSE_MIN_CYCLES
+        }
+
+    def GetMixedMode(self):
+        #if battery mode and custom priority use SetLimitWithPriority
+        for i in range(self.INVERTER_COUNT):
+            for j in range(self.INVERTER_COUNT):
+                if (self.HOY_BATTERY_MODE[i] != self.HOY_BATTERY_MODE[j]):
+                    return True
+        return False
+
+    def GetBatteryMode(self):
+        for i in range(self.INVERTER_COUNT):
+            if self.HOY_BATTERY_MODE[i]:
+                return True
+        return False
+
+    def GetPriorityMode(self):
+        for i in range(self.INVERTER_COUNT):
+            for j in range(self.INVERTER_COUNT):
+                if self.HOY_BATTERY_PRIORITY[i] != self.HOY_BATTERY_PRIORITY[j]:
+                    return True
+        return False
+
+    def CreatePowermeter(self) -> Powermeter:
+        BACKUP_POWERMETER_CONFIG = ""
+        HEDGE_PERCENTILE = 95
+        HTTP_PUSH_PORT = 0
+        HTTP_PUSH_BIND = "127.0.0.1"
+        HTTP_PUSH_ALLOWED_IPS = ""
+        HTTP_PUSH_JSON_PATH = "power"
+        HTTP_PUSH_MAX_AGE_IN_SECONDS = 10
+        VZL_UUID = None
+
+        powermeter = self.CreateSinglePowermeter(self.config)
+        backupConfigFiles = [x.strip() for x in self.config.get('SELECT_POWERMETER', 'BACKUP_POWERMETER_CONFIG', fallback = BACKUP_POWERMETER_CONFIG).split(',') if x.strip() != '']
+        if backupConfigFiles:
+            powermeters = [powermeter]
+            for backupConfigFile in backupConfigFiles:
+                backupConfig = ConfigParser()
+                if not backupConfig.read(Path.joinpath(self.ConfigDir, backupConfigFile)):
+                    raise Exception(f"Error: backup powermeter config {backupConfigFile} not found!")
+                logger.info("read backup powermeter config file: " + backupConfigFile)
+                powermeters.append(self.CreateSinglePowermeter(backupConfig))
+            powermeter = RedundantPowermeter(powermeters, self.config.getint('SELECT_POWERMETER', 'HEDGE_PERCENTILE', fallback = HEDGE_PERCENTILE))
+        if self.config.getint('HTTP_PUSH', 'HTTP_PUSH_PORT', fallback = HTTP_PUSH_PORT) > 0:
+            powermeter = HttpPushPowermeter(
+                powermeter,
+                self.config.get('HTTP_PUSH', 'HTTP_PUSH_BIND', fallback = HTTP_PUSH_BIND),
+                self.config.getint('HTTP_PUSH', 'HTTP_PUSH_PORT', fallback = HTTP_PUSH_PORT),
+                [x.strip() for x in self.config.get('HTTP_PUSH', 'HTTP_PUSH_ALLOWED_IPS', fallback = HTTP_PUSH_ALLOWED_IPS).split(',') if x.strip() != ''],
+                self.config.get('HTTP_PUSH', 'HTTP_PUSH_JSON_PATH', fallback = HTTP_PUSH_JSON_PATH),
+                self.config.get('VZLOGGER', 'VZL_UUID', fallback = VZL_UUID),
+                self.config.getint('HTTP_PUSH', 'HTTP_PUSH_MAX_AGE_IN_SECONDS', fallback = HTTP_PUSH_MAX_AGE_IN_SECONDS)
+            )
+        return powermeter
+
+    def CreateSinglePowermeter(self, config: ConfigParser) -> Powermeter:
+        SHELLY_IP = TASMOTA_IP = SHRDZM_IP = EMLOG_IP = IOBROKER_IP = HA_IP = SCRIPT_IP = "xxx.xxx.xxx.xxx"
+        SHELLY_USER = SHELLY_PASS = SHRDZM_USER = SHRDZM_PASS = SCRIPT_USER = SCRIPT_PASS = EMLOG_IP = EMLOG_METERINDEX = ""
+        USE_TASMOTA = USE_SHELLY_EM = USE_SHELLY_3EM = USE_SHELLY_3EM_PRO = USE_ESPHOME = USE_SHRDZM = USE_EMLOG = USE_IOBROKER = USE_HOMEASSISTANT = USE_VZLOGGER = USE_SCRIPT = False
+        TASMOTA_JSON_STATUS = "StatusSNS"
+        TASMOTA_JSON_PAYLOAD_MQTT_PREFIX = "SML"
+        TASMOTA_JSON_POWER_MQTT_LABEL = "curr_w"
+        ESPHOME_IP = "xxx.xxx.xxx.xxx"
+        ESPHOME_PORT = "80"
+        ESPHOME_DOMAIN = ESPHOME_ID = ""
+        ESPHOME_USE_SSE = False
+        ESPHOME_SSE_MAX_AGE_IN_SECONDS = 30
+        SHRDZM_USE_UDP = False
+        SHRDZM_UDP_PORT = 9522
+        SHRDZM_UDP_MAX_AGE_IN_SECONDS = 10
+        IOBROKER_PORT = "8087"
+        IOBROKER_CURRENT_POWER_ALIAS = "alias.0.Zaehler.Zaehler_CurrentWatt"
+        IOBROKER_POWER_INPUT_ALIAS = "alias.0.Zaehler.Zaehler_CurrentInputWatt"
+        IOBROKER_POWER_OUTPUT_ALIAS = "alias.0.Zaehler.Zaehler_CurrentOutputWatt"
+        HA_PORT = "8123"
+        HA_ACCESSTOKEN = "xxx"
+        HA_CURRENT_POWER_ENTITY = "sensor.dtz541_sml_curr_w"
+        HA_POWER_INPUT_ALIAS = "sensor.dtz541_sml_170"
+        HA_POWER_OUTPUT_ALIAS = "sensor.dtz541_sml_270"
+        HA_USE_WEBSOCKET = False
+        HA_WEBSOCKET_MAX_AGE_IN_SECONDS = 30
+        VZL_IP = "127.0.0.1"
+        VZL_PORT = "2081"
+        VZL_UUID = "30c6c501-9a3c-4b0f-bda5-1d1769904463"
+        TASMOTA_JSON_POWER_CALCULATE =  IOBROKER_POWER_CALCULATE = HA_POWER_CALCULATE = HA_POWER_CALCULATE = False
+        EMLOG_JSON_POWER_CALCULATE = True
+        TASMOTA_JSON_POWER_INPUT_MQTT_LABEL = TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL = IOBROKER_POWER_INPUT_ALIAS = IOBROKER_POWER_OUTPUT_ALIAS = HA_POWER_INPUT_ALIAS = HA_POWER_OUTPUT_ALIAS = None
+        SCRIPT_FILE = "GetPowerFromVictronMultiplus.sh"
+
+        shelly_ip = config.get('SHELLY', 'SHELLY_IP', fallback = SHELLY_IP)
+        shelly_user = config.get('SHELLY', 'SHELLY_USER', fallback = SHELLY_USER)
+        shelly_pass = config.get('SHELLY', 'SHELLY_PASS', fallback = SHELLY_PASS)
+        if config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_EM', fallback = USE_SHELLY_EM):
+            return ShellyEM(shelly_ip, shelly_user, shelly_pass)
+        elif config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_3EM', fallback = USE_SHELLY_3EM):
+            return Shelly3EM(shelly_ip, shelly_user, shelly_pass)
+        elif config.getboolean('SELECT_POWERMETER', 'USE_SHELLY_3EM_PRO', fallback = USE_SHELLY_3EM_PRO):
+            return Shelly3EMPro(shelly_ip, shelly_user, shelly_pass)
+        elif config.getboolean('SELECT_POWERMETER', 'USE_TASMOTA', fallback = USE_TASMOTA):
+            return Tasmota(
+                config.get('TASMOTA', 'TASMOTA_IP', fallback = TASMOTA_IP),
+                config.get('TASMOTA', 'TASMOTA_JSON_STATUS', fallback = TASMOTA_JSON_STATUS),
+                config.get('TASMOTA', 'TASMOTA_JSON_PAYLOAD_MQTT_PREFIX', fallback = TASMOTA_JSON_PAYLOAD_MQTT_PREFIX),
+                config.get('TASMOTA', 'TASMOTA_JSON_POWER_MQTT_LABEL', fallback = TASMOTA_JSON_POWER_MQTT_LABEL),
+                config.get('TASMOTA', 'TASMOTA_JSON_POWER_INPUT_MQTT_LABEL', fallback = TASMOTA_JSON_POWER_INPUT_MQTT_LABEL),
+                config.get('TASMOTA', 'TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL', fallback = TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL),
+                config.getboolean('TASMOTA', 'TASMOTA_JSON_POWER_CALCULATE', fallback = TASMOTA_JSON_POWER_CALCULATE)
+            )
+        elif config.getboolean('SELECT_POWERMETER', 'USE_ESPHOME', fallback = USE_ESPHOME):
+            return ESPHome(
+                config.get('ESPHOME', 'ESPHOME_IP', fallback = ESPHOME_IP),
+                config.get('ESPHOME', 'ESPHOME_PORT', fallback = ESPHOME_PORT),
+                config.get('ESPHOME', 'ESPHOME_DOMAIN', fallback = ESPHOME_DOMAIN),
+                config.get('ESPHOME', 'ESPHOME_ID', fallback = ESPHOME_ID),
+                config.getboolean('ESPHOME', 'ESPHOME_USE_SSE', fallback = ESPHOME_USE_SSE),
+                config.getint('ESPHOME', 'ESPHOME_SSE_MAX_AGE_IN_SECONDS', fallback = ESPHOME_SSE_MAX_AGE_IN_SECONDS)
+            )
+        elif config.getboolean('SELECT_POWERMETER', 'USE_SHRDZM', fallback = USE_SHRDZM):
+            return Shrdzm(
+                config.get('SHRDZM', 'SHRDZM_IP', fallback = SHRDZM_IP),
+                config.get('SHRDZM', 'SHRDZM_USER', fallback = SHRDZM_USER),
+                config.get('SHRDZM', 'SHRDZM_PASS', fallback = SHRDZM_PASS),
+                config.getboolean('SHRDZM', 'SHRDZM_USE_UDP', fallback = SHRDZM_USE_UDP),
+                config.getint('SHRDZM', 'SHRDZM_UDP_PORT', fallback = SHRDZM_UDP_PORT),
+                config.getint('SHRDZM', 'SHRDZM_UDP_MAX_AGE_IN_SECONDS', fallback = SHRDZM_UDP_MAX_AGE_IN_SECONDS)
+            )
+        elif config.getboolean('SELECT_POWERMETER', 'USE_EMLOG', fallback = USE_EMLOG):
+            return Emlog(
+                config.get('EMLOG', 'EMLOG_IP', fallback = EMLOG_IP),
+                config.get('EMLOG', 'EMLOG_METERINDEX', fallback = EMLOG_METERINDEX),
+                config.getboolean('EMLOG', 'EMLOG_JSON_POWER_CALCULATE', fallback = EMLOG_JSON_POWER_CALCULATE)
+            )
+        elif config.getboolean('SELECT_POWERMETER', 'USE_IOBROKER', fallback = USE_IOBROKER):
+            return IoBroker(
+                config.get('IOBROKER', 'IOBROKER_IP', fallback = IOBROKER_IP),
+                config.get('IOBROKER', 'IOBROKER_PORT', fallback = IOBROKER_PORT),
+                config.get('IOBROKER', 'IOBROKER_CURRENT_POWER_ALIAS', fallback = IOBROKER_CURRENT_POWER_ALIAS),
+                config.getboolean('IOBROKER', 'IOBROKER_POWER_CALCULATE', fallback = IOBROKER_POWER_CALCULATE),
+                config.get('IOBROKER', 'IOBROKER_POWER_INPUT_ALIAS', fallback = IOBROKER_POWER_INPUT_ALIAS),
+                config.get('IOBROKER', 'IOBROKER_POWER_OUTPUT_ALIAS', fallback = IOBROKER_POWER_OUTPUT_ALIAS)
+            )
+        elif config.getboolean('SELECT_POWERMETER', 'USE_HOMEASSISTANT', fallback = USE_HOMEASSISTANT):
+            return HomeAssistant(
+                config.get('HOMEASSISTANT', 'HA_IP', fallback = HA_IP),
+                config.get('HOMEASSISTANT', 'HA_PORT', fallback = HA_PORT),
+                config.get('HOMEASSISTANT', 'HA_ACCESSTOKEN', fallback = HA_ACCESSTOKEN),
+                config.get('HOMEASSISTANT', 'HA_CURRENT_POWER_ENTITY', fallback = HA_CURRENT_POWER_ENTITY),
+                config.getboolean('HOMEASSISTANT', 'HA_POWER_CALCULATE', fallback = HA_POWER_CALCULATE),
+                config.get('HOMEASSISTANT', 'HA_POWER_INPUT_ALIAS', fallback = HA_POWER_INPUT_ALIAS),
+                config.get('HOMEASSISTANT', 'HA_POWER_OUTPUT_ALIAS', fallback = HA_POWER_OUTPUT_ALIAS),
+                config.getboolean('HOMEASSISTANT', 'HA_USE_WEBSOCKET', fallback = HA_USE_WEBSOCKET),
+                config.getint('HOMEASSISTANT', 'HA_WEBSOCKET_MAX_AGE_IN_SECONDS', fallback = HA_WEBSOCKET_MAX_AGE_IN_SECONDS)
+            )
+        elif config.getboolean('SELECT_POWERMETER', 'USE_VZLOGGER', fallback = USE_VZLOGGER):
+            return VZLogger(
+                config.get('VZLOGGER', 'VZL_IP', fallback = VZL_IP),
+                config.get('VZLOGGER', 'VZL_PORT', fallback = VZL_PORT),
+                config.get('VZLOGGER', 'VZL_UUID', fallback = VZL_UUID)
+            )
+        elif config.getboolean('SELECT_POWERMETER', 'USE_SCRIPT', fallback = USE_SCRIPT):
+            return Script(
+                config.get('SCRIPT', 'SCRIPT_FILE', fallback = SCRIPT_FILE),
+                config.get('SCRIPT', 'SCRIPT_IP', fallback = SCRIPT_IP),
+                config.get('SCRIPT', 'SCRIPT_USER', fallback = SCRIPT_USER),
+                config.get('SCRIPT', 'SCRIPT_PASS', fallback = SCRIPT_PASS)
+            )
+        else:
+            raise Exception("Error: no powermeter defined!")
+
+    def CreateIntermediatePowermeter(self, dtu: DTU) -> Powermeter:
+        SHELLY_IP_INTERMEDIATE = TASMOTA_IP_INTERMEDIATE = ESPHOME_IP_INTERMEDIATE = SHRDZM_IP_INTERMEDIATE = EMLOG_IP_INTERMEDIATE = IOBROKER_IP_INTERMEDIATE = HA_IP_INTERMEDIATE = "xxx.xxx.xxx.xxx"
+        SHELLY_USER_INTERMEDIATE = SHELLY_PASS_INTERMEDIATE = ESPHOME_DOMAIN_INTERMEDIATE = ESPHOME_ID_INTERMEDIATE = SHRDZM_USER_INTERMEDIATE = SHRDZM_PASS_INTERMEDIATE = EMLOG_IP_INTERMEDIATE = EMLOG_METERINDEX_INTERMEDIATE = ""
+        USE_TASMOTA_INTERMEDIATE = USE_SHELLY_EM_INTERMEDIATE = USE_SHELLY_3EM_INTERMEDIATE = USE_SHELLY_3EM_PRO_INTERMEDIATE = USE_SHELLY_1PM_INTERMEDIATE = USE_SHELLY_PLUS_1PM_INTERMEDIATE = USE_ESPHOME_INTERMEDIATE = USE_SHRDZM_INTERMEDIATE = USE_EMLOG_INTERMEDIATE = USE_IOBROKER_INTERMEDIATE = USE_HOMEASSISTANT_INTERMEDIATE = USE_VZLOGGER_INTERMEDIATE = False
+        TASMOTA_JSON_STATUS_INTERMEDIATE = "StatusSNS"
+        TASMOTA_JSON_PAYLOAD_MQTT_PREFIX_INTERMEDIATE = "SML"
+        TASMOTA_JSON_POWER_MQTT_LABEL_INTERMEDIATE = "curr_w"
+        ESPHOME_PORT_INTERMEDIATE = "80"
+        ESPHOME_USE_SSE_INTERMEDIATE = False
+        ESPHOME_SSE_MAX_AGE_IN_SECONDS_INTERMEDIATE = 30
+        SHRDZM_USE_UDP_INTERMEDIATE = False
+        SHRDZM_UDP_PORT_INTERMEDIATE = 9523
+        SHRDZM_UDP_MAX_AGE_IN_SECONDS_INTERMEDIATE = 10
+        IOBROKER_PORT_INTERMEDIATE = "8087"
+        IOBROKER_CURRENT_POWER_ALIAS_INTERMEDIATE = "alias.0.Zaehler.Zaehler_SolarCurrentWatt"
+        HA_PORT_INTERMEDIATE = "8123"
+        HA_ACCESSTOKEN_INTERMEDIATE = "xxx"
+        HA_CURRENT_POWER_ENTITY_INTERMEDIATE = "sensor.dtz541_sml_curr_w"
+        HA_USE_WEBSOCKET_INTERMEDIATE = False
+        HA_WEBSOCKET_MAX_AGE_IN_SECONDS_INTERMEDIATE = 30
+        VZL_IP_INTERMEDIATE = "127.0.0.1"
+        VZL_PORT_INTERMEDIATE = "2081"
+        VZL_UUID_INTERMEDIATE = "06ec9562-a490-49fe-92ea-ffe0758d181c"
+        TASMOTA_JSON_POWER_CALCULATE_INTERMEDIATE = EMLOG_JSON_POWER_CALCULATE = IOBROKER_POWER_CALCULATE = HA_POWER_CALCULATE_INTERMEDIATE = HA_POWER_CALCULATE_INTERMEDIATE = False
+        TASMOTA_JSON_POWER_INPUT_MQTT_LABEL_INTERMEDIATE = TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL_INTERMEDIATE = IOBROKER_POWER_INPUT_ALIAS_INTERMEDIATE = IOBROKER_POWER_OUTPUT_ALIAS_INTERMEDIATE = HA_POWER_INPUT_ALIAS_INTERMEDIATE = HA_POWER_OUTPUT_ALIAS_INTERMEDIATE = None
+
+        shelly_ip = self.config.get('INTERMEDIATE_SHELLY', 'SHELLY_IP_INTERMEDIATE', fallback = SHELLY_IP_INTERMEDIATE)
+        shelly_user = self.config.get('INTERMEDIATE_SHELLY', 'SHELLY_USER_INTERMEDIATE', fallback = SHELLY_USER_INTERMEDIATE)
+        shelly_pass = self.config.get('INTERMEDIATE_SHELLY', 'SHELLY_PASS_INTERMEDIATE', fallback = SHELLY_PASS_INTERMEDIATE)
+        if self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_TASMOTA_INTERMEDIATE', fallback = USE_TASMOTA_INTERMEDIATE):
+            return Tasmota(
+                self.config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_IP_INTERMEDIATE', fallback = TASMOTA_IP_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_STATUS_INTERMEDIATE', fallback = TASMOTA_JSON_STATUS_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_PAYLOAD_MQTT_PREFIX_INTERMEDIATE', fallback = TASMOTA_JSON_PAYLOAD_MQTT_PREFIX_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_MQTT_LABEL_INTERMEDIATE', fallback = TASMOTA_JSON_POWER_MQTT_LABEL_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_INPUT_MQTT_LABEL_INTERMEDIATE', fallback = TASMOTA_JSON_POWER_INPUT_MQTT_LABEL_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL_INTERMEDIATE', fallback = TASMOTA_JSON_POWER_OUTPUT_MQTT_LABEL_INTERMEDIATE),
+                self.config.getboolean('INTERMEDIATE_TASMOTA', 'TASMOTA_JSON_POWER_CALCULATE_INTERMEDIATE', fallback = TASMOTA_JSON_POWER_CALCULATE_INTERMEDIATE)
+            )
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_EM_INTERMEDIATE', fallback = USE_SHELLY_EM_INTERMEDIATE):
+            return ShellyEM(shelly_ip, shelly_user, shelly_pass)
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_3EM_INTERMEDIATE', fallback = USE_SHELLY_3EM_INTERMEDIATE):
+            return Shelly3EM(shelly_ip, shelly_user, shelly_pass)
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_3EM_PRO_INTERMEDIATE', fallback = USE_SHELLY_3EM_PRO_INTERMEDIATE):
+            return Shelly3EMPro(shelly_ip, shelly_user, shelly_pass)
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_1PM_INTERMEDIATE', fallback = USE_SHELLY_1PM_INTERMEDIATE):
+            return Shelly1PM(shelly_ip, shelly_user, shelly_pass)
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHELLY_PLUS_1PM_INTERMEDIATE', fallback = USE_SHELLY_PLUS_1PM_INTERMEDIATE):
+            return ShellyPlus1PM(shelly_ip, shelly_user, shelly_pass)
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_ESPHOME_INTERMEDIATE', fallback = USE_ESPHOME_INTERMEDIATE):
+            return ESPHome(
+                self.config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_IP_INTERMEDIATE', fallback = ESPHOME_IP_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_PORT_INTERMEDIATE', fallback = ESPHOME_PORT_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_DOMAIN_INTERMEDIATE', fallback = ESPHOME_DOMAIN_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_ESPHOME', 'ESPHOME_ID_INTERMEDIATE', fallback = ESPHOME_ID_INTERMEDIATE),
+                self.config.getboolean('INTERMEDIATE_ESPHOME', 'ESPHOME_USE_SSE_INTERMEDIATE', fallback = ESPHOME_USE_SSE_INTERMEDIATE),
+                self.config.getint('INTERMEDIATE_ESPHOME', 'ESPHOME_SSE_MAX_AGE_IN_SECONDS_INTERMEDIATE', fallback = ESPHOME_SSE_MAX_AGE_IN_SECONDS_INTERMEDIATE)
+            )
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_SHRDZM_INTERMEDIATE', fallback = USE_SHRDZM_INTERMEDIATE):
+            return Shrdzm(
+                self.config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_IP_INTERMEDIATE', fallback = SHRDZM_IP_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_USER_INTERMEDIATE', fallback = SHRDZM_USER_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_SHRDZM', 'SHRDZM_PASS_INTERMEDIATE', fallback = SHRDZM_PASS_INTERMEDIATE),
+                self.config.getboolean('INTERMEDIATE_SHRDZM', 'SHRDZM_USE_UDP_INTERMEDIATE', fallback = SHRDZM_USE_UDP_INTERMEDIATE),
+                self.config.getint('INTERMEDIATE_SHRDZM', 'SHRDZM_UDP_PORT_INTERMEDIATE', fallback = SHRDZM_UDP_PORT_INTERMEDIATE),
+                self.config.getint('INTERMEDIATE_SHRDZM', 'SHRDZM_UDP_MAX_AGE_IN_SECONDS_INTERMEDIATE', fallback = SHRDZM_UDP_MAX_AGE_IN_SECONDS_INTERMEDIATE)
+            )
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_EMLOG_INTERMEDIATE', fallback = USE_EMLOG_INTERMEDIATE):
+            return Emlog(
+                self.config.get('INTERMEDIATE_EMLOG', 'EMLOG_IP_INTERMEDIATE', fallback = EMLOG_IP_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_EMLOG', 'EMLOG_METERINDEX_INTERMEDIATE', fallback = EMLOG_METERINDEX_INTERMEDIATE),
+                self.config.getboolean('INTERMEDIATE_EMLOG', 'EMLOG_JSON_POWER_CALCULATE', fallback = EMLOG_JSON_POWER_CALCULATE)
+            )
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_IOBROKER_INTERMEDIATE', fallback = USE_IOBROKER_INTERMEDIATE):
+            return IoBroker(
+                self.config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_IP_INTERMEDIATE', fallback = IOBROKER_IP_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_PORT_INTERMEDIATE', fallback = IOBROKER_PORT_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_CURRENT_POWER_ALIAS_INTERMEDIATE', fallback = IOBROKER_CURRENT_POWER_ALIAS_INTERMEDIATE),
+                self.config.getboolean('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_CALCULATE', fallback = IOBROKER_POWER_CALCULATE),
+                self.config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_INPUT_ALIAS_INTERMEDIATE', fallback = IOBROKER_POWER_INPUT_ALIAS_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_IOBROKER', 'IOBROKER_POWER_OUTPUT_ALIAS_INTERMEDIATE', fallback = IOBROKER_POWER_OUTPUT_ALIAS_INTERMEDIATE)
+            )
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_HOMEASSISTANT_INTERMEDIATE', fallback = USE_HOMEASSISTANT_INTERMEDIATE):
+            return HomeAssistant(
+                self.config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_IP_INTERMEDIATE', fallback = HA_IP_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_PORT_INTERMEDIATE', fallback = HA_PORT_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_ACCESSTOKEN_INTERMEDIATE', fallback = HA_ACCESSTOKEN_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_CURRENT_POWER_ENTITY_INTERMEDIATE', fallback = HA_CURRENT_POWER_ENTITY_INTERMEDIATE),
+                self.config.getboolean('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_CALCULATE_INTERMEDIATE', fallback = HA_POWER_CALCULATE_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_INPUT_ALIAS_INTERMEDIATE', fallback = HA_POWER_INPUT_ALIAS_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_HOMEASSISTANT', 'HA_POWER_OUTPUT_ALIAS_INTERMEDIATE', fallback = HA_POWER_OUTPUT_ALIAS_INTERMEDIATE),
+                self.config.getboolean('INTERMEDIATE_HOMEASSISTANT', 'HA_USE_WEBSOCKET_INTERMEDIATE', fallback = HA_USE_WEBSOCKET_INTERMEDIATE),
+                self.config.getint('INTERMEDIATE_HOMEASSISTANT', 'HA_WEBSOCKET_MAX_AGE_IN_SECONDS_INTERMEDIATE', fallback = HA_WEBSOCKET_MAX_AGE_IN_SECONDS_INTERMEDIATE)
+            )
+        elif self.config.getboolean('SELECT_INTERMEDIATE_METER', 'USE_VZLOGGER_INTERMEDIATE', fallback = USE_VZLOGGER_INTERMEDIATE):
+            return VZLogger(
+                self.config.get('INTERMEDIATE_VZLOGGER', 'VZL_IP_INTERMEDIATE', fallback = VZL_IP_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_VZLOGGER', 'VZL_PORT_INTERMEDIATE', fallback = VZL_PORT_INTERMEDIATE),
+                self.config.get('INTERMEDIATE_VZLOGGER', 'VZL_UUID_INTERMEDIATE', fallback = VZL_UUID_INTERMEDIATE)
+            )
+        else:
+            return dtu
+
+    def CreateMqttPublisher(self) -> MqttPublisher:
+        MQTT_PUBLISH_ENABLED = False
+        MQTT_PUBLISH_BROKER = "xxx.xxx.xxx.xxx"
+        MQTT_PUBLISH_PORT = 1883
+        MQTT_PUBLISH_USER = MQTT_PUBLISH_PASS = ""
+        MQTT_PUBLISH_TOPIC = "HoymilesZeroExport"
+        MQTT_PUBLISH_DEADBAND_WATT = 5
+        MQTT_PUBLISH_DEADBAND_VOLT = 0.2
+        MQTT_PUBLISH_DEADBAND_SECONDS = 60
+
+        if not self.config.getboolean('MQTT_PUBLISH', 'MQTT_PUBLISH_ENABLED', fallback = MQTT_PUBLISH_ENABLED):
+            return None
+        return MqttPublisher(
+            self.config.get('MQTT_PUBLISH', 'MQTT_PUBLISH_BROKER', fallback = MQTT_PUBLISH_BROKER),
+            self.config.getint('MQTT_PUBLISH', 'MQTT_PUBLISH_PORT', fallback = MQTT_PUBLISH_PORT),
+            self.config.get('MQTT_PUBLISH', 'MQTT_PUBLISH_USER', fallback = MQTT_PUBLISH_USER),
+            self.config.get('MQTT_PUBLISH', 'MQTT_PUBLISH_PASS', fallback = MQTT_PUBLISH_PASS),
+            self.config.get('MQTT_PUBLISH', 'MQTT_PUBLISH_TOPIC', fallback = MQTT_PUBLISH_TOPIC),
+            self.config.getint('MQTT_PUBLISH', 'MQTT_PUBLISH_DEADBAND_WATT', fallback = MQTT_PUBLISH_DEADBAND_WATT),
+            self.config.getfloat('MQTT_PUBLISH', 'MQTT_PUBLISH_DEADBAND_VOLT', fallback = MQTT_PUBLISH_DEADBAND_VOLT),
+            self.config.getint('MQTT_PUBLISH', 'MQTT_PUBLISH_DEADBAND_SECONDS', fallback = MQTT_PUBLISH_DEADBAND_SECONDS)
+        )
+
+    def CreateDTU(self) -> DTU:
+        AHOY_IP = OPENDTU_IP = "xxx.xxx.xxx.xxx"
+        AHOY_PASS = OPENDTU_USER = OPENDTU_PASS = AHOY_MQTT_BROKER = AHOY_MQTT_USER = AHOY_MQTT_PASS = ""
+        USE_AHOY = USE_OPENDTU = AHOY_USE_MQTT = OPENDTU_USE_WEBSOCKET = False
+        AHOY_MQTT_PORT = 1883
+        AHOY_MQTT_TOPIC = "inverter"
+        AHOY_MQTT_MAX_AGE_IN_SECONDS = OPENDTU_WEBSOCKET_MAX_AGE_IN_SECONDS = 30
+        DTU_MAX_REQUESTS_PER_SECOND = 5
+        DTU_MAX_REQUEST_BURST = 10
+
+        inverter_count = self.config.getint('COMMON', 'INVERTER_COUNT', fallback = self.INVERTER_COUNT)
+        max_requests_per_second = self.config.getfloat('COMMON', 'DTU_MAX_REQUESTS_PER_SECOND', fallback = DTU_MAX_REQUESTS_PER_SECOND)
+        max_request_burst = self.config.getint('COMMON', 'DTU_MAX_REQUEST_BURST', fallback = DTU_MAX_REQUEST_BURST)
+        if self.config.getboolean('SELECT_DTU', 'USE_AHOY', fallback = USE_AHOY):
+            return AhoyDTU(
+                self,
+                inverter_count,
+                self.config.get('AHOY_DTU', 'AHOY_IP', fallback = AHOY_IP),
+                self.config.get('AHOY_DTU', 'AHOY_PASS', fallback = AHOY_PASS),
+                self.config.getboolean('AHOY_DTU', 'AHOY_USE_MQTT', fallback = AHOY_USE_MQTT),
+                self.config.get('AHOY_DTU', 'AHOY_MQTT_BROKER', fallback = AHOY_MQTT_BROKER),
+                self.config.getint('AHOY_DTU', 'AHOY_MQTT_PORT', fallback = AHOY_MQTT_PORT),
+                self.config.get('AHOY_DTU', 'AHOY_MQTT_USER', fallback = AHOY_MQTT_USER),
+                self.config.get('AHOY_DTU', 'AHOY_MQTT_PASS', fallback = AHOY_MQTT_PASS),
+                self.config.get('AHOY_DTU', 'AHOY_MQTT_TOPIC', fallback = AHOY_MQTT_TOPIC),
+                self.config.getint('AHOY_DTU', 'AHOY_MQTT_MAX_AGE_IN_SECONDS', fallback = AHOY_MQTT_MAX_AGE_IN_SECONDS),
+                max_requests_per_second,
+                max_request_burst
+            )
+        elif self.config.getboolean('SELECT_DTU', 'USE_OPENDTU', fallback = USE_OPENDTU):
+            return OpenDTU(
+                self,
+                inverter_count,
+                self.config.get('OPEN_DTU', 'OPENDTU_IP', fallback = OPENDTU_IP),
+                self.config.get('OPEN_DTU', 'OPENDTU_USER', fallback = OPENDTU_USER),
+                self.config.get('OPEN_DTU', 'OPENDTU_PASS', fallback = OPENDTU_PASS),
+                self.config.getboolean('OPEN_DTU', 'OPENDTU_USE_WEBSOCKET', fallback = OPENDTU_USE_WEBSOCKET),
+                self.config.getint('OPEN_DTU', 'OPENDTU_WEBSOCKET_MAX_AGE_IN_SECONDS', fallback = OPENDTU_WEBSOCKET_MAX_AGE_IN_SECONDS),
+                max_requests_per_second,
+                max_request_burst
+            )
+        else:
+            raise Exception("Error: no DTU defined!")
+
+    def SetWatchdogProgress(self):
+        # the next loop iteration is due within one loop interval, the slowest device calls and the phase budget of an aborted call
+        WATCHDOG.SetProgress(self.Name, self.LOOP_INTERVAL_IN_SECONDS + self.SET_LIMIT_TIMEOUT_SECONDS + self.SET_POWER_STATUS_DELAY_IN_SECONDS + 2 * WATCHDOG.phase_budget)
+
+    def Run(self):
+        threading.current_thread().name = self.Name
+        try:
+            logger.info("---Init---")
+            newLimitSetpoint = 0
+            self.SetWatchdogProgress()
+            # before the first limit and before the checkpoint is matched against the DTU version: an unsupported firmware stops here.
+            # only a DTU which cannot be read now is checked in the background
+            try:
+                self.CheckDtuVersion()
+            except Exception as e:
+                logger.error('Exception at CheckDtuVersion, retried in the background: %s', e)
+                self.InfoScheduler.Add('DTU version check', self.CheckDtuVersion)
+            Setpoint = self.ResumeFromCheckpoint()
+            if Setpoint is not None:
+                newLimitSetpoint = Setpoint
+            elif self.GetHoymilesAvailable():
+                # power on all inverters at once: the delay after turning on is waited in parallel
+                self.ForEachInverter(lambda i: self.SetHoymilesPowerStatus(i, True))
+                self.SetLimit(self.GetMinWattFromAllInverters())
+                self.GetHoymilesActualPower()
+                self.GetCheckBattery()
+            self.GetPowermeterWatts()
+        except Exception as e:
+            if hasattr(e, 'message'):
+                logger.error(e.message)
+            else:
+                logger.error(e)
+            Sleep(self.LOOP_INTERVAL_IN_SECONDS)
+        logger.info("---Start Zero Export---")
+        if STARTUP_PROFILE:
+            logger.info('Startup profile: init done after %.3f s', time.perf_counter() - START_TIME)
+        FirstLimit = STARTUP_PROFILE
+
+        while True:
+            try:
+                self.SetWatchdogProgress()
+                if (CASSETTE is not None) and CASSETTE.ended:
+                    self.StopReason = 'Replay: end of the cassette'
+                if self.StopReason is not None:
+                    raise SystemExit(self.StopReason)
+                PreviousLimitSetpoint = newLimitSetpoint
+                self.LimitSetpoint = newLimitSetpoint
+                if self.MQTT_PUBLISHER is not None:
+                    Status = self.GetStatus()
+                    Status.pop('powermeter_time')
+                    Status.pop('dtu_requests', None)
+                    self.MQTT_PUBLISHER.Publish(Status)
+                self.ReloadConfig()
+                self.WriteCheckpoint(newLimitSetpoint)
+                self.WriteKpi()
+                self.ScheduleInfoReads()
+                if self.GetHoymilesAvailable() and self.GetCheckBattery():
+                    Settings = self.GetRegulationSettings()
+                    for x in range(CastToInt(self.LOOP_INTERVAL_IN_SECONDS / self.POLL_INTERVAL_IN_SECONDS)):
+                        powermeterWatts = self.GetPowermeterWatts()
+                        if self.PowermeterConfidence < 1:
+                            # no jump on a last good value: it does not show the current grid usage
+                            Sleep(self.POLL_INTERVAL_IN_SECONDS)
+                        elif powermeterWatts > self.POWERMETER_MAX_POINT:
+                            newLimitSetpoint = self.ApplyLimitsToSetpoint(GetJumpLimitSetpoint(Settings, PreviousLimitSetpoint, powermeterWatts))
+                            self.SetLimitStep(newLimitSetpoint, PreviousLimitSetpoint, powermeterWatts)
+                            RemainingDelay = CastToInt((self.LOOP_INTERVAL_IN_SECONDS / self.POLL_INTERVAL_IN_SECONDS - x) * self.POLL_INTERVAL_IN_SECONDS)
+                            if RemainingDelay > 0:
+                                AppliedWatts = self.WaitForLimitStep(RemainingDelay)
+                                if AppliedWatts is not None:
+                                    # the jump is applied: regulate from the jumped limit with the fresh reading right away
+                                    powermeterWatts = AppliedWatts
+                                    PreviousLimitSetpoint = newLimitSetpoint
+                                break
+                        elif self.IsStepApplied(powermeterWatts):
+                            break
+                        else:
+                            Sleep(self.POLL_INTERVAL_IN_SECONDS)
+
+                    # the production is needed to cut the limit or to reduce it from the maximum: read it together with a fresh grid reading
+                    hoymilesActualPower = None
+                    NeedCutLimit = (self.MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER != 100) and (newLimitSetpoint != self.GetMaxWattFromAllInverters())
+                    NeedActualPower = (powermeterWatts < (self.POWERMETER_TARGET_POINT - self.POWERMETER_TOLERANCE)) and (PreviousLimitSetpoint >= self.GetMaxWattFromAllInverters())
+                    if NeedCutLimit or NeedActualPower:
+                        powermeterWatts, hoymilesActualPower = self.GetPowermeterAndActualPower()
+
+                    if self.MAX_DIFFERENCE_BETWEEN_LIMIT_AND_OUTPUTPOWER != 100:
+                        CutLimit = self.CutLimitToProduction(newLimitSetpoint, hoymilesActualPower)
+                        if CutLimit != newLimitSetpoint:
+                            newLimitSetpoint = CutLimit
+                            PreviousLimitSetpoint = newLimitSetpoint
+
+                    if powermeterWatts > self.POWERMETER_MAX_POINT:
+                        continue
+                    if self.PowermeterConfidence < 1:
+                        logger.info('Holding the limit: no current powermeter reading (confidence %.2f)', self.PowermeterConfidence)
+                        continue
+
+                    newLimitSetpoint, Message = GetLimitSetpoint(Settings, PreviousLimitSetpoint, powermeterWatts, hoymilesActualPower)
+                    if Message:
+                        logger.info(Message)
+                    # check for upper and lower limits
+                    newLimitSetpoint = self.ApplyLimitsToSetpoint(newLimitSetpoint)
+                    # set new limit to inverter
+                    self.SetLimitStep(newLimitSetpoint, PreviousLimitSetpoint, powermeterWatts)
+                    if FirstLimit:
+                        FirstLimit = False
+                        logger.info('Startup profile: first regulated limit after %.3f s', time.perf_counter() - START_TIME)
                 else:
-                    logger.info("Not enough energy producing: limit already at maximum")
+                    self.LastLimit = -1
+                    Sleep(self.LOOP_INTERVAL_IN_SECONDS)
 
-            # check for upper and lower limits
-            newLimitSetpoint = ApplyLimitsToSetpoint(newLimitSetpoint)
-            # set new limit to inverter
-            SetLimit(newLimitSetpoint)
+            except Exception as e:
+                if hasattr(e, 'message'):
+                    logger.error(e.message)
+                else:
+                    logger.error(e)
+                Sleep(self.LOOP_INTERVAL_IN_SECONDS)
+
+class PowermeterFilter:
+    # signal conditioning of the powermeter samples for the regulation (without I/O, also used by the tuner):
+    # short import spikes (kettle, compressor start) are replaced by the median of the last FILTER_WINDOW samples (Hampel),
+    # a load pulsing between two levels (induction hob) is followed with its lower level, and increases can be smoothed by an EWMA.
+    # decreases of the grid power (more export) always pass immediately, so the filter never adds export.
+    # the grid power moves with every limit command as well: the samples pass unchanged until the window is filled again after Reset
+    def __init__(self):
+        self.Reset()
+
+    def Reset(self):
+        self.samples = []
+        self.trend = None
+        self.pulsing = False
+
+    def IsPulsing(self, pSamples: list, pMinWatt: int, pMinCycles: int):
+        High = max(pSamples)
+        Low = min(pSamples)
+        if (pMinWatt <= 0) or (High - Low < pMinWatt):
+            return False
+        Middle = (High + Low) / 2
+        RisingEdges = sum(1 for i in range(1, len(pSamples)) if pSamples[i - 1] < Middle <= pSamples[i])
+        return RisingEdges >= pMinCycles
+
+    def Filter(self, pSettings: dict, pWatts):
+        if pSettings['FILTER_WINDOW'] <= 1:
+            self.Reset()
+            return pWatts
+        self.samples.append(pWatts)
+        del self.samples[:-pSettings['FILTER_WINDOW']]
+        if len(self.samples) < pSettings['FILTER_WINDOW']:
+            self.trend = pWatts
+            return pWatts
+        Sorted = sorted(self.samples)
+        Median = Sorted[len(Sorted) // 2]
+        Watts = pWatts
+        self.pulsing = self.IsPulsing(self.samples, pSettings['FILTER_PULSE_MIN_WATT'], pSettings['FILTER_PULSE_MIN_CYCLES'])
+        if self.pulsing:
+            Middle = (Sorted[0] + Sorted[-1]) / 2
+            LowLevel = [x for x in Sorted if x < Middle]
+            Watts = min(pWatts, LowLevel[len(LowLevel) // 2])
+        elif pSettings['FILTER_HAMPEL_SIGMA'] > 0:
+            # 1.4826 * MAD estimates the standard deviation, deviations within the tolerance are never outliers
+            Mad = sorted(abs(x - Median) for x in Sorted)[len(Sorted) // 2]
+            if pWatts - Median > max(pSettings['FILTER_HAMPEL_SIGMA'] * 1.4826 * Mad, pSettings['POWERMETER_TOLERANCE']):
+                Watts = Median
+        if Watts <= self.trend:
+            self.trend = Watts
+        else:
+            self.trend = self.trend + pSettings['FILTER_EWMA_ALPHA'] * (Watts - self.trend)
+        return CastToInt(self.trend)
+
+def GetJumpLimitSetpoint(pSettings: dict, pPreviousLimitSetpoint, pPowermeterWatts):
+    # the limit setpoint when the powermeter exceeds POWERMETER_MAX_POINT (without I/O, not yet limited to the inverters)
+    if pSettings['ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT'] > 0:
+        Setpoint = CastToInt(pSettings['MAX_INVERTER_WATT'] * pSettings['ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT'] / 100)
+        if (Setpoint <= pPreviousLimitSetpoint) and (pSettings['ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT'] != 100):
+            Setpoint = pPreviousLimitSetpoint + pPowermeterWatts - pSettings['POWERMETER_TARGET_POINT']
+        return Setpoint
+    return pPreviousLimitSetpoint + pPowermeterWatts - pSettings['POWERMETER_TARGET_POINT']
+
+def GetLimitSetpoint(pSettings: dict, pPreviousLimitSetpoint, pPowermeterWatts, pActualPower):
+    # one regulation step (without I/O, not yet limited to the inverters): returns the new limit setpoint and the log message of the decision
+    Target = pSettings['POWERMETER_TARGET_POINT']
+    # producing too much power: reduce limit
+    if pPowermeterWatts < (Target - pSettings['POWERMETER_TOLERANCE']):
+        if (pPreviousLimitSetpoint >= pSettings['MAX_WATT']) and (pActualPower is not None):
+            Setpoint = pActualPower + pPowermeterWatts - Target
+            LimitDifference = abs(pActualPower - Setpoint)
+            if LimitDifference > pSettings['SLOW_APPROX_LIMIT']:
+                Setpoint = Setpoint + (LimitDifference * pSettings['SLOW_APPROX_FACTOR_IN_PERCENT'] / 100)
+            if Setpoint > pActualPower:
+                Setpoint = pActualPower
+            return Setpoint, "overproducing: reduce limit based on actual power"
+        Setpoint = pPreviousLimitSetpoint + pPowermeterWatts - Target
+        # check if it is necessary to approximate to the setpoint with some more passes. this reduce overshoot
+        LimitDifference = abs(pPreviousLimitSetpoint - Setpoint)
+        if LimitDifference > pSettings['SLOW_APPROX_LIMIT']:
+            return Setpoint + (LimitDifference * pSettings['SLOW_APPROX_FACTOR_IN_PERCENT'] / 100), "overproducing: reduce limit based on previous limit setpoint by approximation"
+        return Setpoint, "overproducing: reduce limit based on previous limit setpoint"
+    # producing too little power: increase limit
+    if pPowermeterWatts > (Target + pSettings['POWERMETER_TOLERANCE']):
+        if pPreviousLimitSetpoint < pSettings['MAX_WATT']:
+            return pPreviousLimitSetpoint + pPowermeterWatts - Target, "Not enough energy producing: increasing limit"
+        return pPreviousLimitSetpoint, "Not enough energy producing: limit already at maximum"
+    return pPreviousLimitSetpoint, None
+
+# values tried by the tuner (--tune) for every setting, all combinations are evaluated
+TUNER_GRID = {
+    'POWERMETER_TARGET_POINT': [-150, -125, -100, -75, -50, -25, 0],
+    'POWERMETER_TOLERANCE': [10, 20, 30, 40, 50],
+    'SLOW_APPROX_LIMIT_IN_PERCENT': [10, 20, 30, 50],
+    'SLOW_APPROX_FACTOR_IN_PERCENT': [0, 10, 20, 40],
+    'ON_GRID_USAGE_JUMP_TO_LIMIT_PERCENT': [0, 50, 100],
+    'LOOP_INTERVAL_IN_SECONDS': [5, 10, 20, 30]
+}
+TUNER_TRACES = []
+TUNER_DELAY = 0
+
+def ReadTrace(pTraceFile: str):
+    # lines of "time,powermeter watts,limit watts" as written by Controller.WriteTrace
+    Trace = []
+    with open(pTraceFile) as f:
+        for line in f:
+            Fields = line.strip().split(',')
+            try:
+                Trace.append((float(Fields[0]), float(Fields[1]), float(Fields[2])))
+            except (ValueError, IndexError):
+                continue
+    return Trace
+
+def SimulateTrace(pSettings: dict, pTrace: list, pDelay: float):
+    # replay a trace through the regulation step. the household load is the recorded powermeter reading plus the recorded limit,
+    # the simulated inverters produce exactly their limit pDelay seconds after it was sent (ack and ramp).
+    # returns imported Wh, exported Wh and the number of limit commands
+    Imported = Exported = 0.0
+    Commands = 0
+    if len(pTrace) < 2:
+        return Imported, Exported, Commands
+    Setpoint = Applied = pTrace[0][2]
+    Pending = None
+    Filter = PowermeterFilter()
+    NextLoop = pTrace[0][0] + pSettings['LOOP_INTERVAL_IN_SECONDS']
+    Blocked = pTrace[0][0]
+    for k in range(len(pTrace) - 1):
+        Now, RecordedWatts, RecordedLimit = pTrace[k]
+        if (Pending is not None) and (Now >= Pending[0]):
+            Applied = Pending[1]
+            Pending = None
+        Watts = RecordedWatts + RecordedLimit - Applied
+        # a gap in the trace (e.g. a restart) is not integrated
+        Duration = min(pTrace[k + 1][0] - Now, 60) / 3600
+        if Watts > 0:
+            Imported += Watts * Duration
         else:
-            if hasattr(SetLimit, "LastLimit"):
-                SetLimit.LastLimit = -1
-            time.sleep(LOOP_INTERVAL_IN_SECONDS)
+            Exported -= Watts * Duration
+        # the regulation sees the conditioned samples, the energy is integrated from the real ones
+        FilteredWatts = Filter.Filter(pSettings, Watts)
+        if Now < Blocked:
+            continue
+        NewSetpoint = None
+        Watts = FilteredWatts
+        if Watts > pSettings['POWERMETER_MAX_POINT']:
+            # jump and wait for the rest of the loop interval, regulate in the next loop
+            NewSetpoint = GetJumpLimitSetpoint(pSettings, Setpoint, Watts)
+            Blocked = NextLoop
+            NextLoop = NextLoop + pSettings['LOOP_INTERVAL_IN_SECONDS']
+        elif Now >= NextLoop:
+            NewSetpoint = GetLimitSetpoint(pSettings, Setpoint, Watts, Applied)[0]
+            NextLoop = Now + pSettings['LOOP_INTERVAL_IN_SECONDS']
+        if NewSetpoint is not None:
+            NewSetpoint = CastToInt(max(min(NewSetpoint, pSettings['MAX_WATT']), pSettings['MIN_WATT']))
+            if NewSetpoint != Setpoint:
+                Commands += 1
+                Pending = (Now + pDelay, NewSetpoint)
+                Filter.Reset()
+            Setpoint = NewSetpoint
+    return Imported, Exported, Commands
+
+def SetTunerTraces(pTraces: list, pDelay: float):
+    global TUNER_TRACES, TUNER_DELAY
+    TUNER_TRACES = pTraces
+    TUNER_DELAY = pDelay
+
+def EvaluateTunerSettings(pSettings: dict):
+    Results = [SimulateTrace(pSettings, Trace, TUNER_DELAY) for Trace in TUNER_TRACES]
+    return tuple(sum(Result[i] for Result in Results) for i in range(3))
+
+def GetTunerSettings(pBaseSettings: dict, pValues: dict):
+    # the regulation settings of a site with the tuned values applied, derived values are recalculated like in Controller
+    Settings = dict(pBaseSettings)
+    Settings.update(pValues)
+    Settings['SLOW_APPROX_LIMIT'] = CastToInt(Settings['MAX_WATT'] * Settings['SLOW_APPROX_LIMIT_IN_PERCENT'] / 100)
+    if Settings['POWERMETER_MAX_POINT'] < (Settings['POWERMETER_TARGET_POINT'] + Settings['POWERMETER_TOLERANCE']):
+        Settings['POWERMETER_MAX_POINT'] = Settings['POWERMETER_TARGET_POINT'] + Settings['POWERMETER_TOLERANCE'] + 50
+    return Settings
+
+def RunTuner(pConfigFiles: list, pTraceFiles: list, pOutputFile: str, pDelay: float, pWeights: list):
+    # evaluate all combinations of TUNER_GRID on the recorded traces on all CPU cores and write the best ones as config override
+    import itertools
+    from concurrent.futures import ProcessPoolExecutor
+    Site = Controller(pConfigFiles, Path(pConfigFiles[-1]).stem, settingsOnly = True)
+    # the tuner assumes all inverters are available and the batteries are good
+    Site.AVAILABLE = [True for i in range(Site.INVERTER_COUNT)]
+    BaseSettings = Site.GetRegulationSettings()
+    BaseSettings['SLOW_APPROX_LIMIT_IN_PERCENT'] = Site.SLOW_APPROX_LIMIT_IN_PERCENT
+    Traces = [ReadTrace(traceFile) for traceFile in pTraceFiles]
+    logger.info('Tuner: %s traces with %s samples, ack and ramp delay %s s', len(Traces), sum(len(Trace) for Trace in Traces), pDelay)
+
+    Keys = list(TUNER_GRID)
+    Candidates = [dict(zip(Keys, Values)) for Values in itertools.product(*TUNER_GRID.values())
+                  if Values[Keys.index('LOOP_INTERVAL_IN_SECONDS')] >= Site.POLL_INTERVAL_IN_SECONDS]
+    Candidates.insert(0, {key: BaseSettings[key] for key in Keys})
+    Start = time.perf_counter()
+    with ProcessPoolExecutor(initializer = SetTunerTraces, initargs = (Traces, pDelay)) as executor:
+        Results = list(executor.map(EvaluateTunerSettings, [GetTunerSettings(BaseSettings, Values) for Values in Candidates], chunksize = 16))
+    logger.info('Tuner: evaluated %s combinations in %.1f s', len(Candidates), time.perf_counter() - Start)
+
+    def GetScore(pResult):
+        return pResult[0] * pWeights[0] + pResult[1] * pWeights[1] + pResult[2] * pWeights[2]
+    Ranking = sorted(range(len(Candidates)), key = lambda index: GetScore(Results[index]))
+    logger.info('Tuner: current settings: import %.1f Wh, export %.1f Wh, %s limit commands', *Results[0])
+    for Rank, index in enumerate(Ranking[:10]):
+        logger.info('Tuner: #%s import %.1f Wh, export %.1f Wh, %s limit commands: %s', Rank + 1, *Results[index],
+                    ', '.join(f'{key}={value}' for key, value in Candidates[index].items()))
+
+    Best = Candidates[Ranking[0]]
+    with open(pOutputFile, 'w') as f:
+        f.write(f'# written by the tuner from {", ".join(pTraceFiles)}: import {Results[Ranking[0]][0]:.1f} Wh, export {Results[Ranking[0]][1]:.1f} Wh, {Results[Ranking[0]][2]} limit commands\n')
+        f.write(f'# with the current settings: import {Results[0][0]:.1f} Wh, export {Results[0][1]:.1f} Wh, {Results[0][2]} limit commands\n')
+        for section in ['COMMON', 'CONTROL']:
+            f.write(f'[{section}]\n')
+            for key in Keys:
+                if (key.startswith('POWERMETER_') == (section == 'CONTROL')):
+                    f.write(f'{key} = {Best[key]}\n')
+    logger.info('Tuner: best settings written to %s', pOutputFile)
+
+def StartStatusServer(pControllers: list, pBind: str, pPort: int):
+    # read-only HTTP API with the cached state of all controllers: /status (all sites) and /status/<site>
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    import hashlib
+
+    class StatusRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            RequestPath = self.path.split('?')[0].rstrip('/')
+            if RequestPath == '/status':
+                Body = {controller.Name: controller.GetStatus() for controller in pControllers}
+            elif RequestPath.startswith('/status/') and RequestPath[len('/status/'):] in [controller.Name for controller in pControllers]:
+                Body = next(controller.GetStatus() for controller in pControllers if controller.Name == RequestPath[len('/status/'):])
+            else:
+                self.send_error(404)
+                return
+            Body = json.dumps(Body).encode('utf-8')
+            ETag = '"' + hashlib.sha1(Body).hexdigest()[:16] + '"'
+            if ETag in [x.strip() for x in self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(304)
+                self.send_header('ETag', ETag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(Body)))
+            self.send_header('ETag', ETag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(Body)
+
+        def log_message(self, format, *args):
+            pass
+
+    Server = ThreadingHTTPServer((pBind, pPort), StatusRequestHandler)
+    Server.daemon_threads = True
+    threading.Thread(target=Server.serve_forever, name='status api', daemon=True).start()
+    logger.info('Status API listening on http://%s:%s/status', pBind, pPort)
+
+# ----- START -----
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', nargs='+', help='Override configuration file path. Pass several files to regulate several sites from one process (one controller per file)')
+    parser.add_argument('--startup-profile', action='store_true', help='Log the import time, the device setup time and the time to the first regulated limit')
+    parser.add_argument('--record', metavar='CASSETTE', help='Append every device request and response with its duration to this compressed file (e.g. site.cassette.gz)')
+    parser.add_argument('--replay', metavar='CASSETTE', help='Serve the device responses recorded with --record instead of accessing the devices')
+    parser.add_argument('--replay-fast', action='store_true', help='Serve the recorded responses at once instead of with their recorded duration')
+    parser.add_argument('--tune', nargs='+', metavar='TRACE', help='Evaluate the regulation settings on traces recorded with TRACE_FILE and write the best ones to --tune-output, then exit')
+    parser.add_argument('--tune-output', help='Config override written by --tune (default: <config file name>_tuned.ini next to the config file)')
+    parser.add_argument('--tune-delay', type=float, default=3, help='Seconds from sending a limit until the simulated inverters produce it (default: 3)')
+    parser.add_argument('--tune-weights', type=float, nargs=3, default=[1, 1, 0.05], metavar=('IMPORT', 'EXPORT', 'COMMAND'), help='Score of a combination: weight per imported Wh, per exported Wh and per limit command (default: 1 1 0.05)')
+    args = parser.parse_args()
+    STARTUP_PROFILE = args.startup_profile
 
+    ENABLE_LOG_TO_FILE = False
+    LOG_BACKUP_COUNT = 30
+    STATUS_API_PORT = 0
+    STATUS_API_BIND = '127.0.0.1'
+    HTTP_TRANSPORT_NAME = 'requests'
+    WATCHDOG_PHASE_BUDGET_IN_SECONDS = 30
+
+    CONFIG_FILES = [[BASE_CONFIG]]
+    if args.config:
+        CONFIG_FILES = [[BASE_CONFIG, configFile] for configFile in args.config]
+
+    try:
+        config = ConfigParser()
+        config.read(CONFIG_FILES[0])
+        HTTP_TRANSPORT_NAME = config.get('COMMON', 'HTTP_TRANSPORT', fallback = HTTP_TRANSPORT_NAME)
+        ENABLE_LOG_TO_FILE = config.getboolean('COMMON', 'ENABLE_LOG_TO_FILE', fallback = ENABLE_LOG_TO_FILE)
+        LOG_BACKUP_COUNT = config.getint('COMMON', 'LOG_BACKUP_COUNT', fallback = LOG_BACKUP_COUNT)
+        STATUS_API_PORT = config.getint('COMMON', 'STATUS_API_PORT', fallback = STATUS_API_PORT)
+        STATUS_API_BIND = config.get('COMMON', 'STATUS_API_BIND', fallback = STATUS_API_BIND)
+        WATCHDOG_PHASE_BUDGET_IN_SECONDS = config.getint('COMMON', 'WATCHDOG_PHASE_BUDGET_IN_SECONDS', fallback = WATCHDOG_PHASE_BUDGET_IN_SECONDS)
     except Exception as e:
+        logger.info('Error on reading ENABLE_LOG_TO_FILE, set it to DISABLED')
+        ENABLE_LOG_TO_FILE = False
         if hasattr(e, 'message'):
             logger.error(e.message)
         else:
             logger.error(e)
-        time.sleep(LOOP_INTERVAL_IN_SECONDS)
+
+    if len(CONFIG_FILES) > 1:
+        # several sites log into the same output, prefix every line with the site (thread) name
+        for handler in logger.handlers:
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s [%(threadName)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+
+    if ENABLE_LOG_TO_FILE:
+        if not os.path.exists(Path.joinpath(Path(__file__).parent.resolve(), 'log')):
+            os.makedirs(Path.joinpath(Path(__file__).parent.resolve(), 'log'))
+
+        rotating_file_handler = TimedRotatingFileHandler(
+            filename=Path.joinpath(Path.joinpath(Path(__file__).parent.resolve(), 'log'),'log'),
+            when='midnight',
+            interval=2,
+            backupCount=LOG_BACKUP_COUNT)
+
+        formatter = logging.Formatter(
+            '%(asctime)s %(levelname)-8s %(message)s')
+        if len(CONFIG_FILES) > 1:
+            formatter = logging.Formatter(
+                '%(asctime)s %(levelname)-8s [%(threadName)s] %(message)s')
+        rotating_file_handler.setFormatter(formatter)
+        logger.addHandler(rotating_file_handler)
+
+    logger.info('Log write to file: %s', ENABLE_LOG_TO_FILE)
+    logger.info('Python Version: ' + sys.version)
+    try:
+        assert sys.version_info >= (3,6)
+    except:
+        logger.info('Error: your Python version is too old, this script requires version 3.6 or newer. Please update your Python.')
+        sys.exit()
+
+    logger.info("Author: %s / Script Version: %s",__author__, __version__)
+
+    # the HTTP client (requests or http.client) is imported here: the startup profile reports it separately from the module imports
+    TransportStart = time.perf_counter()
+    try:
+        HTTP_TRANSPORT = CreateHttpTransport(HTTP_TRANSPORT_NAME)
+    except Exception as e:
+        logger.error('HTTP transport "%s" is not available, using requests: %s', HTTP_TRANSPORT_NAME, e)
+        HTTP_TRANSPORT = CreateHttpTransport('requests')
+    TransportTime = time.perf_counter() - TransportStart
+    logger.info('HTTP transport: %s', HTTP_TRANSPORT.__class__.__name__)
+    if args.record or args.replay:
+        CASSETTE = Cassette(args.replay or args.record, bool(args.replay), args.replay_fast)
+        HTTP_TRANSPORT = CassetteTransport(HTTP_TRANSPORT, CASSETTE)
+        if args.record:
+            logger.info('Recording all device responses to %s', args.record)
+            # systemctl stop sends SIGTERM: end like Ctrl+C, so the gzip member of this run is closed and later runs can append
+            import signal
+            def OnTerminate(pSignal, pFrame):
+                raise KeyboardInterrupt()
+            signal.signal(signal.SIGTERM, OnTerminate)
+
+    if args.tune:
+        TuneOutput = args.tune_output or str(Path.joinpath(Path(CONFIG_FILES[0][-1]).parent.resolve(), Path(CONFIG_FILES[0][-1]).stem + '_tuned.ini'))
+        RunTuner(CONFIG_FILES[0], args.tune, TuneOutput, args.tune_delay, args.tune_weights)
+        sys.exit()
+
+    CONTROLLERS = []
+    SetupStart = time.perf_counter()
+    for configFiles in CONFIG_FILES:
+        CONTROLLERS.append(Controller(configFiles, Path(configFiles[-1]).stem))
+    if STARTUP_PROFILE:
+        logger.info('Startup profile: imports %.3f s, HTTP transport %.3f s, config and device setup %.3f s', IMPORT_TIME, TransportTime, time.perf_counter() - SetupStart)
+
+    if STATUS_API_PORT > 0:
+        StartStatusServer(CONTROLLERS, STATUS_API_BIND, STATUS_API_PORT)
+
+    WATCHDOG.Start(WATCHDOG_PHASE_BUDGET_IN_SECONDS)
+    if WATCHDOG.ping_interval > 0:
+        logger.info('systemd watchdog: ping every %s s while all regulation loops make progress', WATCHDOG.ping_interval)
+
+    # every controller blocks one worker with its regulation loop, the remaining workers are shared for parallel device I/O:
+    # per inverter one limit command and one parallel request, per controller one parallel meter read
+    WORKER_POOL = ThreadPoolExecutor(max_workers = sum(controller.INVERTER_COUNT * 2 + 2 for controller in CONTROLLERS) + 4, thread_name_prefix = 'worker')
+    futures = [WORKER_POOL.submit(controller.Run) for controller in CONTROLLERS]
+    try:
+        for future in futures:
+            try:
+                future.result()
+            except (Exception, SystemExit) as e:
+                logger.error(e)
+        if CASSETTE is not None:
+            CASSETTE.Close()
+    except KeyboardInterrupt:
+        # the regulation loops never return, don't wait for the workers on exit
+        if CASSETTE is not None:
+            CASSETTE.Close()
+        os._exit(0)
@@ -35,7 +35,10 @@ cat << EOF | tee /etc/systemd/system/HoymilesZeroExport.service
 Description=HoymilesZeroExport Service
 After=multi-user.target
 [Service]
-Type=simple
+Type=notify
+NotifyAccess=main
+WatchdogSec=120
+TimeoutStartSec=300
 Restart=always
 ExecStart=/usr/bin/python3 ${SCRIPT_DIR}/HoymilesZeroExport.py -c ${SCRIPT_DIR}/HoymilesZeroExport_Config_Override.ini
 [Install]